@@ -0,0 +1,213 @@
+import os
+import queue
+import threading
+
+from detection_cache import DetectionCache
+from drop_analysis import DropAnalysis
+from recording_cache import load_recording
+from time_index import TimeIndex
+from time_finder import TimeFinder
+
+
+POLL_INTERVAL_S = 0.1
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job when the operator cancels it."""
+
+
+class AnalysisJob:
+    """One recording to analyse, with the options read from the GUI when it was queued."""
+
+    def __init__(self, file_path, output_dir="data_out", time_col="Time", temp_col="Temp", window_before=30,
+                 window_after=30, std_threshold=2, force_basal_computation=False, save_plots=True,
+                 plot_orig=False, plot_after=False, user_confirmation=True, bidirectional=False):
+        self.file_path = file_path
+        self.dataname = os.path.basename(file_path)
+        self.output_dir = output_dir
+        self.time_col = time_col
+        self.temp_col = temp_col
+        self.window_before = window_before
+        self.window_after = window_after
+        self.std_threshold = std_threshold
+        self.force_basal_computation = force_basal_computation
+        self.bidirectional = bidirectional
+        self.save_plots = save_plots
+        self.plot_orig = plot_orig
+        self.plot_after = plot_after
+        self.user_confirmation = user_confirmation
+        self.cancel_event = threading.Event()
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+
+class ReviewRequest:
+    """
+    Detected drops and recoveries waiting for the operator.
+
+    The job's thread blocks in `wait` until the GUI calls `accept` with the
+    operator's edits ({"Drop Start": [(action, time), ...], "Recovery": [...]})
+    or the job is cancelled.
+    """
+
+    def __init__(self, job, time_values, temp_values, drop_points, recovery_points, time_index=None):
+        self.job = job
+        self.time_values = time_values
+        self.time_index = time_index if time_index is not None else TimeIndex(time_values)  # Clicks snap to the nearest sample
+        self.temp_values = temp_values
+        self.drop_points = [float(t) for t in drop_points]
+        self.recovery_points = [float(t) for t in recovery_points]
+        self._edits = None
+        self._answered = threading.Event()
+
+    def accept(self, edits):
+        self._edits = edits
+        self._answered.set()
+
+    def wait(self):
+        while not self._answered.wait(POLL_INTERVAL_S):
+            self.job.check_cancelled()
+        return self._edits
+
+
+class JobRunner:
+    """
+    Runs queued analysis jobs one at a time on a background thread.
+
+    The worker never touches Tk: stage progress, review requests, results and
+    errors are put on `events` as (kind, job, payload) tuples, which the GUI
+    drains from its event loop. Kinds are "started", "progress" (a stage
+    description), "review" (a ReviewRequest), "done" (a result dict),
+    "cancelled" and "error" (a message). Cancelling a job stops it at the next
+    stage boundary, during review, or while its plots render.
+    """
+
+    def __init__(self):
+        self.events = queue.Queue()
+        self.current = None
+        self._jobs = queue.Queue()
+        self._queued = []
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    def submit(self, job):
+        with self._lock:
+            self._queued.append(job)
+        self._jobs.put(job)
+
+    def cancel(self, job=None):
+        """Cancels `job` (default: the running one) whether it is running or still queued."""
+        job = job or self.current
+        if job is not None:
+            job.cancel_event.set()
+
+    def cancel_all(self):
+        with self._lock:
+            jobs = list(self._queued)
+        for job in jobs + [self.current]:
+            if job is not None:
+                job.cancel_event.set()
+
+    def _emit(self, kind, job, payload=None):
+        self.events.put((kind, job, payload))
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            with self._lock:
+                self._queued.remove(job)
+            if job.cancel_event.is_set():
+                self._emit("cancelled", job)
+                continue
+
+            self.current = job
+            self._emit("started", job)
+            try:
+                self._emit("done", job, self.run_job(job))
+            except JobCancelled:
+                self._emit("cancelled", job)
+            except Exception as e:
+                self._emit("error", job, f"{type(e).__name__}: {e}")
+            finally:
+                self.current = None
+
+    def run_job(self, job):
+        """Runs drop detection, review and drop analysis for one recording on the calling thread."""
+        self._emit("progress", job, "Loading recording")
+        data = load_recording(job.file_path, time_col=job.time_col)
+        job.check_cancelled()
+
+        self._emit("progress", job, "Detecting drops")
+        tool = TimeFinder(
+            data,
+            dataname=job.dataname,
+            output_dir=job.output_dir,
+            file_path=job.file_path,
+            time_col=job.time_col,
+            temp_col=job.temp_col,
+            detection_cache=DetectionCache(),  # Reuses detected and corrected drops across reruns
+            reviewer=lambda finder: self._review(job, finder),
+            show_plots=False,
+            bidirectional=job.bidirectional
+        )
+        results = tool.run_analysis(plot_orig=job.plot_orig, user_confirmation=job.user_confirmation,
+                                    plot_after=job.plot_after)
+        job.check_cancelled()
+
+        self._emit("progress", job, f"Computing statistics for {results['num_drops']} drops")
+        analysis = DropAnalysis(
+            df=data,
+            drop_times=results["drop_times"],
+            recovery_times=results["recovery_times"],
+            dataname=job.dataname,
+            time_col=job.time_col,
+            temp_col=job.temp_col,
+            window_before=job.window_before,
+            window_after=job.window_after,
+            std_threshold=job.std_threshold,
+            save_plots=job.save_plots,
+            output_dir=job.output_dir,
+            force_basal_computation=job.force_basal_computation,
+            plot_workers=None,  # Render on a pool of one process per CPU, off the GUI process
+            polarity=tool.polarity
+        )
+        try:
+            analysis.analyze_drops(wait_for_plots=False)
+            if job.save_plots:
+                self._wait_for_plots(job, analysis)
+        except BaseException:
+            if analysis.plot_renderer is not None:
+                analysis.plot_renderer.cancel()  # Don't leave worker processes rendering plots of a failed job
+            raise
+
+        return {
+            "num_drops": results["num_drops"],
+            "drop_times": results["drop_times"],
+            "recovery_times": results["recovery_times"],
+            "recovery_failures": sum(analysis.recovery_failures),
+            "time_values": data[job.time_col].to_numpy(dtype=float),
+            "temp_values": data[job.temp_col].to_numpy(dtype=float),
+        }
+
+    def _review(self, job, finder):
+        request = ReviewRequest(job, finder.df[finder.time_col].to_numpy(dtype=float),
+                                finder.df[finder.temp_col].to_numpy(dtype=float),
+                                finder.drop_points, finder.recovery_points, finder.time_index)
+        self._emit("progress", job, "Waiting for drop review")
+        self._emit("review", job, request)
+        return request.wait()
+
+    def _wait_for_plots(self, job, analysis):
+        renderer = analysis.plot_renderer
+        total = renderer.pending() if renderer is not None else 0
+        done = None
+        while renderer is not None and renderer.pending():
+            job.check_cancelled()
+            if total - renderer.pending() != done:
+                done = total - renderer.pending()
+                self._emit("progress", job, f"Rendering plots ({done}/{total})")
+            job.cancel_event.wait(POLL_INTERVAL_S)
+        analysis.wait_for_plots()
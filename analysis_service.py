@@ -0,0 +1,399 @@
+import argparse
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from batch_analysis import params_hash, process_recording, resolve_params
+from columnar import read_frame
+from recording_cache import file_hash
+
+
+DEFAULT_HOST = "127.0.0.1"  # Local only: the service has no authentication
+DEFAULT_PORT = 8765
+DEFAULT_DATA_DIR = "service_data"
+MAX_PENDING = 32  # Queued and running jobs accepted before new submissions get 503
+SUMMARY_NAME = "job_summary.json"
+UPLOAD_CHUNK = 1 << 20
+
+
+class ServiceBusy(Exception):
+    """Raised when a submission would exceed the service's pending job limit."""
+
+
+class AnalysisService:
+    """
+    Runs TimeFinder and DropAnalysis jobs for HTTP clients on one shared process pool.
+
+    A job is keyed by the recording's content hash and its full parameter set;
+    its outputs live in `<data_dir>/results/<key>/`. Submitting a key that is
+    already finished (in this session or an earlier one) returns the finished job
+    at once, and submitting one that is still running returns the running job.
+    At most `workers` recordings are analysed at a time and at most `max_pending`
+    jobs wait or run; failed jobs are not cached, so they can be resubmitted.
+    """
+
+    def __init__(self, data_dir=DEFAULT_DATA_DIR, workers=None, max_pending=MAX_PENDING, cache_dir=None, use_cache=True):
+        self.data_dir = os.path.abspath(data_dir)
+        self.results_dir = os.path.join(self.data_dir, "results")
+        self.uploads_dir = os.path.join(self.data_dir, "uploads")
+        os.makedirs(self.results_dir, exist_ok=True)
+        os.makedirs(self.uploads_dir, exist_ok=True)
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.cache_dir = cache_dir
+        self.use_cache = use_cache
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._lock = threading.Lock()
+        self._jobs = {}  # {job id: job dict}
+        self._by_key = {}  # {result key: job id} of finished and running jobs
+
+    # **Submission**
+
+    def submit(self, csv_path, user_params=None):
+        """
+        Queues the analysis of `csv_path` with `user_params` (on top of the batch
+        defaults) and returns the job as a dict; ValueError for bad input, ServiceBusy when full.
+        """
+        if not os.path.isfile(csv_path) or not csv_path.lower().endswith(".csv"):
+            raise ValueError(f"Not a CSV file: {csv_path}")
+        params = resolve_params(user_params, source="the request")
+        key = f"{file_hash(csv_path)}_{params_hash(params)}"
+
+        with self._lock:
+            existing = self._jobs.get(self._by_key.get(key))
+            if existing is not None:
+                return self._view(existing)
+
+            output_dir = os.path.join(self.results_dir, key)
+            job = {"id": uuid.uuid4().hex[:12], "key": key, "name": os.path.basename(csv_path)[:-4], "file": csv_path,
+                   "params": params, "output_dir": output_dir, "submitted": time.time(), "finished": None,
+                   "cached": False, "summary": None, "future": None}
+            cached = self._read_summary(output_dir)
+            if cached is not None and cached["status"] == "ok":
+                job.update(cached=True, summary=cached, finished=job["submitted"])
+            else:
+                if self._pending() >= self.max_pending:
+                    raise ServiceBusy(f"{self.max_pending} jobs are already pending.")
+                shutil.rmtree(output_dir, ignore_errors=True)  # Leftovers of a failed or interrupted run
+                job["future"] = self._pool.submit(process_recording, csv_path, output_dir, params,
+                                                  self.cache_dir, self.use_cache)
+            self._jobs[job["id"]] = job
+            self._by_key[key] = job["id"]
+        if job["future"] is not None:
+            job["future"].add_done_callback(lambda future, job_id=job["id"]: self._finish(job_id, future))
+        return self._view(job)
+
+    def store_upload(self, name, stream, length):
+        """Saves `length` bytes of an uploaded CSV from `stream` under its content hash and returns the file path."""
+        name = os.path.basename(name or "")
+        if not name.lower().endswith(".csv"):
+            raise ValueError("Uploads need a 'name' ending in .csv.")
+        tmp_path = os.path.join(self.uploads_dir, f"{uuid.uuid4().hex}.tmp")
+        digest = hashlib.blake2b(digest_size=16)  # Same hash as recording_cache.file_hash
+        with open(tmp_path, "wb") as f:
+            remaining = length
+            while remaining > 0:
+                chunk = stream.read(min(UPLOAD_CHUNK, remaining))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+                remaining -= len(chunk)
+        if remaining > 0:
+            os.remove(tmp_path)
+            raise ValueError("Upload ended before Content-Length bytes were received.")
+        folder = os.path.join(self.uploads_dir, digest.hexdigest())
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, name)
+        os.replace(tmp_path, path)
+        return path
+
+    # **Job state**
+
+    def job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._view(job) if job is not None else None
+
+    def jobs(self):
+        with self._lock:
+            return [self._view(job) for job in sorted(self._jobs.values(), key=lambda job: job["submitted"])]
+
+    def job_files(self, job_id):
+        """Output files of a finished job as paths relative to its output folder, or None if the job is unknown or not done."""
+        job = self.job(job_id)
+        if job is None or job["status"] not in ("done", "error"):
+            return None
+        folder = self._jobs[job_id]["output_dir"]
+        files = []
+        for root, _, names in os.walk(folder):
+            files += [os.path.relpath(os.path.join(root, name), folder).replace(os.sep, "/") for name in names
+                      if name != SUMMARY_NAME]
+        return sorted(files)
+
+    def file_path(self, job_id, relative_path):
+        """Absolute path of one output file of a job; None unless it is one of `job_files`."""
+        files = self.job_files(job_id)
+        if files is None or relative_path not in files:
+            return None
+        return os.path.join(self._jobs[job_id]["output_dir"], *relative_path.split("/"))
+
+    def results(self, job_id):
+        """The job's numeric results table (`results_<name>.cncol`) as a DataFrame, or None if it has none."""
+        job = self.job(job_id)
+        if job is None or job["status"] != "done":
+            return None
+        # Outputs are named after the file that produced them, which for a cached
+        # job may have been submitted under another name (job_summary.json records it)
+        name = self._jobs[job_id]["summary"].get("name", job["name"])
+        path = os.path.join(self._jobs[job_id]["output_dir"], name, f"results_{name}.cncol")
+        return read_frame(path, mmap=False) if os.path.exists(path) else None
+
+    def health(self):
+        with self._lock:
+            return {"status": "ok", "workers": self.workers, "pending": self._pending(), "jobs": len(self._jobs)}
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait, cancel_futures=not wait)
+
+    def _finish(self, job_id, future):
+        """Pool callback: records the job's summary and, on success, persists it as the cache entry."""
+        try:
+            summary = future.result()
+        except Exception as e:  # A worker that died (process_recording itself never raises)
+            summary = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+        if summary["status"] == "ok":
+            job = self._jobs[job_id]
+            path = os.path.join(job["output_dir"], SUMMARY_NAME)
+            with open(path + ".tmp", "w") as f:
+                json.dump(summary, f)
+            os.replace(path + ".tmp", path)
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(summary=summary, finished=time.time())
+            if summary["status"] != "ok" and self._by_key.get(job["key"]) == job_id:
+                del self._by_key[job["key"]]
+
+    def _pending(self):
+        return sum(1 for job in self._jobs.values() if job["summary"] is None)
+
+    @staticmethod
+    def _read_summary(output_dir):
+        path = os.path.join(output_dir, SUMMARY_NAME)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def _view(job):
+        """JSON-ready state of a job: queued, running, done or error."""
+        summary = job["summary"]
+        if summary is not None:
+            status = "done" if summary["status"] == "ok" else "error"
+        else:
+            status = "running" if job["future"].running() else "queued"
+        view = {key: job[key] for key in ("id", "name", "file", "params", "submitted", "finished", "cached")}
+        view["status"] = status
+        if summary is not None:
+            view.update({key: summary.get(key) for key in ("num_drops", "recovery_failures", "elapsed_s", "error")})
+            view["output_name"] = summary.get("name", job["name"])
+        return view
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    JSON API of an AnalysisService (`self.server.service`):
+
+    POST /jobs                      {"path": ..., "params": {...}} for a file readable by the service
+    POST /jobs?name=x.csv&params=.. the CSV itself as the request body (params as URL-encoded JSON)
+    GET  /jobs, /jobs/<id>          job state
+    GET  /jobs/<id>/results         numeric results as a list of records
+    GET  /jobs/<id>/files[/<path>]  output file list, or one file (plots, CSVs)
+    GET  /health
+    """
+
+    server_version = "DropAnalysisService/1.0"
+
+    def do_GET(self):
+        service = self.server.service
+        parts = [urllib.parse.unquote(part) for part in urllib.parse.urlsplit(self.path).path.strip("/").split("/")]
+        if parts == ["health"]:
+            return self._send_json(200, service.health())
+        if parts == ["jobs"]:
+            return self._send_json(200, service.jobs())
+        if len(parts) < 2 or parts[0] != "jobs":
+            return self._send_json(404, {"error": "Unknown endpoint."})
+
+        job = service.job(parts[1])
+        if job is None:
+            return self._send_json(404, {"error": f"Unknown job {parts[1]}."})
+        if len(parts) == 2:
+            return self._send_json(200, job)
+        if parts[2:] == ["results"]:
+            results = service.results(parts[1])
+            if results is None:
+                return self._send_json(409, {"error": f"Job {parts[1]} has no results ({job['status']})."})
+            return self._send_bytes(200, results.to_json(orient="records").encode(), "application/json")
+        if parts[2] == "files":
+            if len(parts) == 3:
+                files = service.job_files(parts[1])
+                if files is None:
+                    return self._send_json(409, {"error": f"Job {parts[1]} is {job['status']}."})
+                return self._send_json(200, files)
+            path = service.file_path(parts[1], "/".join(parts[3:]))
+            if path is None:
+                return self._send_json(404, {"error": "No such output file."})
+            with open(path, "rb") as f:
+                return self._send_bytes(200, f.read(), mimetypes.guess_type(path)[0] or "application/octet-stream")
+        return self._send_json(404, {"error": "Unknown endpoint."})
+
+    def do_POST(self):
+        service = self.server.service
+        url = urllib.parse.urlsplit(self.path)
+        if url.path.rstrip("/") != "/jobs":
+            return self._send_json(404, {"error": "Unknown endpoint."})
+        length = int(self.headers.get("Content-Length") or 0)
+        query = urllib.parse.parse_qs(url.query)
+        try:
+            if "name" in query:  # Upload
+                params = json.loads(query["params"][0]) if "params" in query else None
+                csv_path = service.store_upload(query["name"][0], self.rfile, length)
+            else:
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if "path" not in request:
+                    raise ValueError("Submit {'path': ..., 'params': {...}} or upload with ?name=<file>.csv.")
+                csv_path, params = request["path"], request.get("params")
+            if params is not None and not isinstance(params, dict):
+                raise ValueError("'params' must be a JSON object.")
+            job = service.submit(csv_path, params)
+        except ServiceBusy as e:
+            return self._send_json(503, {"error": str(e)}, {"Retry-After": "5"})
+        except (ValueError, OSError) as e:  # json.JSONDecodeError is a ValueError
+            return self._send_json(400, {"error": str(e)})
+        return self._send_json(200 if job["status"] in ("done", "error") else 202, job)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, code, payload, headers=None):
+        self._send_bytes(code, json.dumps(payload).encode(), "application/json", headers)
+
+    def _send_bytes(self, code, body, content_type, headers=None):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, verbose=False):
+    """HTTP server for `service`; port 0 picks a free port (see `server.server_address`)."""
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.verbose = verbose
+    return server
+
+
+class AnalysisClient:
+    """Minimal client of the service's HTTP API, using only the standard library."""
+
+    def __init__(self, url=f"http://{DEFAULT_HOST}:{DEFAULT_PORT}", timeout=30):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def submit(self, csv_path, params=None, upload=False):
+        """Submits a recording by path (the service must be able to read it) or, with `upload`, by sending the file."""
+        if upload:
+            query = {"name": os.path.basename(csv_path)}
+            if params:
+                query["params"] = json.dumps(params)
+            with open(csv_path, "rb") as f:
+                return self._request("POST", f"/jobs?{urllib.parse.urlencode(query)}", f.read(), "text/csv")
+        body = json.dumps({"path": os.path.abspath(csv_path), "params": params or {}}).encode()
+        return self._request("POST", "/jobs", body, "application/json")
+
+    def status(self, job_id):
+        return self._request("GET", f"/jobs/{job_id}")
+
+    def wait(self, job_id, poll_interval=0.2, timeout=None):
+        """Polls until the job is done or failed and returns its final state."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.status(job_id)
+            if job["status"] in ("done", "error"):
+                return job
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Job {job_id} is still {job['status']}.")
+            time.sleep(poll_interval)
+
+    def results(self, job_id):
+        return self._request("GET", f"/jobs/{job_id}/results")
+
+    def files(self, job_id):
+        return self._request("GET", f"/jobs/{job_id}/files")
+
+    def fetch(self, job_id, relative_path):
+        """Raw bytes of one output file (e.g. a plot)."""
+        return self._request("GET", f"/jobs/{job_id}/files/{urllib.parse.quote(relative_path)}", raw=True)
+
+    def _request(self, method, path, body=None, content_type=None, raw=False):
+        request = urllib.request.Request(self.url + path, data=body, method=method)
+        if content_type:
+            request.add_header("Content-Type", content_type)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                data = response.read()
+        except urllib.error.HTTPError as e:
+            message = e.read().decode(errors="replace")
+            try:
+                message = json.loads(message)["error"]
+            except (ValueError, KeyError):
+                pass
+            raise RuntimeError(f"{method} {path} failed ({e.code}): {message}") from None
+        return data if raw else json.loads(data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve drop detection and drop analysis over a local HTTP API.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Address to listen on (default: localhost only).")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on.")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="Folder for uploads and cached results.")
+    parser.add_argument("--workers", type=int, default=None, help="Recordings analysed at the same time (default: CPU count).")
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING, help="Queued and running jobs accepted before rejecting new ones.")
+    parser.add_argument("--cache-dir", default=None, help="Folder for the parsed-recording cache (default: ~/.cache/corneal_nerve).")
+    parser.add_argument("--no-cache", action="store_true", help="Always parse and detect from scratch instead of using the recording and detection caches.")
+    parser.add_argument("--verbose", action="store_true", help="Log every request.")
+    args = parser.parse_args(argv)
+
+    service = AnalysisService(args.data_dir, workers=args.workers, max_pending=args.max_pending,
+                              cache_dir=args.cache_dir, use_cache=not args.no_cache)
+    server = make_server(service, args.host, args.port, verbose=args.verbose)
+    host, port = server.server_address[:2]
+    print(f"Serving on http://{host}:{port} with {service.workers} workers (results in {service.data_dir}).")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown(wait=False)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,226 @@
+import matplotlib
+matplotlib.use("Agg")  # Headless: batch runs never open plot windows
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from time_finder import TimeFinder
+from drop_analysis import DropAnalysis
+from recording_cache import load_recording
+from detection_cache import DetectionCache
+from instrumentation import collect_profiles, get_profiler
+
+
+# Parameters understood in the parameter file, with their defaults
+TIME_FINDER_PARAMS = {
+    "detect_hot_points": False,
+    "neighbor_threshold": 5,
+    "preced_window": 30,
+    "drop_factor": 1.5,
+    "deriv_thresh": 1,
+    "bidirectional": False,
+}
+DROP_ANALYSIS_PARAMS = {
+    "window_before": 30,
+    "window_after": 30,
+    "std_threshold": 2,
+    "save_plots": True,
+    "save_csv": True,
+    "force_basal_computation": False,
+}
+SHARED_PARAMS = {
+    "time_col": "Time",
+    "temp_col": "Temp",
+}
+
+MANIFEST_NAME = "batch_manifest.csv"
+PROFILE_SUMMARY_NAME = "batch_profile.csv"
+MANIFEST_COLUMNS = ["file", "name", "status", "num_drops", "recovery_failures", "elapsed_s", "params_hash", "error"]
+
+
+def resolve_params(user_params=None, source="parameters"):
+    """Puts `user_params` on top of the defaults and rejects unknown keys (`source` names them in the error)."""
+    params = {**SHARED_PARAMS, **TIME_FINDER_PARAMS, **DROP_ANALYSIS_PARAMS}
+    if user_params:
+        unknown = set(user_params) - set(params)
+        if unknown:
+            raise ValueError(f"Unknown parameters in {source}: {', '.join(sorted(unknown))}")
+        params.update(user_params)
+    return params
+
+
+def load_params(params_path=None):
+    """Loads a JSON parameter file on top of the defaults and rejects unknown keys."""
+    if not params_path:
+        return resolve_params()
+    with open(params_path) as f:
+        return resolve_params(json.load(f), source=params_path)
+
+
+def params_hash(params):
+    """Short stable hash of a parameter set, stored in the manifest to detect stale outputs."""
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def collect_inputs(inputs):
+    """Expands directories and glob patterns into a sorted, de-duplicated list of CSV files."""
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            files.extend(glob.glob(os.path.join(item, "*.csv")))
+        elif any(ch in item for ch in "*?["):
+            files.extend(glob.glob(item, recursive=True))
+        else:
+            files.append(item)
+    return sorted({os.path.abspath(f) for f in files if f.lower().endswith(".csv")})
+
+
+def output_paths(csv_path, output_dir, save_csv=True):
+    """Numeric results table and (with `save_csv`) result and failure CSV paths written by DropAnalysis for a recording."""
+    name = os.path.basename(csv_path)[:-4]
+    folder = os.path.join(output_dir, name)
+    paths = [os.path.join(folder, f"results_{name}.cncol")]
+    if save_csv:
+        paths += [os.path.join(folder, f"analyzed_{name}.csv"), os.path.join(folder, f"failure_{name}.csv")]
+    return paths
+
+
+def is_complete(csv_path, output_dir, manifest_row, current_hash, save_csv=True):
+    """A recording is complete if the manifest recorded a successful run with the same parameters and its outputs exist."""
+    if manifest_row is None or manifest_row.get("status") != "ok" or manifest_row.get("params_hash") != current_hash:
+        return False
+    return all(os.path.exists(path) and os.path.getsize(path) > 0 for path in output_paths(csv_path, output_dir, save_csv))
+
+
+def process_recording(csv_path, output_dir, params, cache_dir=None, use_cache=True, profile=False):
+    """Runs non-interactive drop detection and drop analysis on one recording; never raises."""
+    dataname = os.path.basename(csv_path)
+    summary = {"file": csv_path, "name": dataname[:-4], "status": "ok", "num_drops": 0,
+               "recovery_failures": 0, "elapsed_s": 0.0, "params_hash": params_hash(params), "error": ""}
+    start = time.perf_counter()
+    profiler = get_profiler()
+    if profile:
+        profiler.enable()
+    profiler.reset()  # Stages of an earlier recording in this worker never leak into this report
+
+    try:
+        with profiler.stage("load_recording"):
+            data = load_recording(csv_path, time_col=params["time_col"], cache_dir=cache_dir, use_cache=use_cache)
+
+        tool = TimeFinder(
+            data,
+            dataname=dataname,
+            output_dir=output_dir,
+            file_path=csv_path,
+            detection_cache=DetectionCache(cache_dir) if use_cache else None,
+            **{key: params[key] for key in SHARED_PARAMS},
+            **{key: params[key] for key in TIME_FINDER_PARAMS}
+        )
+        results = tool.run_analysis(plot_orig=False, user_confirmation=False, plot_after=False)
+
+        analysis = DropAnalysis(
+            df=data,
+            drop_times=results["drop_times"],
+            recovery_times=results["recovery_times"],
+            dataname=dataname,
+            output_dir=output_dir,
+            plot_workers=0,  # Recordings already run in parallel; render each one's plots in its own worker
+            polarity=tool.polarity,
+            **{key: params[key] for key in SHARED_PARAMS},
+            **{key: params[key] for key in DROP_ANALYSIS_PARAMS}
+        )
+        analysis.analyze_drops()
+
+        summary["num_drops"] = results["num_drops"]
+        summary["recovery_failures"] = sum(analysis.recovery_failures)
+    except Exception as e:
+        summary["status"] = "error"
+        summary["error"] = f"{type(e).__name__}: {e}\n{traceback.format_exc()}"
+
+    summary["elapsed_s"] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+def read_manifest(output_dir):
+    """Returns the previous manifest as {file: row}, or an empty dict."""
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    manifest = pd.read_csv(path, dtype={"params_hash": str}, keep_default_na=False)
+    return {row["file"]: row for row in manifest.to_dict("records")}
+
+
+def write_manifest(output_dir, rows):
+    """Writes the manifest atomically so an interrupted batch can always be resumed."""
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    pd.DataFrame(sorted(rows.values(), key=lambda row: row["file"]), columns=MANIFEST_COLUMNS).to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def run_batch(inputs, output_dir="data_out", params_path=None, workers=None, resume=True, cache_dir=None, use_cache=True,
+              profile=False):
+    """
+    Processes every recording matched by `inputs` on a process pool.
+
+    Each file runs in isolation: a failure is recorded in the manifest and does
+    not stop the batch. With `resume`, files whose outputs are already complete
+    for the same parameters are skipped. Parsed recordings and detected drops are
+    shared with later runs through the recording and detection caches unless
+    `use_cache` is False. With `profile`, each recording gets a stage report and
+    all reports are combined into `batch_profile.csv`.
+    """
+    params = load_params(params_path)
+    current_hash = params_hash(params)
+    os.makedirs(output_dir, exist_ok=True)
+
+    files = collect_inputs(inputs)
+    manifest = read_manifest(output_dir)
+    todo = [f for f in files if not (resume and is_complete(f, output_dir, manifest.get(f), current_hash, params["save_csv"]))]
+    print(f"{len(files)} recordings found, {len(files) - len(todo)} already complete, {len(todo)} to process.")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process_recording, f, output_dir, params, cache_dir, use_cache, profile): f for f in todo}
+        for future in as_completed(futures):
+            summary = future.result()
+            manifest[summary["file"]] = summary
+            write_manifest(output_dir, manifest)
+            message = f"{summary['num_drops']} drops" if summary["status"] == "ok" else summary["error"].splitlines()[0]
+            print(f"[{summary['status']}] {summary['name']} ({summary['elapsed_s']}s): {message}")
+
+    if profile:
+        collect_profiles(output_dir).to_csv(os.path.join(output_dir, PROFILE_SUMMARY_NAME), index=False)
+    return [manifest[f] for f in files]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run drop detection and drop analysis on many recordings in parallel.")
+    parser.add_argument("inputs", nargs="+", help="CSV files, directories of CSV files, or glob patterns.")
+    parser.add_argument("--params", default=None, help="JSON file with detection and analysis parameters.")
+    parser.add_argument("--output-dir", default="data_out", help="Folder for results, plots and the batch manifest.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count).")
+    parser.add_argument("--no-resume", action="store_true", help="Reprocess recordings even if their outputs are complete.")
+    parser.add_argument("--cache-dir", default=None, help="Folder for the parsed-recording cache (default: ~/.cache/corneal_nerve).")
+    parser.add_argument("--profile", action="store_true", help="Record per-stage timing and memory for every recording (also enabled by CORNEAL_NERVE_PROFILE=1).")
+    parser.add_argument("--no-cache", action="store_true", help="Always parse and detect from scratch instead of using the recording and detection caches.")
+    args = parser.parse_args(argv)
+
+    summaries = run_batch(args.inputs, output_dir=args.output_dir, params_path=args.params,
+                          workers=args.workers, resume=not args.no_resume,
+                          cache_dir=args.cache_dir, use_cache=not args.no_cache,
+                          profile=args.profile or get_profiler().enabled)
+    failed = [s for s in summaries if s["status"] != "ok"]
+    print(f"Done: {len(summaries) - len(failed)} succeeded, {len(failed)} failed.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,165 @@
+import matplotlib
+matplotlib.use("Agg")  # Benchmarks never open plot windows
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from time_finder import TimeFinder
+from drop_analysis import DropAnalysis
+from recording_cache import read_recording_csv
+from synthetic_data import write_recording
+
+
+# Recording sizes to benchmark; "large" matches a multi-hour, 500-unit rig recording
+SCALES = {
+    "small": {"duration": 3600, "sampling_rate": 1, "n_units": 12, "n_drops": 8},
+    "medium": {"duration": 3600, "sampling_rate": 10, "n_units": 100, "n_drops": 20},
+    "large": {"duration": 3 * 3600, "sampling_rate": 10, "n_units": 500, "n_drops": 40},
+}
+DEFAULT_SCALES = ["small", "medium"]
+BENCHMARKS = ["csv_ingest", "detect_drops", "analyze_drops", "analyze_drops_plots"]
+DEFAULT_BASELINE = "benchmark_baseline.json"
+MIN_CHANGE = {"time_s": 0.01, "peak_mb": 1.0}  # Ignore differences below timer / allocator noise
+
+
+def bench_csv_ingest(csv_path, df, work_dir):
+    read_recording_csv(csv_path)
+
+
+def bench_detect_drops(csv_path, df, work_dir):
+    TimeFinder(df, dataname="bench.csv", output_dir=work_dir, file_path=csv_path).detect_drops(False, False)
+
+
+def _analyze(df, work_dir, save_plots):
+    tool = TimeFinder(df, dataname="bench.csv", output_dir=work_dir, file_path="bench.csv")
+    tool.detect_drops(False, False)
+    # Plots render in this process, so the timing and tracemalloc peak include them
+    analysis = DropAnalysis(df, tool.drop_points, tool.recovery_points, dataname="bench.csv",
+                            output_dir=work_dir, save_plots=save_plots, plot_workers=0)
+    analysis.analyze_drops()
+
+
+def bench_analyze_drops(csv_path, df, work_dir):
+    _analyze(df, work_dir, save_plots=False)
+
+
+def bench_analyze_drops_plots(csv_path, df, work_dir):
+    _analyze(df, work_dir, save_plots=True)
+
+
+def measure(fn, repeats=3):
+    """
+    Runs `fn` `repeats` times for the best wall time, then once more under
+    tracemalloc for the peak Python/NumPy allocation (the traced run is not timed).
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"time_s": round(min(times), 4), "peak_mb": round(peak / 1024 ** 2, 2)}
+
+
+def run_benchmarks(scales=None, benchmarks=None, repeats=3, seed=0):
+    """Times and memory-profiles every benchmark at every scale; returns {"scale/benchmark": result}."""
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for scale in scales or DEFAULT_SCALES:
+            csv_path = os.path.join(work_dir, f"{scale}.csv")
+            write_recording(csv_path, seed=seed, **SCALES[scale])
+            df = read_recording_csv(csv_path)
+            print(f"{scale}: {len(df)} samples, {len(df.columns)} columns")
+
+            for name in benchmarks or BENCHMARKS:
+                bench = globals()[f"bench_{name}"]
+                with contextlib.redirect_stdout(io.StringIO()):  # Silence per-drop progress output
+                    result = measure(lambda: bench(csv_path, df, work_dir), repeats=repeats)
+                results[f"{scale}/{name}"] = result
+                print(f"  {name:<22} {result['time_s']:>9.3f} s {result['peak_mb']:>9.1f} MB")
+    return results
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Returns the benchmarks that are slower or use more memory than the baseline
+    by more than `tolerance` (a fraction) and more than `MIN_CHANGE`, as
+    (key, metric, baseline, current) tuples.
+    """
+    regressions = []
+    for key, current in results.items():
+        if key not in baseline:
+            continue
+        for metric in ("time_s", "peak_mb"):
+            reference = baseline[key][metric]
+            if current[metric] > reference * (1 + tolerance) and current[metric] - reference > MIN_CHANGE[metric]:
+                regressions.append((key, metric, reference, current[metric]))
+    return regressions
+
+
+def environment():
+    return {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+            "machine": platform.machine(), "processor": platform.processor(), "cpus": os.cpu_count()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark CSV ingest, drop detection and drop analysis on synthetic recordings.")
+    parser.add_argument("--scales", nargs="+", default=DEFAULT_SCALES, choices=list(SCALES), help="Recording sizes to benchmark.")
+    parser.add_argument("--benchmarks", nargs="+", default=BENCHMARKS, choices=BENCHMARKS, help="Benchmarks to run.")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per benchmark (the best is kept).")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file to compare against.")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown / memory growth before flagging a regression.")
+    parser.add_argument("--output", default=None, help="Also write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.scales, args.benchmarks, repeats=args.repeats)
+    report = {"environment": environment(), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)["results"]
+        report["results"] = {**baseline, **results}
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one.")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("environment") != report["environment"]:
+        print("Warning: the baseline was recorded on a different environment.")
+
+    regressions = compare(results, baseline["results"], args.tolerance)
+    for key, metric, reference, current in regressions:
+        print(f"REGRESSION {key} {metric}: {reference} -> {current}")
+    print(f"{len(regressions)} regression(s) against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,125 @@
+from collections import Counter
+
+import numpy as np
+
+
+FREQUENCY_PREFIX = "f-"
+FREQUENCY_DTYPE = np.float32
+
+
+class ChannelSchema:
+    """
+    Channel layout of a recording, parsed once from its header.
+
+    Every column other than the time and temperature columns is either a unit's
+    event-count column or the frequency column `f-<unit>` of that unit.
+    Frequency columns are matched to their unit by exact name with one dict
+    lookup per column, so units whose names share a prefix (`U1`, `U11`) are
+    never confused. Frequency columns without a matching unit are reported and ignored.
+    """
+
+    def __init__(self, columns, time_col="Time", temp_col="Temp"):
+        columns = [str(col) for col in columns]
+        duplicates = sorted(col for col, count in Counter(columns).items() if count > 1)
+        if duplicates:
+            raise ValueError(f"Duplicate column names in the recording: {', '.join(duplicates)}")
+        if time_col not in columns:
+            raise ValueError(f"Time column '{time_col}' not found in the recording.")
+        if temp_col not in columns:
+            raise ValueError(f"Temperature column '{temp_col}' not found in the recording.")
+
+        self.time_col = time_col
+        self.temp_col = temp_col
+        self.units = [col for col in columns if not col.startswith(FREQUENCY_PREFIX) and col not in (time_col, temp_col)]
+        unit_index = {unit: i for i, unit in enumerate(self.units)}
+
+        frequency_columns = {}
+        self.unmatched_frequency_columns = []
+        for col in columns:
+            if col.startswith(FREQUENCY_PREFIX):
+                unit = col[len(FREQUENCY_PREFIX):]
+                if unit in unit_index:
+                    frequency_columns[unit] = col
+                else:
+                    self.unmatched_frequency_columns.append(col)
+        if self.unmatched_frequency_columns:
+            print(f"Warning: ignoring frequency columns without a matching unit: {', '.join(self.unmatched_frequency_columns)}")
+
+        # {unit: frequency column}, in unit order
+        self.frequency_columns = {unit: frequency_columns[unit] for unit in self.units if unit in frequency_columns}
+        self.frequency_units = list(self.frequency_columns)
+
+    @property
+    def stat_columns(self):
+        """Every event column, then every frequency column: the column order of `ChannelMatrix`."""
+        return self.units + list(self.frequency_columns.values())
+
+
+def compact_count_dtype(columns):
+    """
+    Smallest dtype that holds every event-count column exactly: the smallest
+    (unsigned if possible) integer type, or float32 if any value is missing or fractional.
+    """
+    low, high = 0, 0
+    for values in columns:
+        if len(values) == 0:
+            continue
+        if values.dtype.kind == "f":
+            if np.isnan(values).any() or not np.array_equal(values, np.floor(values)):
+                return np.dtype(np.float32)
+        elif values.dtype.kind not in "iub":
+            return np.dtype(np.float32)
+        low, high = min(low, values.min()), max(high, values.max())
+    if low < 0:
+        # Smallest signed type of both bounds (-high - 1 needs the same signed width as high)
+        return np.result_type(np.min_scalar_type(int(low)), np.min_scalar_type(-int(high) - 1))
+    return np.min_scalar_type(int(high))
+
+
+class ChannelMatrix:
+    """
+    Event counts and frequencies of a recording as two time × channel matrices.
+
+    Each matrix is column-major, so one channel is a contiguous view and
+    statistics can run over all channels at once. Event counts use the smallest
+    type that holds them (`compact_count_dtype`) and frequencies are float32,
+    a fraction of the memory of int64/float64 DataFrame columns.
+    """
+
+    def __init__(self, schema, time, temp, events, frequencies):
+        self.schema = schema
+        self.time = time
+        self.temp = temp
+        self.events = events
+        self.frequencies = frequencies
+        self._index = {unit: (events, j) for j, unit in enumerate(schema.units)}
+        self._index.update({col: (frequencies, j) for j, col in enumerate(schema.frequency_columns.values())})
+
+    @classmethod
+    def from_frame(cls, df, schema=None, time_col="Time", temp_col="Temp"):
+        """Copies a recording DataFrame into compact channel matrices, one column at a time."""
+        schema = schema or ChannelSchema(df.columns, time_col, temp_col)
+        event_columns = [df[unit].to_numpy() for unit in schema.units]
+        events = np.empty((len(df), len(event_columns)), dtype=compact_count_dtype(event_columns), order="F")
+        for j, values in enumerate(event_columns):
+            events[:, j] = values
+
+        frequencies = np.empty((len(df), len(schema.frequency_columns)), dtype=FREQUENCY_DTYPE, order="F")
+        for j, col in enumerate(schema.frequency_columns.values()):
+            frequencies[:, j] = df[col].to_numpy()
+
+        return cls(schema, df[schema.time_col].to_numpy(dtype=float), df[schema.temp_col].to_numpy(dtype=float),
+                   events, frequencies)
+
+    def column(self, name):
+        """One channel (a unit's events or a frequency column, by column name) as a view."""
+        if name == self.schema.time_col:
+            return self.time
+        if name == self.schema.temp_col:
+            return self.temp
+        matrix, j = self._index[name]
+        return matrix[:, j]
+
+    @property
+    def nbytes(self):
+        return self.time.nbytes + self.temp.nbytes + self.events.nbytes + self.frequencies.nbytes
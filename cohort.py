@@ -0,0 +1,282 @@
+import argparse
+import json
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from columnar import read_columns
+from segment_stats import centred_stats
+
+
+RESULTS_PATTERN = re.compile(r"^results_(.+)\.cncol$")
+CSV_RESULTS_PATTERN = re.compile(r"^(?:analyzed|failure)_(.+)\.csv$")
+DEFAULT_BY = ["drop", "window", "metric"]  # Grouped after the metadata columns
+LAYOUT_CACHE = 64  # Recording layouts whose group rows are remembered
+SUMMARY_NAME = "cohort_summary.csv"
+RECORDINGS_NAME = "cohort_recordings.csv"
+
+
+def find_results(output_dir):
+    """
+    Finds the numeric results table of every analysed recording below `output_dir`,
+    as a sorted list of (name, path); `<name>/results_<name>.cncol` is the layout DropAnalysis writes.
+    """
+    found = []
+    for folder, _, files in os.walk(output_dir):
+        for file in files:
+            match = RESULTS_PATTERN.match(file)
+            if match and os.path.basename(folder) == match.group(1):
+                found.append((match.group(1), os.path.join(folder, file)))
+    return sorted(found)
+
+
+def find_csv_only_results(output_dir):
+    """
+    Names of recordings below `output_dir` with result CSVs (`analyzed_<name>.csv` /
+    `failure_<name>.csv`) but no numeric results table, e.g. analysed before
+    `results_<name>.cncol` was written; their formatted CSVs cannot be aggregated.
+    """
+    found = set()
+    for folder, _, files in os.walk(output_dir):
+        name = os.path.basename(folder)
+        if f"results_{name}.cncol" in files:
+            continue
+        for file in files:
+            match = CSV_RESULTS_PATTERN.match(file)
+            if match and match.group(1) == name:
+                found.add(name)
+    return sorted(found)
+
+
+def load_factors(factors_path):
+    """
+    Loads filename factors from a JSON file: {column: [level, ...] or "regex"}.
+
+    A list matches the longest level found in the name as a whole token (not
+    inside a longer word); a regex gives its first group, or the whole match if
+    it has none. Both ignore case.
+    """
+    with open(factors_path) as f:
+        factors = json.load(f)
+    for column, spec in factors.items():
+        if not isinstance(spec, (list, str)):
+            raise ValueError(f"Factor '{column}' must be a list of levels or a regular expression.")
+    return factors
+
+
+def filename_metadata(name, factors):
+    """Metadata of one recording parsed from its name with `factors` (see `load_factors`); unmatched factors are None."""
+    metadata = {}
+    for column, spec in factors.items():
+        value = None
+        if isinstance(spec, str):
+            match = re.search(spec, name, flags=re.IGNORECASE)
+            if match:
+                value = match.group(1) if match.groups() else match.group(0)
+        else:
+            # Longest level first, so "BAK_Day14" wins over "BAK"
+            for level in sorted(spec, key=len, reverse=True):
+                if re.search(rf"(?<![A-Za-z0-9]){re.escape(level)}(?![A-Za-z0-9])", name, flags=re.IGNORECASE):
+                    value = level
+                    break
+        metadata[column] = value
+    return metadata
+
+
+def read_sidecar(path):
+    """
+    Reads a metadata manifest: a CSV with a `recording` column (the recording name,
+    with or without `.csv`) and one column per metadata field. Returns {name: {field: value}}.
+    """
+    sidecar = pd.read_csv(path, dtype=str, keep_default_na=False, encoding="utf-8-sig")
+    if "recording" not in sidecar.columns:
+        raise ValueError(f"Metadata manifest {path} needs a 'recording' column.")
+    names = sidecar.pop("recording").str.replace(r"\.csv$", "", regex=True)
+    return {name: {k: (v if v != "" else None) for k, v in row.items()} for name, row in zip(names, sidecar.to_dict("records"))}
+
+
+class CohortAggregator:
+    """
+    Grouped statistics of the window means of many analysed recordings, one recording at a time.
+
+    Each recording's numeric results are reduced with NumPy to count / sum /
+    sum of squares of its window means per group (metadata columns, then `by`)
+    and added to running totals, so memory grows with the number of groups,
+    not the number of recordings. Empty windows (NaN means) are not counted.
+    """
+
+    def __init__(self, metadata_columns, by=None):
+        self.metadata_columns = list(metadata_columns)
+        self.by = list(by) if by is not None else list(DEFAULT_BY)
+        overlap = set(self.metadata_columns) & set(self.by)
+        if overlap:
+            raise ValueError(f"Metadata columns also used as result columns: {', '.join(sorted(overlap))}")
+        self.recordings = []
+        self._groups = {}  # {group key tuple: row of the running totals}
+        self._layouts = {}  # {(metadata, levels per column): group row of every combined code}
+        self._category_order = {}  # {column: {level: rank}} of categorical columns, in the order first stored
+        self._totals = np.zeros((0, 4))  # count, sum, sum of squares, recordings
+
+    @property
+    def keys(self):
+        return self.metadata_columns + self.by
+
+    def add(self, name, results, metadata):
+        """
+        Adds one recording's numeric results (`DropAnalysis.numeric_results`, as a
+        DataFrame or the {column: array} of `columnar.read_columns`) with its metadata.
+        """
+        missing = [col for col in self.by + ["mean"] if col not in results]
+        if missing:
+            raise ValueError(f"Results of {name} have no column(s): {', '.join(missing)}")
+
+        # **Group codes of the result columns, combined into one code per row**
+        levels, codes = [], []
+        for col in self.by:
+            values = results[col]
+            categorical = True
+            if isinstance(values, tuple):  # (codes, categories) from `read_columns(..., decode=False)`
+                column_codes, column_levels = np.asarray(values[0]), list(values[1])
+            elif isinstance(getattr(values, "dtype", None), pd.CategoricalDtype):
+                categories = pd.Categorical(values)
+                column_codes, column_levels = np.asarray(categories.codes), list(categories.categories)
+            else:
+                column_levels, column_codes = np.unique(np.asarray(values), return_inverse=True)
+                column_levels, categorical = column_levels.tolist(), False
+            if categorical:
+                order = self._category_order.setdefault(col, {})
+                for level in column_levels:
+                    order.setdefault(level, len(order))
+            levels.append(column_levels)
+            codes.append(column_codes)
+        values = np.asarray(results["mean"], dtype=float)
+        shape = [max(len(l), 1) for l in levels]
+        unique, inverse = np.unique(np.ravel_multi_index(codes, shape) if len(values) else np.empty(0, dtype=np.int64),
+                                    return_inverse=True)
+
+        valid = ~np.isnan(values)
+        finite = np.where(valid, values, 0.0)
+        partial = np.column_stack([
+            np.bincount(inverse, weights=valid, minlength=len(unique)),
+            np.bincount(inverse, weights=finite, minlength=len(unique)),
+            np.bincount(inverse, weights=finite * finite, minlength=len(unique)),
+        ])
+        partial = np.column_stack([partial, partial[:, 0] > 0])
+
+        # **Add to the running totals of the same groups**
+        prefix = tuple(metadata.get(col) for col in self.metadata_columns)
+        layout = (prefix, tuple(map(tuple, levels)))
+        rows_by_code = self._layouts.get(layout)
+        if rows_by_code is None:
+            if len(self._layouts) >= LAYOUT_CACHE:
+                self._layouts.clear()
+            rows_by_code = self._layouts[layout] = np.full(int(np.prod(shape)), -1, dtype=np.int64)
+        rows = rows_by_code[unique]
+        new = np.flatnonzero(rows < 0)
+        for g, group in zip(new, np.column_stack(np.unravel_index(unique[new], shape)).tolist()):
+            key = prefix + tuple(levels[c][code] for c, code in enumerate(group))
+            rows[g] = self._groups.setdefault(key, len(self._groups))
+        rows_by_code[unique[new]] = rows[new]
+        if len(self._groups) > len(self._totals):
+            grown = np.zeros((max(len(self._groups), 2 * len(self._totals)), 4))
+            grown[:len(self._totals)] = self._totals
+            self._totals = grown
+        self._totals[rows] += partial
+
+        # **Per-recording row: metadata, drop count and drops without full recovery**
+        drops = np.asarray(results["drop"]) if "drop" in results else np.empty(0)
+        failures = 0
+        if "window" in results and "start" in results and len(drops):
+            window = results["window"]
+            if isinstance(window, tuple):
+                window = np.asarray(window[1], dtype=object)[np.asarray(window[0])]
+            failed = (np.asarray(window) == "during") & np.isnan(np.asarray(results["start"], dtype=float))
+            failures = len(np.unique(drops[failed]))
+        self.recordings.append({"recording": name, **dict(zip(self.metadata_columns, prefix)),
+                                "num_drops": int(drops.max()) if len(drops) else 0, "recovery_failures": failures})
+
+    def summary(self):
+        """One row per group: its keys, n_recordings, n (window means), and their mean, std and sem."""
+        totals = self._totals[:len(self._groups)]
+        summary = pd.DataFrame(list(self._groups), columns=self.keys)
+        for col, order in self._category_order.items():
+            summary[col] = pd.Categorical(summary[col], categories=list(order))  # e.g. basal, during, after
+        count = totals[:, 0].astype(np.int64)
+        mean, std, _ = centred_stats(totals[:, 1], totals[:, 2], count, 0.0)
+        summary["n_recordings"] = totals[:, 3].astype(np.int64)
+        summary["n"] = count
+        summary["mean"] = mean
+        summary["std"] = std
+        with np.errstate(invalid="ignore", divide="ignore"):
+            summary["sem"] = std / np.sqrt(count)
+        return summary.sort_values(self.keys, na_position="last", ignore_index=True) if len(summary) else summary
+
+    def recordings_table(self):
+        return pd.DataFrame(self.recordings, columns=["recording"] + self.metadata_columns + ["num_drops", "recovery_failures"])
+
+
+def aggregate_cohort(output_dir, factors=None, sidecar_path=None, by=None, neuron_level=False):
+    """
+    Aggregates every analysed recording below `output_dir` into grouped summaries.
+    Recordings with only result CSVs (`find_csv_only_results`) are skipped with a warning.
+
+    Metadata comes from the recording names (`factors`, see `load_factors`) and
+    from an optional manifest CSV (`read_sidecar`), whose values take precedence.
+    Results are grouped by the metadata columns, then `by` (default: drop index,
+    window and metric; `neuron_level` adds the neuron). Returns (summary, recordings).
+    """
+    factors = factors or {}
+    sidecar = read_sidecar(sidecar_path) if sidecar_path else {}
+    metadata_columns = list(factors)
+    for fields in sidecar.values():
+        metadata_columns += [col for col in fields if col not in metadata_columns]
+
+    by = list(by) if by is not None else list(DEFAULT_BY)
+    if neuron_level and "neuron" not in by:
+        by.append("neuron")
+    aggregator = CohortAggregator(metadata_columns, by=by)
+
+    found = find_results(output_dir)
+    unmatched = [name for name in sidecar if name not in {n for n, _ in found}]
+    if unmatched:
+        print(f"Warning: {len(unmatched)} recordings in the metadata manifest have no results, e.g. {unmatched[0]}")
+    csv_only = find_csv_only_results(output_dir)
+    if csv_only:
+        print(f"Warning: skipping {len(csv_only)} recordings with result CSVs but no results_<name>.cncol "
+              f"(re-run their analysis to include them), e.g. {csv_only[0]}")
+
+    columns = list(dict.fromkeys(by + ["drop", "window", "mean", "start"]))
+    for name, path in found:
+        metadata = filename_metadata(name, factors)
+        metadata.update(sidecar.get(name, {}))
+        aggregator.add(name, read_columns(path, columns=columns, decode=False)[0], metadata)
+    return aggregator.summary(), aggregator.recordings_table()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Combine the analysed recordings of an output folder into grouped cohort summaries.")
+    parser.add_argument("output_dir", help="Output folder of the GUI or batch_analysis.py (searched recursively).")
+    parser.add_argument("--factors", default=None, help="JSON file mapping metadata columns to filename levels or a regular expression.")
+    parser.add_argument("--metadata", default=None, help="CSV manifest with a 'recording' column and metadata columns (overrides filename factors).")
+    parser.add_argument("--by", nargs="+", default=None, help=f"Result columns to group by after the metadata (default: {' '.join(DEFAULT_BY)}).")
+    parser.add_argument("--neurons", action="store_true", help="Also group by neuron.")
+    parser.add_argument("--save-dir", default=None, help="Folder for the cohort CSVs (default: the output folder).")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    factors = load_factors(args.factors) if args.factors else {}
+    summary, recordings = aggregate_cohort(args.output_dir, factors=factors, sidecar_path=args.metadata,
+                                           by=args.by, neuron_level=args.neurons)
+    save_dir = args.save_dir or args.output_dir
+    os.makedirs(save_dir, exist_ok=True)
+    summary.to_csv(os.path.join(save_dir, SUMMARY_NAME), index=False, encoding="utf-8-sig")
+    recordings.to_csv(os.path.join(save_dir, RECORDINGS_NAME), index=False, encoding="utf-8-sig")
+    print(f"Aggregated {len(recordings)} recordings into {len(summary)} groups in {time.perf_counter() - start:.1f}s.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
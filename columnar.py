@@ -0,0 +1,138 @@
+import json
+import os
+import struct
+import uuid
+
+import numpy as np
+import pandas as pd
+
+
+MAGIC = b"CNCOL01\n"
+ALIGNMENT = 64
+
+
+def write_columns(path, columns, metadata=None):
+    """
+    Writes named 1-D columns to a compact binary columnar file.
+
+    Layout: magic, little-endian uint64 header length, JSON header, then each
+    column's raw little-endian data aligned to 64 bytes so it can be memory-mapped.
+    Numeric and boolean columns keep their dtype; string/object and categorical
+    columns are dictionary-encoded as int32 codes plus a list of categories.
+    The file is written to a temporary name and renamed into place.
+    """
+    entries = []
+    blocks = []
+    n_rows = None
+
+    for name, values in columns.items():
+        entry = {"name": str(name)}
+        if isinstance(values, pd.Categorical) or isinstance(getattr(values, "dtype", None), pd.CategoricalDtype):
+            categorical = pd.Categorical(values)
+            entry["categories"] = [str(c) for c in categorical.categories]
+            data = np.asarray(categorical.codes, dtype="<i4")
+        else:
+            data = np.asarray(values)
+            if data.dtype.kind in "OUS":
+                categorical = pd.Categorical(data)
+                entry["categories"] = [str(c) for c in categorical.categories]
+                data = np.asarray(categorical.codes, dtype="<i4")
+            else:
+                data = data.astype(data.dtype.newbyteorder("<"), copy=False)
+
+        if data.ndim != 1:
+            raise ValueError(f"Column '{name}' must be one-dimensional.")
+        if n_rows is None:
+            n_rows = len(data)
+        elif len(data) != n_rows:
+            raise ValueError(f"Column '{name}' has {len(data)} rows, expected {n_rows}.")
+
+        entry["dtype"] = data.dtype.str
+        entries.append(entry)
+        blocks.append(np.ascontiguousarray(data))
+
+    # **Lay out the data blocks after the header, each aligned for memory-mapping**
+    header = {"n_rows": n_rows or 0, "columns": entries, "metadata": metadata or {}}
+    data_start = 0
+    while True:  # The header stores the offsets, so grow the reserved space until it fits
+        offset = data_start
+        for entry, block in zip(entries, blocks):
+            entry["offset"] = offset
+            offset = _align(offset + block.nbytes)
+        header_bytes = json.dumps(header).encode()
+        needed = _align(len(MAGIC) + 8 + len(header_bytes))
+        if needed <= data_start:
+            break
+        data_start = needed
+
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<Q", len(header_bytes)))
+            f.write(header_bytes)
+            for entry, block in zip(entries, blocks):
+                f.write(b"\0" * (entry["offset"] - f.tell()))
+                f.write(block.tobytes())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def read_header(path):
+    """Returns the JSON header of a columnar file (row count, column layout and metadata)."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a columnar data file.")
+        (header_length,) = struct.unpack("<Q", f.read(8))
+        return json.loads(f.read(header_length))
+
+
+def read_columns(path, columns=None, mmap=True, decode=True):
+    """
+    Reads columns from a columnar file as {name: array} plus the stored metadata.
+
+    Numeric columns are read-only memory maps when `mmap` is True, so loading
+    costs almost nothing until the data is touched. Dictionary-encoded columns
+    are returned as pandas Categoricals, or as (codes, categories) pairs with
+    `decode=False` when many small files are read and only the codes are needed.
+    """
+    header = read_header(path)
+    n_rows = header["n_rows"]
+    wanted = None if columns is None else set(columns)
+    result = {}
+    buffer = np.memmap(path, dtype=np.uint8, mode="r") if mmap and n_rows > 0 else None
+
+    for entry in header["columns"]:
+        if wanted is not None and entry["name"] not in wanted:
+            continue
+        dtype = np.dtype(entry["dtype"])
+        if n_rows == 0:
+            data = np.empty(0, dtype=dtype)
+        elif mmap:
+            data = buffer[entry["offset"]:entry["offset"] + n_rows * dtype.itemsize].view(dtype)
+        else:
+            with open(path, "rb") as f:
+                f.seek(entry["offset"])
+                data = np.fromfile(f, dtype=dtype, count=n_rows)
+        if "categories" in entry:
+            data = pd.Categorical.from_codes(np.asarray(data), categories=entry["categories"]) if decode else (data, entry["categories"])
+        result[entry["name"]] = data
+
+    return result, header["metadata"]
+
+
+def read_frame(path, columns=None, mmap=True):
+    """Reads a columnar file into a DataFrame without copying the memory-mapped numeric columns."""
+    data, _ = read_columns(path, columns=columns, mmap=mmap)
+    return pd.DataFrame(data, copy=False)
+
+
+def write_frame(path, df, metadata=None):
+    """Writes every column of a DataFrame to a columnar file."""
+    write_columns(path, {col: df[col].array if isinstance(df[col].dtype, pd.CategoricalDtype) else df[col].to_numpy() for col in df.columns}, metadata)
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
@@ -1,147 +1,255 @@
+import matplotlib
+matplotlib.use("Agg")  # pyplot only saves files here; figures are shown in the embedded canvas
+
 import tkinter as tk
 from tkinter import filedialog, messagebox
-import pandas as pd
-import os
-import threading
-from time_finder import TimeFinder
-from drop_analysis import DropAnalysis  
+import queue
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+from analysis_jobs import AnalysisJob, JobRunner
+
+POLL_INTERVAL_MS = 100
+CLICK_TOLERANCE = 0.01  # Clicks within this fraction of the visible time range select an existing point
 
 class DropAnalysisGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("Drop Analysis Tool")
+        self.runner = JobRunner()
+        self.jobs = []  # Every queued job, in listbox order
+        self.review = None  # ReviewRequest being answered on the canvas
+        self.review_points = {}
+        self.review_edits = {}
 
-        # **File Selection**
-        tk.Label(root, text="Select CSV File:").grid(row=0, column=0, sticky="w", padx=5, pady=2)
-        self.file_entry = tk.Entry(root, width=50, state="disabled")
-        self.file_entry.grid(row=0, column=1, padx=5, pady=2)
-        tk.Button(root, text="Browse", command=self.load_file).grid(row=0, column=2, padx=5, pady=2)
+        controls = tk.Frame(root)
+        controls.grid(row=0, column=0, sticky="nw")
+        plot_area = tk.Frame(root)
+        plot_area.grid(row=0, column=1, sticky="nsew")
+        root.columnconfigure(1, weight=1)
+        root.rowconfigure(0, weight=1)
+
+        # **File Queue**
+        tk.Label(controls, text="Recordings:").grid(row=0, column=0, sticky="nw", padx=5, pady=2)
+        self.file_list = tk.Listbox(controls, width=60, height=8)
+        self.file_list.grid(row=0, column=1, columnspan=2, padx=5, pady=2)
+        file_buttons = tk.Frame(controls)
+        file_buttons.grid(row=1, column=1, columnspan=2, sticky="w", padx=5)
+        tk.Button(file_buttons, text="Add Files", command=self.add_files).pack(side="left", padx=2)
+        tk.Button(file_buttons, text="Cancel Selected", command=self.cancel_selected).pack(side="left", padx=2)
+        tk.Button(file_buttons, text="Cancel All", command=self.runner.cancel_all).pack(side="left", padx=2)
 
         # **Output Folder**
-        tk.Label(root, text="Output Folder:").grid(row=1, column=0, sticky="w", padx=5, pady=2)
-        self.out_folder_entry = tk.Entry(root, width=30)
+        tk.Label(controls, text="Output Folder:").grid(row=2, column=0, sticky="w", padx=5, pady=2)
+        self.out_folder_entry = tk.Entry(controls, width=30)
         self.out_folder_entry.insert(0, "data_out")
-        self.out_folder_entry.grid(row=1, column=1, padx=5, pady=2)
+        self.out_folder_entry.grid(row=2, column=1, sticky="w", padx=5, pady=2)
 
         # **User Confirmation & Plotting Options**
         self.user_confirmation_var = tk.BooleanVar(value=True)
-        tk.Checkbutton(root, text="Enable User Confirmation", variable=self.user_confirmation_var).grid(row=2, column=0, columnspan=2, sticky="w", padx=5, pady=2)
+        tk.Checkbutton(controls, text="Review Drops Before Analysis", variable=self.user_confirmation_var).grid(row=3, column=0, columnspan=2, sticky="w", padx=5, pady=2)
 
         self.plot_orig_var = tk.BooleanVar(value=True)
-        tk.Checkbutton(root, text="Plot Original Data", variable=self.plot_orig_var).grid(row=3, column=0, columnspan=2, sticky="w", padx=5, pady=2)
+        tk.Checkbutton(controls, text="Save Original Data Plot", variable=self.plot_orig_var).grid(row=4, column=0, columnspan=2, sticky="w", padx=5, pady=2)
 
         self.plot_after_var = tk.BooleanVar(value=True)
-        tk.Checkbutton(root, text="Plot After Analysis", variable=self.plot_after_var).grid(row=4, column=0, columnspan=2, sticky="w", padx=5, pady=2)
+        tk.Checkbutton(controls, text="Save Corrected Drops Plot", variable=self.plot_after_var).grid(row=5, column=0, columnspan=2, sticky="w", padx=5, pady=2)
 
         self.save_plots_var = tk.BooleanVar(value=True)
-        tk.Checkbutton(root, text="Save Plots", variable=self.save_plots_var).grid(row=5, column=0, columnspan=2, sticky="w", padx=5, pady=2)
+        tk.Checkbutton(controls, text="Save Plots", variable=self.save_plots_var).grid(row=6, column=0, columnspan=2, sticky="w", padx=5, pady=2)
 
         # **Force Basal Computation**
         self.force_basal_var = tk.BooleanVar(value=True)
-        tk.Checkbutton(root, text="Force Basal Computation", variable=self.force_basal_var).grid(row=6, column=0, columnspan=2, sticky="w", padx=5, pady=2)
+        tk.Checkbutton(controls, text="Force Basal Computation", variable=self.force_basal_var).grid(row=7, column=0, columnspan=2, sticky="w", padx=5, pady=2)
 
-        # **Parameters: Time, Temperature, Windows**
-        self.create_param_input("Time Column:", "Time", 7)
-        self.create_param_input("Temp Column:", "Temp", 8)
-        self.create_param_input("Window Before (s):", "30", 9)
-        self.create_param_input("Window After (s):", "30", 10)
-        self.create_param_input("STD Threshold:", "2", 11)
+        # **Cold and Hot Stimuli in One Pass**
+        self.bidirectional_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(controls, text="Detect Cold and Hot Stimuli", variable=self.bidirectional_var).grid(row=8, column=0, columnspan=2, sticky="w", padx=5, pady=2)
 
-        # **Run Button**
-        self.run_button = tk.Button(root, text="Run Analysis", command=self.run_analysis)
-        self.run_button.grid(row=12, column=0, columnspan=3, pady=10)
+        # **Parameters: Time, Temperature, Windows**
+        self.time_col_entry = self.create_param_input(controls, "Time Column:", "Time", 9)
+        self.temp_col_entry = self.create_param_input(controls, "Temp Column:", "Temp", 10)
+        self.window_before_entry = self.create_param_input(controls, "Window Before (s):", "30", 11)
+        self.window_after_entry = self.create_param_input(controls, "Window After (s):", "30", 12)
+        self.std_threshold_entry = self.create_param_input(controls, "STD Threshold:", "2", 13)
 
         # **Status Message**
-        self.status_label = tk.Label(root, text="", fg="blue")
-        self.status_label.grid(row=13, column=0, columnspan=3, pady=5)
+        self.status_label = tk.Label(controls, text="Add recordings to start.", fg="blue", wraplength=420, justify="left")
+        self.status_label.grid(row=14, column=0, columnspan=3, sticky="w", padx=5, pady=5)
+
+        # **Embedded Plot for Reviewing Drops**
+        self.figure = Figure(figsize=(9, 5))
+        self.ax = self.figure.add_subplot(111)
+        self.canvas = FigureCanvasTkAgg(self.figure, master=plot_area)
+        self.toolbar = NavigationToolbar2Tk(self.canvas, plot_area, pack_toolbar=False)
+        self.toolbar.pack(side="bottom", fill="x")
+        self.canvas.get_tk_widget().pack(side="top", fill="both", expand=True)
+        self.canvas.mpl_connect("button_press_event", self.on_plot_click)
+
+        review_buttons = tk.Frame(plot_area)
+        review_buttons.pack(side="bottom", fill="x")
+        self.accept_button = tk.Button(review_buttons, text="Accept Drops", state="disabled", command=self.accept_review)
+        self.accept_button.pack(side="right", padx=5, pady=2)
+        self.reset_button = tk.Button(review_buttons, text="Reset", state="disabled", command=self.reset_review)
+        self.reset_button.pack(side="right", padx=5, pady=2)
+        self.review_label = tk.Label(review_buttons, text="", justify="left")
+        self.review_label.pack(side="left", padx=5)
 
-        self.file_path = None  # Store selected file path
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+        self.root.after(POLL_INTERVAL_MS, self.poll_events)
 
-    def create_param_input(self, label, default_value, row):
+    def create_param_input(self, parent, label, default_value, row):
         """Create input fields for user-configurable parameters."""
-        tk.Label(self.root, text=label).grid(row=row, column=0, sticky="w", padx=5, pady=2)
-        entry = tk.Entry(self.root, width=10)
+        tk.Label(parent, text=label).grid(row=row, column=0, sticky="w", padx=5, pady=2)
+        entry = tk.Entry(parent, width=10)
         entry.insert(0, default_value)
-        entry.grid(row=row, column=1, padx=5, pady=2)
-        setattr(self, f"param_{row}", entry)  # Store entry widget dynamically
-
-    def load_file(self):
-        """Open file dialog to select a CSV file."""
-        file_path = filedialog.askopenfilename(filetypes=[("CSV Files", "*.csv")])
-        if file_path:
-            self.file_path = file_path
-            self.file_entry.config(state="normal")
-            self.file_entry.delete(0, tk.END)
-            self.file_entry.insert(0, os.path.basename(file_path))
-            self.file_entry.config(state="disabled")
-
-    def run_analysis(self):
-        """Run TimeFinder and DropAnalysis on the selected file."""
-        if not self.file_path:
-            messagebox.showerror("Error", "Please select a CSV file first!")
+        entry.grid(row=row, column=1, sticky="w", padx=5, pady=2)
+        return entry
+
+    def add_files(self):
+        """Queue one or more CSV files with the current options."""
+        file_paths = filedialog.askopenfilenames(filetypes=[("CSV Files", "*.csv")])
+        if not file_paths:
+            return
+        try:
+            options = {
+                "output_dir": self.out_folder_entry.get(),
+                "time_col": self.time_col_entry.get(),
+                "temp_col": self.temp_col_entry.get(),
+                "window_before": int(self.window_before_entry.get()),
+                "window_after": int(self.window_after_entry.get()),
+                "std_threshold": float(self.std_threshold_entry.get()),
+                "force_basal_computation": self.force_basal_var.get(),
+                "bidirectional": self.bidirectional_var.get(),
+                "save_plots": self.save_plots_var.get(),
+                "plot_orig": self.plot_orig_var.get(),
+                "plot_after": self.plot_after_var.get(),
+                "user_confirmation": self.user_confirmation_var.get(),
+            }
+        except ValueError as e:
+            messagebox.showerror("Error", f"Invalid parameter: {e}")
             return
 
-        self.status_label.config(text="Running analysis...", fg="black")
-        self.root.update_idletasks()
+        for file_path in file_paths:
+            job = AnalysisJob(file_path, **options)
+            self.jobs.append(job)
+            self.file_list.insert(tk.END, "")
+            self.set_job_status(job, "queued")
+            self.runner.submit(job)
 
-        # Run in a separate thread to keep GUI responsive
-        thread = threading.Thread(target=self.process_analysis)
-        thread.start()
+    def cancel_selected(self):
+        for index in self.file_list.curselection():
+            self.runner.cancel(self.jobs[index])
 
-    def process_analysis(self):
-        try:
-            # **Extract User Inputs**
-            data = pd.read_csv(self.file_path)
-            dataname = os.path.basename(self.file_path)
-            output_dir = self.out_folder_entry.get()
-            force_basal_computation = self.force_basal_var.get()
-            plot_orig = self.plot_orig_var.get()
-            plot_after = self.plot_after_var.get()
-            save_plots = self.save_plots_var.get()
-            user_confirmation = self.user_confirmation_var.get()
-
-            time_col = self.param_7.get()
-            temp_col = self.param_8.get()
-            window_before = int(self.param_9.get())
-            window_after = int(self.param_10.get())
-            std_threshold = float(self.param_11.get())
-
-            # **Run TimeFinder**
-            tool = TimeFinder(
-                data,
-                dataname=dataname,
-                output_dir=output_dir,
-                file_path=self.file_path
-            )
-            results = tool.run_analysis(
-                plot_orig=plot_orig,
-                user_confirmation=user_confirmation,
-                plot_after=plot_after
-            )
-
-            # **Run DropAnalysis**
-            analysis = DropAnalysis(
-                df=data,
-                drop_times=results["drop_times"],
-                recovery_times=results["recovery_times"],
-                dataname=dataname,
-                time_col=time_col,
-                temp_col=temp_col,
-                window_before=window_before,
-                window_after=window_after,
-                std_threshold=std_threshold,
-                save_plots=save_plots,
-                output_dir=output_dir,
-                force_basal_computation=force_basal_computation
-            )
-            analysis.analyze_drops()
-
-            self.status_label.config(text="Analysis completed successfully!", fg="green")
-            messagebox.showinfo("Success", "Analysis completed successfully!")
-
-        except Exception as e:
-            self.status_label.config(text=f"Error: {e}", fg="red")
-            messagebox.showerror("Error", f"Analysis failed: {e}")
+    def set_job_status(self, job, text):
+        index = self.jobs.index(job)
+        self.file_list.delete(index)
+        self.file_list.insert(index, f"{job.dataname}: {text}")
+
+    def poll_events(self):
+        """Applies the job runner's events on the Tk thread, then reschedules itself."""
+        while True:
+            try:
+                kind, job, payload = self.runner.events.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == "progress":
+                self.set_job_status(job, payload)
+                self.status_label.config(text=f"{job.dataname}: {payload}...", fg="black")
+            elif kind == "review":
+                self.start_review(payload)
+            elif kind == "done":
+                failures = f", {payload['recovery_failures']} without full recovery" if payload["recovery_failures"] else ""
+                self.set_job_status(job, f"done, {payload['num_drops']} drops{failures}")
+                self.status_label.config(text=f"{job.dataname}: analysis completed successfully!", fg="green")
+                if self.review is None:
+                    self.draw_recording(payload["time_values"], payload["temp_values"], payload["drop_times"],
+                                        payload["recovery_times"], f"{job.dataname}: analysed drops")
+            elif kind in ("cancelled", "error"):
+                if self.review is not None and self.review.job is job:
+                    self.end_review()
+                text = "cancelled" if kind == "cancelled" else f"failed ({payload})"
+                self.set_job_status(job, text)
+                self.status_label.config(text=f"{job.dataname}: {text}", fg="red" if kind == "error" else "black")
+
+        self.root.after(POLL_INTERVAL_MS, self.poll_events)
+
+    def draw_recording(self, time_values, temp_values, drop_points, recovery_points, title):
+        self.ax.clear()
+        self.ax.plot(time_values, temp_values, linestyle="-", alpha=0.6, label="Temperature")
+        self.drop_markers = self.ax.scatter([], [], color="red", label="Drop Start", zorder=3)
+        self.recovery_markers = self.ax.scatter([], [], color="green", label="Recovery", zorder=3)
+        self.trace = (time_values, temp_values)
+        self.update_markers(drop_points, recovery_points)
+        self.ax.set_xlabel("Time")
+        self.ax.set_ylabel("Temperature")
+        self.ax.set_title(title)
+        self.ax.legend(loc="lower right")
+        self.ax.grid(True)
+        self.toolbar.update()  # Home resets to this recording
+        self.canvas.draw_idle()
+
+    def update_markers(self, drop_points, recovery_points):
+        time_values, temp_values = self.trace
+        for markers, points in ((self.drop_markers, drop_points), (self.recovery_markers, recovery_points)):
+            points = np.asarray(sorted(points), dtype=float)
+            markers.set_offsets(np.column_stack([points, np.interp(points, time_values, temp_values)]) if len(points) else np.empty((0, 2)))
+        self.canvas.draw_idle()
+
+    # **Drop Review on the Embedded Plot**
+    def start_review(self, request):
+        self.review = request
+        self.review_points = {"Drop Start": list(request.drop_points), "Recovery": list(request.recovery_points)}
+        self.review_edits = {"Drop Start": [], "Recovery": []}
+        self.draw_recording(request.time_values, request.temp_values, request.drop_points, request.recovery_points,
+                            f"{request.job.dataname}: review detected drops")
+        self.review_label.config(text="Left click: add/remove a drop start.  Right or shift+click: add/remove a recovery.")
+        self.accept_button.config(state="normal")
+        self.reset_button.config(state="normal")
+
+    def on_plot_click(self, event):
+        """Adds a drop start (left click) or recovery (right or shift+click) at the nearest sample, or removes one near the click."""
+        if self.review is None or event.inaxes is not self.ax or event.xdata is None or self.toolbar.mode:
+            return
+        if event.button == 1 and event.key != "shift":
+            label = "Drop Start"
+        elif event.button == 3 or (event.button == 1 and event.key == "shift"):
+            label = "Recovery"
+        else:
+            return
+
+        points = self.review_points[label]
+        x_min, x_max = self.ax.get_xlim()
+        nearest = min(points, key=lambda p: abs(p - event.xdata), default=None)
+        if nearest is not None and abs(nearest - event.xdata) <= CLICK_TOLERANCE * (x_max - x_min):
+            points[:] = [p for p in points if p != nearest]
+            self.review_edits[label].append(("remove", nearest))
+        else:
+            sample_time = float(self.review.time_index.times[self.review.time_index.nearest(event.xdata)])
+            points.append(sample_time)
+            self.review_edits[label].append(("add", sample_time))
+        self.update_markers(self.review_points["Drop Start"], self.review_points["Recovery"])
+
+    def reset_review(self):
+        """Discards this review's edits."""
+        request = self.review
+        self.start_review(request)
+
+    def accept_review(self):
+        request = self.review
+        self.end_review()
+        request.accept(self.review_edits)
+
+    def end_review(self):
+        self.review = None
+        self.review_label.config(text="")
+        self.accept_button.config(state="disabled")
+        self.reset_button.config(state="disabled")
+
+    def close(self):
+        self.runner.cancel_all()
+        self.root.destroy()
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+import uuid
+
+from recording_cache import DEFAULT_CACHE_DIR, RecordingCache
+
+
+DETECTION_DIR = "detections"
+
+
+def apply_corrections(points, corrections):
+    """Replays recorded manual corrections (`[action, time]` pairs) on detected points, like `TimeFinder.manual_correction`."""
+    points = list(points)
+    for action, value in corrections:
+        if action == "add":
+            points.append(value)
+        elif action == "remove":
+            points = [p for p in points if p != value]
+    return sorted(points)
+
+
+class DetectionCache:
+    """
+    On-disk store of drop detection results and the manual corrections made to them.
+
+    Entries are JSON files keyed by the recording's content hash plus the
+    detection hyperparameters, so changing only analysis parameters (windows,
+    `std_threshold`, ...) reuses the detected and corrected drops, while editing
+    the recording or any detection parameter starts from a fresh detection.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.recordings = RecordingCache(self.cache_dir)
+        os.makedirs(os.path.join(self.cache_dir, DETECTION_DIR), exist_ok=True)
+
+    def key(self, csv_path, params):
+        """Entry key: recording content key plus a hash of the detection parameters."""
+        params_digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+        return f"{self.recordings.key(csv_path)}-{params_digest}"
+
+    def load(self, csv_path, params):
+        """Returns the stored entry (detected points and corrections) or None."""
+        try:
+            with open(self._entry_path(self.key(csv_path, params))) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save(self, csv_path, params, drop_times, recovery_times, corrections):
+        """Stores the detected drop / recovery times (None when no candidate was found) and the corrections applied to them."""
+        entry = {
+            "source": os.path.abspath(csv_path),
+            "params": params,
+            "drop_times": None if drop_times is None else [float(t) for t in drop_times],
+            "recovery_times": None if recovery_times is None else [float(t) for t in recovery_times],
+            "corrections": {label: [[action, float(value)] for action, value in edits] for label, edits in corrections.items()},
+        }
+        path = self._entry_path(self.key(csv_path, params))
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f, indent=1)
+        os.replace(tmp_path, path)
+
+    def clear(self):
+        """Removes every stored detection."""
+        folder = os.path.join(self.cache_dir, DETECTION_DIR)
+        for name in os.listdir(folder):
+            if name.endswith(".json"):
+                os.remove(os.path.join(folder, name))
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, DETECTION_DIR, f"{key}.json")
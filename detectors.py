@@ -0,0 +1,474 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def significant_onsets(temp_series, dT_dt, candidates, new_cluster, preceding_window, drop_threshold_factor,
+                       abs_diff_sum=None):
+    """
+    Position in `candidates` of the first significant candidate of every cluster
+    (`new_cluster` marks each cluster's first candidate): the first one whose
+    |dT/dt| exceeds `drop_threshold_factor` times the mean |diff| over the
+    `preceding_window` samples before the cluster, from one cumulative sum.
+    """
+    cluster_id = np.cumsum(new_cluster) - 1
+    cluster_starts = candidates[new_cluster]
+
+    # Baseline fluctuation: mean |diff| of temp[start:cluster_start] from a cumulative sum
+    if abs_diff_sum is None:
+        abs_diff_sum = np.concatenate(([0.0], np.cumsum(np.abs(np.diff(temp_series)))))
+    window_starts = np.maximum(0, cluster_starts - preceding_window)
+    n_diffs = cluster_starts - window_starts - 1
+    with np.errstate(invalid="ignore", divide="ignore"):
+        baseline_fluctuation = np.where(
+            n_diffs > 0,
+            (abs_diff_sum[np.maximum(cluster_starts - 1, 0)] - abs_diff_sum[window_starts]) / n_diffs,
+            np.nan
+        )
+
+    # First point in each cluster where the drop is significant
+    significant = np.abs(dT_dt[candidates]) > drop_threshold_factor * baseline_fluctuation[cluster_id]
+    significant_index = np.flatnonzero(significant)
+    _, first = np.unique(cluster_id[significant_index], return_index=True)
+    return significant_index[first]
+
+
+def detect_drop_indices(temp_series, dT_dt, derivative_threshold, neighbor_threshold, preceding_window,
+                        drop_threshold_factor, detect_hot_points=False, abs_diff_sum=None):
+    """
+    Vectorized drop and recovery detection on a temperature trace and its derivative.
+
+    Candidates are split into clusters wherever consecutive candidate indices are
+    more than `neighbor_threshold` apart. Each cluster's baseline fluctuation (mean
+    |diff| over the `preceding_window` samples before it) comes from one cumulative
+    sum, and each drop's recovery is the next derivative sign flip, looked up by
+    binary search in a precomputed index of flips.
+
+    `abs_diff_sum` (the cumulative |diff| of the trace, starting at 0) may be
+    passed in when detection runs many times on the same trace.
+
+    Returns (drop_indices, recovery_indices), already shifted back by one sample,
+    or (None, None) when no derivative sample crosses the threshold.
+    """
+    temp_series = np.asarray(temp_series, dtype=float)
+    dT_dt = np.asarray(dT_dt, dtype=float)
+
+    # Identify potential drop points (or hot peaks)
+    drop_candidates = np.flatnonzero(dT_dt > derivative_threshold) if detect_hot_points else np.flatnonzero(dT_dt < derivative_threshold)
+    if len(drop_candidates) == 0:
+        return None, None
+
+    # Cluster drop points: a new cluster starts after every gap wider than neighbor_threshold
+    new_cluster = np.empty(len(drop_candidates), dtype=bool)
+    new_cluster[0] = True
+    new_cluster[1:] = np.diff(drop_candidates) > neighbor_threshold
+    drop_indices = drop_candidates[significant_onsets(temp_series, dT_dt, drop_candidates, new_cluster, preceding_window,
+                                                      drop_threshold_factor, abs_diff_sum)]
+
+    # Recovery: next index (excluding the last sample) where the derivative flips sign
+    flips = np.flatnonzero(dT_dt[:-1] < 0) if detect_hot_points else np.flatnonzero(dT_dt[:-1] > 0)
+    next_flip = np.searchsorted(flips, drop_indices + 1, side="left")
+    has_recovery = next_flip < len(flips)
+    recovery_indices = flips[next_flip[has_recovery]]
+
+    # Correct the off-by-one error of the derivative index
+    return drop_indices - 1, recovery_indices - 1
+
+
+def detect_event_indices(temp_series, dT_dt, deriv_thresh, neighbor_threshold, preceding_window, drop_threshold_factor,
+                         abs_diff_sum=None):
+    """
+    Cold drops and hot peaks in one pass over the derivative.
+
+    Samples with dT/dt below -`deriv_thresh` or above `deriv_thresh` are the
+    candidates; clusters never mix the two directions, so each direction finds
+    the same events as `detect_drop_indices` run for it alone. A cold event
+    recovers at the next rise of the derivative, a hot one at the next fall.
+    Left out are events with no recovery before the end of the trace and the
+    return of an event (e.g. the fall after a heat pulse), i.e. an opposite
+    event starting before the temperature is back past halfway from the extreme.
+
+    Returns (event_indices, recovery_indices, hot) in time order, shifted back by
+    one sample like `detect_drop_indices`, or (None, None, None) without candidates.
+    """
+    temp_series = np.asarray(temp_series, dtype=float)
+    dT_dt = np.asarray(dT_dt, dtype=float)
+
+    candidates = np.flatnonzero(np.abs(dT_dt) > abs(deriv_thresh))
+    if len(candidates) == 0:
+        return None, None, None
+
+    # Cold candidates first, then hot ones, each still in time order
+    hot = dT_dt[candidates] > 0
+    order = np.argsort(hot, kind="stable")
+    candidates, hot = candidates[order], hot[order]
+    new_cluster = np.empty(len(candidates), dtype=bool)
+    new_cluster[0] = True
+    new_cluster[1:] = (np.diff(candidates) > neighbor_threshold) | (hot[1:] != hot[:-1])
+    onsets = significant_onsets(temp_series, dT_dt, candidates, new_cluster, preceding_window, drop_threshold_factor,
+                                abs_diff_sum)
+    event_indices, hot = candidates[onsets], hot[onsets]
+
+    # Recovery: next sign flip against the event's direction (excluding the last sample)
+    recovery_indices = np.full(len(event_indices), -1, dtype=np.int64)
+    for is_hot, flips in ((False, np.flatnonzero(dT_dt[:-1] > 0)), (True, np.flatnonzero(dT_dt[:-1] < 0))):
+        selected = np.flatnonzero(hot == is_hot)
+        next_flip = np.searchsorted(flips, event_indices[selected] + 1, side="left")
+        has_recovery = next_flip < len(flips)
+        recovery_indices[selected[has_recovery]] = flips[next_flip[has_recovery]]
+
+    order = np.argsort(event_indices, kind="stable")
+    order = order[recovery_indices[order] >= 0]
+
+    event_indices, recovery_indices, hot = event_indices[order] - 1, recovery_indices[order] - 1, hot[order]
+    keep = not_returns(temp_series, event_indices, recovery_indices, hot)
+    return event_indices[keep], recovery_indices[keep], hot[keep]
+
+
+def not_returns(temp_series, event_indices, recovery_indices, hot):
+    """
+    Mask of the events (in time order) that are not the return of the event
+    before them: a rise right after a cold drop, or a fall right after a hot
+    peak, that starts before the temperature is back past halfway from that
+    event's extreme (its recovery sample) to its start.
+    """
+    keep = np.ones(len(event_indices), dtype=bool)
+    last = None
+    for k in range(len(event_indices)):
+        if last is not None and hot[k] != hot[last]:
+            halfway = (temp_series[event_indices[last]] + temp_series[recovery_indices[last]]) / 2
+            onset_temp = temp_series[event_indices[k]]
+            if (onset_temp < halfway) if hot[k] else (onset_temp > halfway):
+                keep[k] = False
+                continue
+        last = k
+    return keep
+
+
+def event_polarities(time_values, temp_values, drop_times, response_times):
+    """
+    Polarity of every event from its temperatures: "hot" if the temperature at
+    its response time is above the temperature at its start, otherwise "cold".
+
+    Works on any drop / response times (detected, cached or edited by hand), so
+    labels never need to be stored alongside them.
+    """
+    time_values = np.asarray(time_values, dtype=float)
+    temp_values = np.asarray(temp_values, dtype=float)
+    start_temp = np.interp(np.asarray(drop_times, dtype=float), time_values, temp_values)
+    response_temp = np.interp(np.asarray(response_times, dtype=float), time_values, temp_values)
+    return np.where(response_temp > start_temp, "hot", "cold").astype(object)
+
+
+POLARITIES = ("cold", "hot", "both")  # Stimulus types DropAnalysis can model
+ONSET_FRACTION = 0.05  # Share of a CUSUM change's height that still counts as before its change point
+CUSUM_BLOCK = 4096  # Samples per CUSUM evaluation block (doubled while a change runs past it)
+
+
+class DropDetector:
+    """
+    Finds drop and recovery samples in a temperature trace.
+
+    Subclasses implement `find(time_values, temp_values)`, returning
+    (drop_indices, recovery_indices, n_candidates), or (None, None, 0) when
+    nothing crosses the detection threshold, and `params()`, the settings that
+    determine the result (part of the detection cache key). `detect` times the
+    call and keeps `report`: detector name, runtime, candidate, drop and recovery counts.
+    """
+
+    name = None
+
+    def params(self):
+        return {}
+
+    def find(self, time_values, temp_values):
+        raise NotImplementedError
+
+    def detect(self, time_values, temp_values):
+        """Returns (drop_indices, recovery_indices) like `detect_drop_indices` and updates `report`."""
+        start = time.perf_counter()
+        drops, recoveries, n_candidates = self.find(np.asarray(time_values, dtype=float), np.asarray(temp_values, dtype=float))
+        self.report = {
+            "detector": self.name,
+            "runtime_s": time.perf_counter() - start,
+            "candidates": int(n_candidates),
+            "drops": 0 if drops is None else len(drops),
+            "recoveries": 0 if recoveries is None else len(recoveries),
+        }
+        return drops, recoveries
+
+
+class DerivativeDetector(DropDetector):
+    """
+    The raw-derivative heuristic of `detect_drop_indices` (TimeFinder's default):
+    threshold crossings of dT/dt, clustered and checked against the preceding fluctuation.
+    With `bidirectional`, cold drops and hot peaks are found together (`detect_event_indices`).
+    """
+
+    name = "derivative"
+
+    def __init__(self, deriv_thresh=1, neighbor_threshold=5, preced_window=30, drop_factor=1.5, detect_hot_points=False,
+                 bidirectional=False):
+        self.derivative_threshold = deriv_thresh if detect_hot_points else -1 * deriv_thresh
+        self.neighbor_threshold = neighbor_threshold
+        self.preceding_window = preced_window
+        self.drop_threshold_factor = drop_factor
+        self.detect_hot_points = detect_hot_points
+        self.bidirectional = bidirectional
+
+    def params(self):
+        params = {
+            "detect_hot_points": self.detect_hot_points,
+            "neighbor_threshold": self.neighbor_threshold,
+            "preceding_window": self.preceding_window,
+            "drop_threshold_factor": self.drop_threshold_factor,
+            "derivative_threshold": self.derivative_threshold,
+        }
+        if self.bidirectional:
+            params["bidirectional"] = True  # One-direction keys stay as before, so earlier cache entries still match
+        return params
+
+    def find(self, time_values, temp_values):
+        dT_dt = np.gradient(temp_values, time_values)
+        if self.bidirectional:
+            drops, recoveries, _ = detect_event_indices(
+                temp_values, dT_dt, self.derivative_threshold, self.neighbor_threshold,
+                self.preceding_window, self.drop_threshold_factor
+            )
+            return drops, recoveries, np.count_nonzero(np.abs(dT_dt) > abs(self.derivative_threshold))
+        crossings = dT_dt > self.derivative_threshold if self.detect_hot_points else dT_dt < self.derivative_threshold
+        drops, recoveries = detect_drop_indices(
+            temp_values, dT_dt, self.derivative_threshold, self.neighbor_threshold,
+            self.preceding_window, self.drop_threshold_factor, self.detect_hot_points
+        )
+        return drops, recoveries, np.count_nonzero(crossings)
+
+
+def moving_average(values, window):
+    """Centred moving average over `window` samples (shorter at the ends) in O(n) from one cumulative sum."""
+    values = np.asarray(values, dtype=float)
+    if window <= 1 or len(values) == 0:
+        return values
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    index = np.arange(len(values))
+    lo = np.maximum(index - window // 2, 0)
+    hi = np.minimum(index + (window - window // 2), len(values))
+    return (cumulative[hi] - cumulative[lo]) / (hi - lo)
+
+
+class SmoothedDerivativeDetector(DerivativeDetector):
+    """
+    `DerivativeDetector` on a trace smoothed with a centred moving average over
+    `smooth_s` time units (converted to samples with the median sampling
+    interval), so sample-to-sample noise no longer crosses the derivative
+    threshold or flips its sign (spurious drops and early recoveries).
+    """
+
+    name = "smoothed_derivative"
+
+    def __init__(self, smooth_s=0.5, **kwargs):
+        super().__init__(**kwargs)
+        self.smooth_s = smooth_s
+
+    def params(self):
+        return {**super().params(), "smooth_s": self.smooth_s}
+
+    def find(self, time_values, temp_values):
+        interval = np.median(np.diff(time_values)) if len(time_values) > 1 else 0
+        window = int(round(self.smooth_s / interval)) if interval > 0 else 1
+        return super().find(time_values, moving_average(temp_values, window))
+
+
+def cusum_changes(increments, threshold, onset_fraction=ONSET_FRACTION, block=CUSUM_BLOCK):
+    """
+    One-sided CUSUM S_k = max(0, S_{k-1} + x_k) of `increments`, restarted after every change it detects.
+
+    A change begins when S exceeds `threshold` and is over once S has fallen
+    `threshold` below its maximum since (or the trace ends). The CUSUM then
+    restarts from that maximum, so a level that never returns to where the
+    change started (partial recoveries, artefacts) does not hide later changes.
+    S is evaluated a block at a time as cumulative sum minus its running
+    minimum; quiet blocks are skipped from their last zero and a block only
+    grows (doubling) while a change runs past its end, so the trace is read
+    O(n) times overall.
+
+    Returns (onsets, peaks): for each change, the last index before its peak
+    where S was at most `onset_fraction` of the peak (the change point,
+    unaffected by noise that lifted S off zero earlier), and the index of the
+    peak (where the change stops). Index k is the sample before increment k.
+    """
+    cumulative = np.concatenate(([0.0], np.cumsum(increments)))
+    onsets, peaks = [], []
+    start, size = 0, block
+    while start < len(cumulative) - 1:
+        segment = cumulative[start:start + size]
+        statistic = segment - np.minimum.accumulate(segment)
+        reaches_end = start + size >= len(cumulative)
+
+        above = np.flatnonzero(statistic > threshold)
+        if len(above) == 0:
+            if reaches_end:
+                break
+            restart = int(np.flatnonzero(statistic == 0)[-1])
+            start, size = (start + restart, size) if restart > 0 else (start, 2 * size)
+            continue
+
+        alarm = above[0]
+        after = statistic[alarm:]
+        ended = np.flatnonzero(after <= np.maximum.accumulate(after) - threshold)
+        if len(ended) == 0 and not reaches_end:
+            size *= 2
+            continue
+        peak = alarm + int(np.argmax(after[:ended[0]] if len(ended) else after))
+        rise = statistic[:peak + 1]
+        onsets.append(start + int(np.flatnonzero(rise <= onset_fraction * rise[-1])[-1]))
+        peaks.append(start + peak)
+        start, size = start + peak, block
+
+    return np.array(onsets, dtype=np.int64), np.array(peaks, dtype=np.int64)
+
+
+class CusumDetector(DropDetector):
+    """
+    Change-point detector: CUSUM of the standardised temperature steps.
+
+    Steps (first differences) are scaled by their robust noise level
+    (1.4826 × MAD), so `drift` and `threshold` are in noise units and do not
+    depend on the thermistor or the sampling rate. The CUSUM accumulates the
+    fall in temperature minus `drift` per sample: white noise cancels out, while
+    a drop adds up to its depth in noise units. Each change found by
+    `cusum_changes` is a drop, starting at its change point, with its recovery
+    where the CUSUM peaks (the lowest point of the drop). With `bidirectional`,
+    a second CUSUM of the rises adds the hot events. Runs in O(n); every
+    change is a candidate, so `candidates` equals `drops`.
+    """
+
+    name = "cusum"
+
+    def __init__(self, drift=0.05, threshold=10.0, detect_hot_points=False, bidirectional=False):
+        self.drift = drift
+        self.threshold = threshold
+        self.detect_hot_points = detect_hot_points
+        self.bidirectional = bidirectional
+
+    def params(self):
+        params = {"detect_hot_points": self.detect_hot_points, "drift": self.drift, "threshold": self.threshold}
+        if self.bidirectional:
+            params["bidirectional"] = True
+        return params
+
+    def find(self, time_values, temp_values):
+        if len(temp_values) < 3:
+            return None, None, 0
+        steps = np.diff(temp_values)
+        scale = 1.4826 * np.median(np.abs(steps - np.median(steps)))
+        if not scale > 0:
+            scale = np.std(steps) or 1.0
+        change = steps / scale if self.detect_hot_points else -steps / scale  # Positive while the drop develops
+
+        drops, recoveries = cusum_changes(change - self.drift, self.threshold)
+        if self.bidirectional:
+            # Two one-sided CUSUMs: falls and rises, merged in time order
+            rises, peaks = cusum_changes(-change - self.drift, self.threshold)
+            order = np.argsort(np.concatenate((drops, rises)), kind="stable")
+            drops, recoveries = np.concatenate((drops, rises))[order], np.concatenate((recoveries, peaks))[order]
+            second = (np.arange(len(order)) >= len(order) - len(rises))[order]  # Events of the rises CUSUM
+            keep = not_returns(temp_values, drops, recoveries, second != self.detect_hot_points)
+            drops, recoveries = drops[keep], recoveries[keep]
+        if len(drops) == 0:
+            return None, None, 0
+        return drops, recoveries, len(drops)
+
+
+DETECTORS = {cls.name: cls for cls in (DerivativeDetector, SmoothedDerivativeDetector, CusumDetector)}
+
+
+def make_detector(name, **params):
+    """Builds a detector by name ("derivative", "smoothed_derivative" or "cusum")."""
+    if name not in DETECTORS:
+        raise ValueError(f"Unknown drop detector '{name}'; choose from {', '.join(DETECTORS)}.")
+    return DETECTORS[name](**params)
+
+
+def match_drops(detected, reference, tolerance):
+    """Number of reference drop times with a detected drop within `tolerance`, each detected drop used once."""
+    detected, reference = sorted(detected), sorted(reference)
+    matched, i = 0, 0
+    for t in reference:
+        while i < len(detected) and detected[i] < t - tolerance:
+            i += 1
+        if i < len(detected) and detected[i] <= t + tolerance:
+            matched += 1
+            i += 1
+    return matched
+
+
+def compare_detectors(time_values, temp_values, detectors, reference_drops=None, tolerance=2.0):
+    """
+    Runs every detector on one trace and returns its `report` as a DataFrame row.
+
+    With `reference_drops` (e.g. the drops kept after manual review), each row
+    also counts the drops found within `tolerance` time units, the missed and
+    spurious ones, and the manual corrections (adds + removes) they would need.
+    """
+    time_values = np.asarray(time_values, dtype=float)
+    rows = []
+    for detector in detectors:
+        drops, _ = detector.detect(time_values, temp_values)
+        row = dict(detector.report)
+        if reference_drops is not None:
+            detected = time_values[drops] if drops is not None else []
+            matched = match_drops(detected, reference_drops, tolerance)
+            row.update(matched=matched, missed=len(reference_drops) - matched, spurious=len(detected) - matched)
+            row["corrections"] = row["missed"] + row["spurious"]
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    from detection_cache import DetectionCache, apply_corrections
+    from recording_cache import load_recording
+
+    parser = argparse.ArgumentParser(description="Compare drop detectors on recordings: runtime, candidates and, "
+                                                 "for recordings reviewed earlier, the manual corrections each would need.")
+    parser.add_argument("inputs", nargs="+", help="Recording CSV files.")
+    parser.add_argument("--time-col", default="Time")
+    parser.add_argument("--temp-col", default="Temp")
+    parser.add_argument("--smooth-s", type=float, default=0.5, help="Moving-average window (time units) of the smoothed detector.")
+    parser.add_argument("--cusum-drift", type=float, default=0.05, help="CUSUM drift per sample, in noise units.")
+    parser.add_argument("--cusum-threshold", type=float, default=10.0, help="CUSUM alarm threshold, in noise units.")
+    parser.add_argument("--tolerance", type=float, default=2.0, help="Time tolerance for matching reviewed drops.")
+    parser.add_argument("--cache-dir", default=None, help="Detection cache holding earlier reviews (default: ~/.cache/corneal_nerve).")
+    parser.add_argument("--output", default=None, help="CSV file for the comparison table.")
+    args = parser.parse_args(argv)
+
+    cache = DetectionCache(args.cache_dir)
+    frames = []
+    for path in args.inputs:
+        data = load_recording(path, time_col=args.time_col, cache_dir=args.cache_dir)
+        detectors = [DerivativeDetector(), SmoothedDerivativeDetector(smooth_s=args.smooth_s),
+                     CusumDetector(drift=args.cusum_drift, threshold=args.cusum_threshold)]
+
+        # **Reference: the reviewed drops stored by an earlier run with the default detector**
+        params = {"time_col": args.time_col, "temp_col": args.temp_col, **detectors[0].params()}
+        entry = cache.load(path, params)
+        reference = None
+        if entry is not None and entry["drop_times"] is not None:
+            reference = apply_corrections(entry["drop_times"], [tuple(edit) for edit in entry["corrections"]["Drop Start"]])
+
+        frame = compare_detectors(data[args.time_col].to_numpy(dtype=float), data[args.temp_col].to_numpy(dtype=float),
+                                  detectors, reference, args.tolerance)
+        frame.insert(0, "recording", path)
+        frames.append(frame)
+
+    table = pd.concat(frames, ignore_index=True)
+    print(table.to_string(index=False))
+    if args.output:
+        table.to_csv(args.output, index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,18 +1,48 @@
-from time_finder import TimeFinder
+from segment_stats import SegmentStats
+from channel_schema import ChannelSchema, ChannelMatrix
+from recovery_finder import resolve_recovery_chain
+from detectors import POLARITIES, event_polarities
+from time_index import TimeIndex
+from plot_rendering import PlotRenderer, event_histograms, render_event_plot, render_temp_plot, render_neuron_plot
+from columnar import write_frame
+from instrumentation import get_profiler
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import os
 
 
+WINDOW_NAMES = ["basal", "during", "after"]
+
+
+def split_channel_columns(columns, time_col="Time", temp_col="Temp"):
+    """Returns the neuron event columns and the {neuron: frequency column} mapping of a recording."""
+    schema = ChannelSchema(columns, time_col, temp_col)
+    return schema.units, schema.frequency_columns
+
 
 class DropAnalysis:
     def __init__(self, df, drop_times, recovery_times, dataname='default_name', time_col="Time", temp_col="Temp",
                  window_before=30, window_after=30, std_threshold=2, save_plots=True, output_dir="plots",
-                 force_basal_computation=False):
+                 force_basal_computation=False, plot_workers=0, plot_renderer=None, save_csv=True, profiler=None,
+                 polarity="cold"):
         """
         Initializes DropAnalysis for neuron event and frequency analysis.
+
+        Numeric results are always written as a typed columnar table
+        (`results_<name>.cncol`); `save_csv` also writes the formatted CSV views.
+        Stage timings go to `profiler` (default: the shared profiler, enabled by
+        CORNEAL_NERVE_PROFILE) and are written to `profile_<name>.json`.
+
+        Plots are rendered by `plot_renderer` (a shared PlotRenderer) or, if none is
+        given, in-process, or with `plot_workers` set, by a private pool of that many
+        processes (None: one per CPU; the calling script then needs a `__main__` guard).
+
+        `polarity` is the stimulus type: "cold" (drops), "hot" (heat peaks) or
+        "both", where each event is labelled from its own temperatures
+        (`detectors.event_polarities`) and results gain a polarity column.
         """
+        if polarity not in POLARITIES:
+            raise ValueError(f"Unknown polarity '{polarity}'; choose from {', '.join(POLARITIES)}.")
         self.df = df
         self.drop_times = [float(t) for t in drop_times]  
         self.recovery_times = [float(t) for t in recovery_times]
@@ -22,113 +52,114 @@ class DropAnalysis:
         self.window_after = window_after
         self.std_threshold = std_threshold
         self.force_basal_computation = force_basal_computation  
+        self.polarity = polarity
         self.results = []
         self.drop_failure_counts = {}  
+        self.recovery_failures = []
         self.save_plots = save_plots
+        self.save_csv = save_csv
+        self.numeric_results = None
+        self.profiler = profiler or get_profiler()
         self.output_dir = output_dir
         self.dataname = dataname[:-4]
+        self.plot_renderer = plot_renderer
+        self._owns_renderer = plot_renderer is None
+        self.plot_workers = plot_workers
+        self.drop_intervals = []
+        self.forced_computations = []
 
         if not os.path.exists (self.output_dir):
             os.makedirs(self.output_dir, exist_ok=True)
         if not os.path.exists (os.path.join(self.output_dir, self.dataname)):
             os.makedirs(os.path.join(self.output_dir, self.dataname))
 
-        # Identify neuron event and frequency columns dynamically
-        self.neuron_columns = [col for col in df.columns if not col.startswith("f-") and col not in [self.time_col, self.temp_col]]
-        self.frequency_columns = {col: freq_col for col in self.neuron_columns for freq_col in df.columns if freq_col.startswith(f"f-{col}")}
-
-    def analyze_drops(self):
-        """Analyzes neuronal event data before, during, and after each drop and generates plots."""
-        prev_full_recovery_time = None  # Track previous drop's full recovery time
-        drop_intervals = []
-        self.drop_failure_counts = {neuron: 0 for neuron in self.neuron_columns} 
-        forced_computations = [] 
-        recovery_failures = []
-
-        for i, (drop_time, response_time) in enumerate(zip(self.drop_times, self.recovery_times)):
-            drop_info = {"Drop #": i + 1}
-
-            # **Determine Basal Start Time**
-            basal_start = max(0, drop_time - self.window_before)
-            '''
-            Need to incorporate forced basal computation in here
-            '''
-            if self.force_basal_computation:
-                # **Force Basal Computation: Always Use Window Before Drop**
-                basal_start = max(0, drop_time - self.window_before)
-                forced_basal_handling = "global"  # Mark global forced computation
-            else:
-                # **Standard Behavior: Adjust for Previous Recovery**
-                basal_start = max(0, drop_time - self.window_before)
-
-                # **Handle the first drop separately**
-                # **Handle the first drop separately**
-                if i == 0:
-                    basal_start = max(0, drop_time - self.window_before)
-                    forced_basal_handling = None  # No special handling for first drop
-                else:
-                    # **Case 1: If previous drop never fully recovered, reset basal_start to drop_time**
-                    if prev_full_recovery_time is None or prev_full_recovery_time >= drop_time:
-                        basal_start = drop_time
-                        forced_basal_handling = "no_recovery"  # Special case for missing recovery
-
-                    # **Case 2: Overlap prevention required**
-                    elif prev_full_recovery_time and basal_start < prev_full_recovery_time:
-                        basal_start = prev_full_recovery_time  # Prevent overlap
-                        forced_basal_handling = "overlap_prevention"  # Prevented overlap
-
-                    # **Case 3: Normal basal period calculation (at least `window_before` available)**
-                    else:
-                        basal_start = max(0, drop_time - self.window_before)
-                        forced_basal_handling = None  # No forced computation, normal green shade
-
-
-            forced_computations.append(forced_basal_handling)  # Store forced computation type
-
-
-
-            # **Compute Basal Temperature Mean & STD (Always Computed)**
-            basal_segment = self.df[(self.df[self.time_col] >= basal_start) & (self.df[self.time_col] < drop_time)]
-            forced_basal = False  
-            temp_threshold = None  
-
-            if basal_segment.empty:
-                # **If no valid basal period, use drop-time temperature**
-                temp_threshold = self.df.loc[self.df[self.time_col] == drop_time, self.temp_col].values[0]
-                print('EMPTY')
-                print(temp_threshold, print(type(temp_threshold)))
-            else:
-                basal_temp_mean = basal_segment[self.temp_col].mean()
-                basal_temp_std = basal_segment[self.temp_col].std()
-                temp_threshold = basal_temp_mean - self.std_threshold * basal_temp_std 
-                # print(temp_threshold, print(type(temp_threshold)))
-
-
-            # **Find Full Recovery Time (First Time Temp Returns to Basal)**
-            temp_after_recovery = self.df[self.df[self.time_col] >= response_time]
-            reached_threshold = False  # Track if temperature fully recovered
-            full_recovery_time = None  # Track actual recovery
-            next_drop_time = self.drop_times[i + 1] if i + 1 < len(self.drop_times) else self.df[self.time_col].max()
-
-            for idx, row in temp_after_recovery.iterrows():
-                if temp_threshold is not None and row[self.temp_col] >= temp_threshold:
-                    if row[self.time_col] < next_drop_time:  #  Only valid if recovery happens before the next drop
-                        full_recovery_time = row[self.time_col]
-                        reached_threshold = True
-                        break  # Stop at first valid recovery
-
-
-            # **If Temperature Never Recovers, Use Next Drop or Max Time**
-            if full_recovery_time is None:
-                full_recovery_time = self.drop_times[i + 1] if i + 1 < len(self.drop_times) else self.df[self.time_col].max()
-                print(full_recovery_time)
-
+        # Identify neuron event and frequency columns from the header
+        self.schema = ChannelSchema(df.columns, self.time_col, self.temp_col)
+        self.neuron_columns = self.schema.units
+        self.frequency_columns = self.schema.frequency_columns
+        self.stat_columns = self.schema.stat_columns
+        self._channels = None
+        self._segment_stats = None
+        self._temp_stats = None
+        self._time_index = None
+        self._windows = None  # Per-drop windows, keys and statistics of the last analysis (for `update_drops`)
+        self._drop_keys = []
+        self._window_stats = None
+
+    @property
+    def channels(self):
+        """Event counts and frequencies as compact time × channel matrices, built on first use."""
+        if self._channels is None:
+            with self.profiler.stage("channel_matrix_build"):
+                self._channels = ChannelMatrix.from_frame(self.df, self.schema)
+        return self._channels
+
+    @property
+    def segment_stats(self):
+        """Prefix-sum statistics engine over every event and frequency column, built on first use."""
+        if self._segment_stats is None:
+            channels = self.channels
+            with self.profiler.stage("segment_stats_build"):
+                self._segment_stats = SegmentStats.from_channels(channels)
+        return self._segment_stats
+
+    @property
+    def temp_stats(self):
+        """Prefix-sum statistics of the temperature column (basal windows), built on first use."""
+        if self._temp_stats is None:
+            self._temp_stats = SegmentStats(self.df[self.time_col].to_numpy(dtype=float), self.df[self.temp_col].to_numpy(dtype=float))
+        return self._temp_stats
+
+    @property
+    def time_index(self):
+        """Binary-search index of the sample times (point and range lookups), built on first use."""
+        if self._time_index is None:
+            self._time_index = TimeIndex(self.df[self.time_col].to_numpy(dtype=float))
+        return self._time_index
+
+    def compute_drop_windows(self):
+        """
+        Resolves the basal, during and after windows of every drop.
 
-            # **Update Failure Count for Neurons**
-            if not reached_threshold:
-                for neuron in self.neuron_columns:
-                    self.drop_failure_counts[neuron] += 1
+        Recovery thresholds and full recovery times for all drops come from one
+        batched search (`resolve_recovery_chain`); the loop below only assembles
+        the per-drop window bounds.
+        """
+        return self.resolve_windows(0, min(len(self.drop_times), len(self.recovery_times)))
 
+    def resolve_windows(self, start, stop, previous_full_recovery=np.nan):
+        """
+        Windows of drops `start` to `stop - 1`, given the full recovery time of
+        drop `start - 1` (NaN for the first drop), as dicts like `compute_drop_windows`.
+        """
+        time_values = self.time_index.times
+        temp_values = self.df[self.temp_col].to_numpy(dtype=float)
+        max_time = self.time_index.end
+        drops = range(start, stop)
+        next_drop_times = [self.drop_times[i + 1] if i + 1 < len(self.drop_times) else max_time for i in drops]
+        response_times = self.recovery_times[start:stop]
+        polarities = self.drop_polarities(start, stop)
+
+        chain = resolve_recovery_chain(
+            time_values, temp_values, self.drop_times[start:stop], response_times, next_drop_times,
+            window_before=self.window_before, std_threshold=self.std_threshold,
+            force_basal_computation=self.force_basal_computation, temp_stats=self.temp_stats,
+            previous_full_recovery=previous_full_recovery, hot=polarities == "hot", time_index=self.time_index
+        )
+
+        # **Temperature at the response time's sample (none if it is not within half a sampling interval of one)**
+        response_index = self.time_index.find(response_times)
+
+        windows = []
+        for k, i in enumerate(drops):
+            drop_time = self.drop_times[i]
+            basal_start = chain["basal_start"][k]
+            if basal_start == 0:
+                basal_start = 0  # Keep `max(0, ...)` output for windows clipped at the recording start
+
+            # **Full recovery (first time temp returns to basal threshold before the next drop)**
+            reached_threshold = chain["recovery_index"][k] >= 0
+            full_recovery_time = time_values[chain["recovery_index"][k]] if reached_threshold else next_drop_times[k]
 
             # **After Stim Period (Only If Recovery Occurred)**
             if reached_threshold:
@@ -136,81 +167,392 @@ class DropAnalysis:
                 after_end = after_start + self.window_after
                 if i + 1 < len(self.drop_times) and after_end > self.drop_times[i + 1]:
                     after_end = self.drop_times[i + 1]
-                recovery_failures.append(False)  
-
             else:
                 after_start = None
                 after_end = None
-                recovery_failures.append(True)  
-
-            # **Store Drop Information**
-            drop_info["30s Before"] = f"{basal_start} to {drop_time}"
-            drop_info["During Stim"] = f"{response_time} to {full_recovery_time}"
-            drop_info["30s After"] = f"{after_start} to {after_end}"
-            drop_info["Forced Basal"] = forced_basal_handling
-
-            # **Store Temperature Data for Each Drop**
-            drop_info["Basal Temp ± STD"] = f"{basal_temp_mean:.3f} ± {basal_temp_std:.3f}" if basal_temp_mean is not None else "N/A"
-            drop_info["Min Temp (Response Time)"] = f"{self.df.loc[self.df[self.time_col] == response_time, self.temp_col].values[0]:.3f}" if response_time in self.df[self.time_col].values else "N/A"
-            drop_info["Recovery Threshold Temp"] = f"{temp_threshold:.3f}" 
 
-            drop_intervals.append((basal_start, drop_time, response_time, full_recovery_time, after_start, after_end))
+            window = {
+                "basal_start": basal_start,
+                "drop_time": drop_time,
+                "response_time": self.recovery_times[i],
+                "full_recovery_time": full_recovery_time,
+                "after_start": after_start,
+                "after_end": after_end,
+                "reached_threshold": reached_threshold,
+                "forced_basal": chain["forced_basal"][k],
+                "basal_temp_mean": chain["basal_temp_mean"][k],
+                "basal_temp_std": chain["basal_temp_std"][k],
+                "temp_threshold": chain["temp_threshold"][k],
+                "response_temp": temp_values[response_index[k]] if response_index[k] >= 0 else None,
+            }
+            if self.polarity != "cold":
+                window["polarity"] = polarities[k]
+            windows.append(window)
+
+        return windows
+
+    def drop_polarities(self, start=0, stop=None):
+        """Polarity ("cold" or "hot") of drops `start` to `stop - 1`: fixed by `polarity`, or from their temperatures with "both"."""
+        drop_times, response_times = self.drop_times[start:stop], self.recovery_times[start:stop]
+        n_drops = min(len(drop_times), len(response_times))
+        if self.polarity != "both":
+            return np.full(n_drops, self.polarity, dtype=object)
+        return event_polarities(self.df[self.time_col].to_numpy(dtype=float), self.df[self.temp_col].to_numpy(dtype=float),
+                                drop_times[:n_drops], response_times[:n_drops])
+
+    def drop_keys(self):
+        """
+        Everything a drop's windows depend on besides the previous drop's full
+        recovery time: its drop and response times and the next drop (or the
+        recording end), which bounds its recovery search and after window.
+        """
+        n_drops = min(len(self.drop_times), len(self.recovery_times))
+        max_time = float(self.time_index.end)
+        return [(self.drop_times[i], self.recovery_times[i],
+                 self.drop_times[i + 1] if i + 1 < len(self.drop_times) else None, max_time)
+                for i in range(n_drops)]
 
-            # **Compute Stats for Each Neuron**
-            for neuron in self.neuron_columns:
-                basal_stats = self.compute_segment_stats(basal_start, drop_time, neuron)
-                during_stats = self.compute_segment_stats(response_time, full_recovery_time, neuron) if reached_threshold else {"Event Mean ± STD": "N/A", "Freq Mean ± STD": "N/A"}
-                after_stats = self.compute_segment_stats(after_start, after_end, neuron)
+    @staticmethod
+    def drop_row(window):
+        """The formatted result row of one drop (without its neuron statistics), and its plot interval."""
+        basal_start, drop_time = window["basal_start"], window["drop_time"]
+        response_time, full_recovery_time = window["response_time"], window["full_recovery_time"]
+        after_start, after_end = window["after_start"], window["after_end"]
+
+        # **Store Drop Information**
+        drop_info = {"Drop #": None}
+        if "polarity" in window:
+            drop_info["Polarity"] = window["polarity"]
+        drop_info["30s Before"] = f"{basal_start} to {drop_time}"
+        drop_info["During Stim"] = f"{response_time} to {full_recovery_time}"
+        drop_info["30s After"] = f"{after_start} to {after_end}"
+        drop_info["Forced Basal"] = window["forced_basal"]
+
+        # **Store Temperature Data for Each Drop**
+        basal_temp_mean, basal_temp_std = window["basal_temp_mean"], window["basal_temp_std"]
+        drop_info["Basal Temp ± STD"] = f"{basal_temp_mean:.3f} ± {basal_temp_std:.3f}" if pd.notna(basal_temp_mean) else "N/A"
+        drop_info["Min Temp (Response Time)"] = f"{window['response_temp']:.3f}" if window["response_temp"] is not None else "N/A"
+        drop_info["Recovery Threshold Temp"] = f"{window['temp_threshold']:.3f}" 
+
+        interval = (basal_start, drop_time, response_time, full_recovery_time, after_start, after_end)
+        return drop_info, interval
+
+    def analyze_drops(self, wait_for_plots=True):
+        """
+        Analyzes neuronal event data before, during, and after each drop and generates plots.
 
-                drop_info.update({
-                    f"{neuron} - Basal Period": basal_stats["Event Mean ± STD"],
-                    f"{neuron} - During": during_stats["Event Mean ± STD"],
-                    f"{neuron} - After Resolution": after_stats["Event Mean ± STD"],
+        Statistics CSVs are written first. With `wait_for_plots=False` and a worker pool
+        (`plot_workers` other than 0, or a pooled `plot_renderer`) the call returns while
+        plots are still rendering; use `wait_for_plots()` to wait for them. Without a
+        pool the plots are rendered before the call returns.
+        """
+        with self.profiler.stage("drop_windows"):
+            windows = self.compute_drop_windows()
 
-                    f"{neuron} - Basal Period Freq": basal_stats["Freq Mean ± STD"],
-                    f"{neuron} - During Freq": during_stats["Freq Mean ± STD"],
-                    f"{neuron} - After Resolution Freq": after_stats["Freq Mean ± STD"],
-                })
+        rows, drop_intervals = [], []
+        for window in windows:
+            drop_info, interval = self.drop_row(window)
+            rows.append(drop_info)
+            drop_intervals.append(interval)
+        recovery_failures = [not window["reached_threshold"] for window in windows]
 
-            self.results.append(drop_info)
-            prev_full_recovery_time = full_recovery_time  # Update for next iteration
+        # **Compute Stats for Each Neuron (all drops, windows and columns at once)**
+        with self.profiler.stage("window_stats"):
+            mean, std, n = self.window_stats_matrix(drop_intervals, recovery_failures)
+        with self.profiler.stage("format_neuron_stats"):
+            self.add_neuron_stats(rows, mean, std)
 
+        self._finish_analysis(windows, rows, drop_intervals, mean, std, n, wait_for_plots)
 
-        # **Save Results to CSV**
-        results_df = pd.DataFrame(self.results)
-        failure_counts_df = pd.DataFrame(list(self.drop_failure_counts.items()), columns=["Neuron", "Failure Count"])
+    def update_drops(self, drop_times, recovery_times, wait_for_plots=False):
+        """
+        Re-analyses the recording after drop / recovery times were edited,
+        recomputing only the drops whose windows can have changed.
+
+        A drop depends on its own drop and response times, the next drop time
+        (recovery search bound and after-window cap) and, unless basal
+        computation is forced, the previous drop's full recovery time. Drops
+        whose inputs are unchanged keep their windows, statistics and formatted
+        rows; runs of changed drops are re-resolved together, and a change only
+        propagates to the following drop if its full recovery time moved.
+        Results are rewritten and, with `save_plots`, figures are re-queued in
+        the background (replacing any stale ones still waiting to render).
+        Returns the indices of the recomputed drops in the new drop order.
+        """
+        if self._windows is None:
+            self.drop_times = [float(t) for t in drop_times]
+            self.recovery_times = [float(t) for t in recovery_times]
+            self.analyze_drops(wait_for_plots=wait_for_plots)
+            return list(range(len(self._windows)))
+
+        old_index = {key: j for j, key in enumerate(self._drop_keys)}
+        old_windows, old_rows = self._windows, self.results
+        old_mean, old_std, old_n = self._window_stats
+        self.drop_times = [float(t) for t in drop_times]
+        self.recovery_times = [float(t) for t in recovery_times]
+        keys = self.drop_keys()
+        n_drops = len(keys)
+
+        with self.profiler.stage("drop_windows"):
+            windows, source = [None] * n_drops, [None] * n_drops
+            previous_full_recovery = np.nan
+            i = 0
+            while i < n_drops:
+                j = old_index.get(keys[i])
+                old_previous = old_windows[j - 1]["full_recovery_time"] if j else np.nan
+                if j is not None and (self.force_basal_computation or (np.isnan(previous_full_recovery) and np.isnan(old_previous))
+                                      or previous_full_recovery == old_previous):
+                    windows[i], source[i] = old_windows[j], j
+                    previous_full_recovery = windows[i]["full_recovery_time"]
+                    i += 1
+                    continue
+
+                # **Re-resolve this drop and the changed drops right after it together**
+                stop = i + 1
+                while stop < n_drops and keys[stop] not in old_index:
+                    stop += 1
+                windows[i:stop] = self.resolve_windows(i, stop, previous_full_recovery)
+                previous_full_recovery = windows[stop - 1]["full_recovery_time"]
+                i = stop
+
+        recomputed = [i for i in range(n_drops) if source[i] is None]
+        if not recomputed and n_drops == len(old_windows):
+            return []  # Same drops as before: nothing to rewrite or redraw
+
+        # **Reuse the statistics and formatted rows of unchanged drops**
+        rows, drop_intervals = [None] * n_drops, [None] * n_drops
+        mean = np.empty((n_drops,) + old_mean.shape[1:])
+        std, n = np.empty_like(mean), np.empty(mean.shape, dtype=old_n.dtype)
+        for i, j in enumerate(source):
+            if j is not None:
+                rows[i], drop_intervals[i] = dict(old_rows[j]), self.drop_row(windows[i])[1]
+                mean[i], std[i], n[i] = old_mean[j], old_std[j], old_n[j]
+            else:
+                rows[i], drop_intervals[i] = self.drop_row(windows[i])
+        recovery_failures = [not window["reached_threshold"] for window in windows]
+
+        if recomputed:
+            with self.profiler.stage("window_stats"):
+                mean[recomputed], std[recomputed], n[recomputed] = self.window_stats_matrix(
+                    [drop_intervals[i] for i in recomputed], [recovery_failures[i] for i in recomputed])
+            with self.profiler.stage("format_neuron_stats"):
+                self.add_neuron_stats([rows[i] for i in recomputed], mean[recomputed], std[recomputed])
+
+        if self.plot_renderer is not None and self._owns_renderer:
+            # Figures of the previous drops are out of date; the ones already rendering finish
+            # first so they cannot overwrite the new figures
+            self.plot_renderer.cancel(wait=True)
+        self._finish_analysis(windows, rows, drop_intervals, mean, std, n, wait_for_plots)
+        return recomputed
+
+    def _finish_analysis(self, windows, rows, drop_intervals, mean, std, n, wait_for_plots):
+        """Stores the analysed drops, writes the results and queues the plots."""
+        for i, drop_info in enumerate(rows):
+            drop_info["Drop #"] = i + 1
+        self.results = rows
+        self._windows = windows
+        self._drop_keys = self.drop_keys()
+        self._window_stats = (mean, std, n)
+        self.drop_intervals = drop_intervals
+        self.forced_computations = [window["forced_basal"] for window in windows]  # Store forced computation type
+        self.recovery_failures = [not window["reached_threshold"] for window in windows]
+
+        # **Update Failure Count for Neurons**
+        failures = sum(self.recovery_failures)
+        self.drop_failure_counts = {neuron: failures for neuron in self.neuron_columns}
+
+        with self.profiler.stage("numeric_results"):
+            polarities = [window["polarity"] for window in windows] if self.polarity != "cold" else None
+            self.numeric_results = self.numeric_results_table(self.window_bounds(drop_intervals, self.recovery_failures), mean, std, n,
+                                                              polarities)
+
+        # **Save Results (before any plot is rendered)**
+        with self.profiler.stage("write_results"):
+            self.write_results()
 
         # **Generate Plots**
         if self.save_plots:
-            self.plot_temp_with_annotations(drop_intervals, forced_computations,recovery_failures)
-            for neuron in self.neuron_columns:
-                self.plot_neuron(neuron, drop_intervals, f"{neuron}_events", forced_computations,recovery_failures)
-                if neuron in self.frequency_columns:
-                    freq_neuron = self.frequency_columns[neuron]
-                    self.plot_neuron(freq_neuron, drop_intervals, f"{neuron}_frequency", forced_computations,recovery_failures)
+            self.render_plots()
+            if wait_for_plots:
+                self.wait_for_plots()
+        else:
+            self.write_profile()
+
+    def write_results(self):
+        """Writes the numeric results table and, with `save_csv`, the formatted result and failure CSVs."""
+        write_frame(os.path.join(self.output_dir, self.dataname, 'results_' + self.dataname + '.cncol'), self.numeric_results,
+                    metadata={"recording": self.dataname})
+
+        if self.save_csv:
+            results_df = pd.DataFrame(self.results)
+            failure_counts_df = pd.DataFrame(list(self.drop_failure_counts.items()), columns=["Neuron", "Failure Count"])
+
+            # UTF-8 with a byte order mark so spreadsheet programs read "±" correctly
+            result_name = os.path.join(self.output_dir, self.dataname, 'analyzed_'+ self.dataname +'.csv')
+            results_df.to_csv(result_name, index=False, encoding="utf-8-sig")
+
+            failure = os.path.join(self.output_dir, self.dataname, 'failure_'+ self.dataname +'.csv')
+            failure_counts_df.to_csv(failure, index=False, encoding="utf-8-sig")
+
+    def render_plots(self):
+        """Queues the temperature plot and every neuron event/frequency plot on the plot renderer."""
+        if self.plot_renderer is None:
+            self.plot_renderer = PlotRenderer(workers=self.plot_workers, profiler=self.profiler)
+
+        plot_dir = os.path.join(self.output_dir, self.dataname)
+        time_values = self.channels.time
+        windows = (self.drop_intervals, self.forced_computations, self.recovery_failures)
+
+        self.plot_renderer.submit(render_temp_plot, os.path.join(plot_dir, f"{self.dataname}_temp.png"),
+                                  time_values, self.channels.temp, *windows)
+
+        # Event histograms of all units in one pass; each plot only receives its bins
+        bin_edges, event_counts = event_histograms(time_values, self.channels.events)
+        for j, neuron in enumerate(self.neuron_columns):
+            plot_label = f"{neuron}_events"
+            self.plot_renderer.submit(render_event_plot, os.path.join(plot_dir, f"{plot_label}.png"),
+                                      bin_edges, event_counts[:, j], neuron, plot_label, *windows)
+            if neuron in self.frequency_columns:
+                freq_neuron = self.frequency_columns[neuron]
+                plot_label = f"{neuron}_frequency"
+                self.plot_renderer.submit(render_neuron_plot, os.path.join(plot_dir, f"{plot_label}.png"),
+                                          time_values, self.channels.column(freq_neuron), freq_neuron, plot_label, True, *windows)
+
+    def wait_for_plots(self):
+        """Blocks until every queued plot is saved and returns the saved paths."""
+        if self.plot_renderer is None:
+            return []
+        paths = self.plot_renderer.wait()
+        if self._owns_renderer:
+            self.plot_renderer.shutdown()
+            self.plot_renderer = None
+        self.write_profile()
+        return paths
+
+    def write_profile(self):
+        """
+        Writes the profiler's stage report to `profile_<name>.json` next to the
+        results and starts a fresh report for the next recording (no-op when profiling is off).
+        """
+        if not self.profiler.enabled:
+            return None
+        path = os.path.join(self.output_dir, self.dataname, f"profile_{self.dataname}.json")
+        self.profiler.write_report(path, recording=self.dataname, num_drops=len(self.drop_intervals),
+                                   rows=len(self.df), columns=len(self.df.columns))
+        self.profiler.reset()
+        return path
+
+    def analysed_intervals(self):
+        """
+        (drop_intervals, recovery_failures) of the last `analyze_drops`; before it
+        has run, the windows are resolved on demand without writing any output.
+        """
+        if self.drop_intervals or min(len(self.drop_times), len(self.recovery_times)) == 0:
+            return self.drop_intervals, self.recovery_failures
+        windows = self.compute_drop_windows()
+        return [self.drop_row(window)[1] for window in windows], [not window["reached_threshold"] for window in windows]
 
-        # Save results to CSV
-        result_name = os.path.join(self.output_dir, self.dataname, 'analyzed_'+ self.dataname +'.csv')
-        results_df.to_csv(result_name, index=False)
+    @staticmethod
+    def window_bounds(drop_intervals, recovery_failures):
+        """
+        Returns a (drop, window, 2) array of [start, end) bounds of the basal / during /
+        after windows; missing windows (no recovery, no after period) are NaN.
+        """
+        windows = np.full((len(drop_intervals), 3, 2), np.nan)
+        for i, (basal_start, drop_time, response_time, full_recovery_time, after_start, after_end) in enumerate(drop_intervals):
+            windows[i, 0] = (basal_start, drop_time)
+            if not recovery_failures[i]:
+                windows[i, 1] = (response_time, full_recovery_time)
+            if after_start is not None and after_end is not None:
+                windows[i, 2] = (after_start, after_end)
+        return windows
 
-        failure = os.path.join(self.output_dir, self.dataname, 'failure_'+ self.dataname +'.csv')
-        failure_counts_df.to_csv(failure, index=False)
+    def window_stats_matrix(self, drop_intervals, recovery_failures):
+        """
+        Returns mean, std and n arrays of shape (drop, window, column) for the
+        basal / during / after windows of every drop, with columns ordered as
+        `self.stat_columns`. The during window is empty when the drop never recovered.
+        """
+        windows = self.window_bounds(drop_intervals, recovery_failures)
+        return self.segment_stats.window_stats(windows[..., 0], windows[..., 1])
 
+    def numeric_results_table(self, windows, mean, std, n, polarities=None):
+        """
+        Long-format numeric results: one row per drop, window, neuron and metric
+        ("events" or "frequency") with mean, std, sample count n and the window's
+        [start, end) bounds. Neurons without a frequency column have no frequency rows.
+        With per-drop `polarities`, a polarity column follows the drop number.
+        """
+        metrics = [(neuron, "events", col) for neuron, col in zip(self.neuron_columns, self.neuron_columns)]
+        metrics += [(neuron, "frequency", self.frequency_columns[neuron]) for neuron in self.neuron_columns if neuron in self.frequency_columns]
+        column_index = {col: j for j, col in enumerate(self.stat_columns)}
+        selected = [column_index[col] for _, _, col in metrics]
+
+        n_drops, n_windows, n_metrics = len(windows), len(WINDOW_NAMES), len(metrics)
+        shape = (n_drops, n_windows, n_metrics)
+        drop = np.broadcast_to(np.arange(1, n_drops + 1)[:, None, None], shape)
+        window = np.broadcast_to(np.arange(n_windows)[None, :, None], shape)
+        metric = np.broadcast_to(np.arange(n_metrics)[None, None, :], shape)
+
+        table = pd.DataFrame({
+            "recording": pd.Categorical([self.dataname] * drop.size),
+            "drop": drop.ravel().astype(np.int32),
+            "window": pd.Categorical.from_codes(window.ravel(), categories=WINDOW_NAMES),
+            "neuron": pd.Categorical(np.array([m[0] for m in metrics], dtype=object)[metric.ravel()], categories=self.neuron_columns),
+            "metric": pd.Categorical(np.array([m[1] for m in metrics], dtype=object)[metric.ravel()], categories=["events", "frequency"]),
+            "mean": mean[:, :, selected].ravel(),
+            "std": std[:, :, selected].ravel(),
+            "n": n[:, :, selected].ravel().astype(np.int64),
+            "start": np.broadcast_to(windows[:, :, None, 0], shape).ravel(),
+            "end": np.broadcast_to(windows[:, :, None, 1], shape).ravel(),
+        })
+        if polarities is not None:
+            table.insert(2, "polarity", pd.Categorical(np.array(polarities, dtype=object)[drop.ravel() - 1], categories=["cold", "hot"]))
+        return table
+
+    def add_neuron_stats(self, rows, mean, std):
+        """Adds the formatted per-neuron event and frequency statistics (from `window_stats_matrix`) to each drop's result row."""
+        column_index = {col: j for j, col in enumerate(self.stat_columns)}
+
+        for i, drop_info in enumerate(rows):
+            for neuron in self.neuron_columns:
+                event_stats = [self.format_stats(mean[i, w, column_index[neuron]], std[i, w, column_index[neuron]]) for w in range(3)]
+                freq_col = self.frequency_columns.get(neuron, None)
+                if freq_col is not None:
+                    freq_stats = [self.format_stats(mean[i, w, column_index[freq_col]], std[i, w, column_index[freq_col]]) for w in range(3)]
+                else:
+                    freq_stats = ["N/A"] * 3
+
+                drop_info.update({
+                    f"{neuron} - Basal Period": event_stats[0],
+                    f"{neuron} - During": event_stats[1],
+                    f"{neuron} - After Resolution": event_stats[2],
+
+                    f"{neuron} - Basal Period Freq": freq_stats[0],
+                    f"{neuron} - During Freq": freq_stats[1],
+                    f"{neuron} - After Resolution Freq": freq_stats[2],
+                })
 
     def compute_segment_stats(self, start_time, end_time, neuron_col):
         """Computes mean ± std for neuron event count and frequency in a given time window."""
-        segment = self.df[(self.df[self.time_col] >= start_time) & (self.df[self.time_col] < end_time)]
+        with self.profiler.stage("compute_segment_stats"):
+            return self._compute_segment_stats(start_time, end_time, neuron_col)
+
+    def _compute_segment_stats(self, start_time, end_time, neuron_col):
         stats = {}
+        start_time = np.nan if start_time is None else start_time
+        end_time = np.nan if end_time is None else end_time
+        mean, std, _ = self.segment_stats.window_stats([start_time], [end_time])
+        column_index = {col: j for j, col in enumerate(self.segment_stats.columns)}
 
-        event_mean = segment[neuron_col].mean() if neuron_col in segment.columns else None
-        event_std = segment[neuron_col].std() if neuron_col in segment.columns else None
-        stats["Event Mean ± STD"] = self.format_stats(event_mean, event_std)
+        if neuron_col in column_index:
+            stats["Event Mean ± STD"] = self.format_stats(mean[0, column_index[neuron_col]], std[0, column_index[neuron_col]])
+        else:
+            stats["Event Mean ± STD"] = "N/A"
 
         freq_col = self.frequency_columns.get(neuron_col, None)
-        if freq_col and freq_col in segment.columns:
-            freq_mean = segment[freq_col].mean()
-            freq_std = segment[freq_col].std()
-            stats["Freq Mean ± STD"] = self.format_stats(freq_mean, freq_std)
+        if freq_col and freq_col in column_index:
+            stats["Freq Mean ± STD"] = self.format_stats(mean[0, column_index[freq_col]], std[0, column_index[freq_col]])
         else:
             stats["Freq Mean ± STD"] = "N/A"
 
@@ -223,140 +565,20 @@ class DropAnalysis:
 
 
     def plot_temp_with_annotations(self, drop_intervals, forced_computations, recovery_failures):
-        fig, ax = plt.subplots(figsize=(12, 6))
-
-        # Plot temperature over time
-        ax.plot(self.df[self.time_col], self.df[self.temp_col], color='blue', alpha=0.7, label="Temperature")
-
-        for idx, (basal_start, drop_time, during_start, during_end, after_start, after_end) in enumerate(drop_intervals):
-            # **Determine Hatching Style for Forced Computation in Green (Basal Period)**
-            forced_type = forced_computations[idx]
-            hatch_style = None
-            if forced_type == "no_recovery":
-                hatch_style = "oo"  # No full recovery, so basal temp was forced
-            elif forced_type == "overlap_prevention":
-                hatch_style = "//"  # Overlap prevention adjusted the basal window
-
-            # **Always show green (30s Before window), with hatching only if required**
-            ax.axvspan(basal_start, drop_time, color='green', alpha=0.2, hatch=hatch_style, label="30s Before" if idx == 0 else "")
-
-            # **Determine Hatching Style for Red (During Stim) if No Recovery**
-            stim_hatch = "\\" if recovery_failures[idx] else None  
-            
-            # **Always show red (During Stim window), with hatching if no recovery**
-            ax.axvspan(during_start, during_end, color='red', alpha=0.3, hatch=stim_hatch, label="During Stim" if idx == 0 else "")
-
-            # **Only plot after-period if it exists**
-            if after_start is not None and after_end is not None:
-                ax.axvspan(after_start, after_end, color='purple', alpha=0.2, label="30s After" if idx == 0 else "")
-
-        ax.set_xlabel("Time (s)")
-        ax.set_ylabel("Temperature (°C)")
-        ax.set_title("Temperature Drops and Stimulation Periods")
-        ax.legend()
-        
-        plt.savefig(os.path.join(self.output_dir, self.dataname, f"{self.dataname}_temp.png"), dpi=300)
-        plt.close()
+        """Plots the temperature trace with the drop windows and saves it."""
+        render_temp_plot(
+            os.path.join(self.output_dir, self.dataname, f"{self.dataname}_temp.png"),
+            self.channels.time, self.channels.temp,
+            drop_intervals, forced_computations, recovery_failures
+        )
 
     def plot_neuron(self, neuron, drop_intervals, plot_label, forced_computations, recovery_failures):
         """
         Plots neuron event or frequency data with stim periods and saves them.
         If force_basal_computation=True for a drop, the 30s Before window is still displayed but with hatching.
         """
-        fig, ax = plt.subplots(figsize=(10, 5))
-
-        is_frequency = neuron in self.frequency_columns.values()  # Check if it's a frequency plot
-        
-        if is_frequency:
-            # **Plot frequency data as a continuous line**
-            ax.plot(self.df[self.time_col], self.df[neuron], label=f"{neuron} {plot_label}", color='blue')
-        else:
-            # **Plot event counts as a histogram**
-            ax.hist(self.df[self.time_col], bins=50, weights=self.df[neuron], alpha=0.7, color='black', label=f"{neuron} {plot_label}")
-
-        for idx, (basal_start, drop_time, during_start, during_end, after_start, after_end) in enumerate(drop_intervals):
-            # **Determine Hatching Style for Forced Computation**
-            forced_type = forced_computations[idx]
-            hatch_style = None  # Default: No hatching
-
-            if forced_type == "no_recovery":
-                hatch_style = "oo"  # No full recovery, basal temp was forced
-            elif forced_type == "overlap_prevention":
-                hatch_style = "//"  # Overlap prevention adjusted the basal window
-
-            # **Always show green (30s Before window), with hatching if forced**
-            ax.axvspan(basal_start, drop_time, color='green', alpha=0.2, hatch=hatch_style, label="30s Before" if idx == 0 else "")
-
-            # **Only plot after-period if it exists**
-            if after_start is not None and after_end is not None:
-                ax.axvspan(after_start, after_end, color='purple', alpha=0.2, label="30s After" if idx == 0 else "")
-
-            stim_hatch = "\\" if recovery_failures[idx] else None  
-
-            # **Always show red (During Stim window), with hatching if no recovery**
-            ax.axvspan(during_start, during_end, color='red', alpha=0.3, hatch=stim_hatch, label="During Stim" if idx == 0 else "")
-
-        ax.set_xlabel("Time (s)")
-        ax.set_ylabel("Neuron Events" if not is_frequency else "Frequency (Hz)")
-        ax.set_title(f"{neuron} {plot_label} Response to Drop")
-        ax.legend()
-        ax.grid(True)
-
-        save_path = os.path.join(self.output_dir, self.dataname, f"{plot_label}.png")
-        plt.savefig(save_path, dpi=300)
-        plt.close()
-
-
-
-# data = [data/'08202024_Intact_Cold.csv', 'data/08292022_Female_Intact_Cold.csv', 'data/12172014_BAK_Day14_RatIV_Cold.csv', 'data/12192024_Bak_Day14_RatIII_Cold.csv']
-
-# data = [ 'data/12192024_Bak_Day14_RatIII_Cold.csv']
-
-# for dataset in data:
-
-#     data_name = os.path.basename(dataset) 
-
-#     out_folder = 'data_out'
-#     user_confirmation=True
-#     plot_orig=True
-#     plot_after=True
-
-#     force_basal_computation=True
-#     temp_col = 'Temp'
-#     time_col = 'Time'
-#     window_before = 30
-#     window_after = 30
-#     std_threshold = 2
-#     save_plots = True
-
-#     data = pd.read_csv(dataset)
-#     print(data_name)
-#     # path = 'data/'+dataset
-#     tool = TimeFinder(data, dataname = data_name, output_dir=out_folder, file_path=dataset)
-#     results = tool.run_analysis(plot_orig=plot_orig,user_confirmation=user_confirmation, plot_after=plot_after)
-#     print(results['drop_times'])
-#     # Initialize DropAnalysis 
-#     analysis = DropAnalysis(data, 
-#                             results["drop_times"], 
-#                             results["recovery_times"], 
-#                             output_dir= out_folder, 
-#                             force_basal_computation=force_basal_computation,
-#                             temp_col = temp_col,
-#                             time_col = time_col,
-#                             window_before=window_before,
-#                             window_after=window_after,
-#                             std_threshold=std_threshold,
-#                             save_plots = save_plots,
-#                             dataname=data_name,
-#                             )
-    
-#     analysis.analyze_drops()
-
-
-
-
-
-
-
-# Run visualization
-# plot_stim_periods(pd.read_csv(data[0]), drop_times, recovery_times)
+        render_neuron_plot(
+            os.path.join(self.output_dir, self.dataname, f"{plot_label}.png"),
+            self.channels.time, self.channels.column(neuron), neuron, plot_label,
+            neuron in self.frequency_columns.values(), drop_intervals, forced_computations, recovery_failures
+        )
@@ -0,0 +1,167 @@
+import contextlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+
+
+PROFILE_ENV = "CORNEAL_NERVE_PROFILE"
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+def profiling_requested():
+    """True if the CORNEAL_NERVE_PROFILE environment variable is set to a non-empty, non-zero value."""
+    return os.environ.get(PROFILE_ENV, "").strip().lower() not in ("", "0", "false", "no", "off")
+
+
+class Profiler:
+    """
+    Records wall time, CPU time, peak memory and call counts per pipeline stage.
+
+    `stage(name)` is a context manager; when the profiler is disabled it returns a
+    shared no-op context, so instrumented code costs one attribute check.
+    Peak memory is the peak traced allocation above the stage's starting point
+    (tracemalloc, started when profiling is enabled with `trace_memory`); nested
+    stages are supported. Stages with a `detail` (e.g. each plot) are also listed
+    individually in the report.
+    """
+
+    def __init__(self, enabled=None, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+        if enabled if enabled is not None else profiling_requested():
+            self.enable()
+
+    def enable(self):
+        self.enabled = True
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        """Forgets every recorded stage."""
+        with self._lock:
+            self.stages = {}
+            self.details = []
+
+    def stage(self, name, detail=None):
+        """Context manager measuring one stage; a no-op when profiling is off."""
+        if not self.enabled:
+            return _NULL_STAGE
+        return self._measure(name, detail)
+
+    @contextlib.contextmanager
+    def _measure(self, name, detail):
+        stack = self._stack()
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], peak)  # Keep the enclosing stage's peak before resetting
+            tracemalloc.reset_peak()
+        else:
+            current = 0
+        frame = {"start": current, "peak": current}
+        stack.append(frame)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            stack.pop()
+            peak_bytes = 0
+            if tracing:
+                peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+                peak_bytes = peak - frame["start"]
+                if stack:
+                    stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+            self.add(name, wall, cpu, peak_bytes, detail)
+
+    def add(self, name, wall_s, cpu_s, peak_bytes=0, detail=None):
+        """Adds one measured call of a stage (used for work measured elsewhere, e.g. in a worker process)."""
+        with self._lock:
+            stats = self.stages.setdefault(name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "peak_mb": 0.0})
+            stats["calls"] += 1
+            stats["wall_s"] += wall_s
+            stats["cpu_s"] += cpu_s
+            stats["peak_mb"] = max(stats["peak_mb"], peak_bytes / 1024 ** 2)
+            if detail is not None:
+                self.details.append({"stage": name, "detail": detail, "wall_s": wall_s, "cpu_s": cpu_s,
+                                     "peak_mb": peak_bytes / 1024 ** 2})
+
+    def report(self, **info):
+        """The recorded stages as a JSON-serialisable dict (extra `info` keys are included as-is)."""
+        with self._lock:
+            stages = {name: {key: round(value, 6) if isinstance(value, float) else value for key, value in stats.items()}
+                      for name, stats in self.stages.items()}
+            details = [{key: round(value, 6) if isinstance(value, float) else value for key, value in entry.items()}
+                       for entry in self.details]
+        return {**info, "memory_traced": self.trace_memory, "stages": stages, "details": details}
+
+    def write_report(self, path, **info):
+        """Writes `report()` as JSON (atomically) and returns the path."""
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.report(**info), f, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+
+def timed_call(fn, *args):
+    """
+    Runs `fn(*args)` and returns (result, (wall_s, cpu_s, peak_bytes)); meant for
+    worker processes, whose timings are then added to the parent's profiler.
+    """
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    start_current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        result = fn(*args)
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        peak = tracemalloc.get_traced_memory()[1] - start_current
+        if started_tracing:
+            tracemalloc.stop()
+    return result, (wall, cpu, peak)
+
+
+def collect_profiles(output_dir):
+    """Gathers every `profile_<name>.json` under `output_dir` into one tidy table (one row per recording and stage)."""
+    import pandas as pd
+
+    rows = []
+    for folder, _, files in os.walk(output_dir):
+        for name in sorted(files):
+            if name.startswith("profile_") and name.endswith(".json"):
+                with open(os.path.join(folder, name)) as f:
+                    report = json.load(f)
+                for stage, stats in report["stages"].items():
+                    rows.append({"recording": report.get("recording", name[len("profile_"):-len(".json")]), "stage": stage, **stats})
+    return pd.DataFrame(rows, columns=["recording", "stage", "calls", "wall_s", "cpu_s", "peak_mb"])
+
+
+_default_profiler = None
+
+
+def get_profiler():
+    """The process-wide profiler shared by TimeFinder, DropAnalysis and recording loading (enabled by CORNEAL_NERVE_PROFILE)."""
+    global _default_profiler
+    if _default_profiler is None:
+        _default_profiler = Profiler()
+    return _default_profiler
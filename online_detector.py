@@ -0,0 +1,304 @@
+import math
+from collections import deque
+
+import numpy as np
+
+from segment_stats import RunningStats
+
+
+class OnlineDropDetector:
+    """
+    Incremental drop detector for live acquisition.
+
+    Samples are pushed one at a time (or in small blocks) as they arrive, and
+    drop and recovery events are returned as soon as they are known. Detection
+    follows `TimeFinder.detect_drops` with the same `neighbor_threshold`,
+    `preced_window`, `drop_factor` and `deriv_thresh` semantics: the central
+    derivative of a sample needs the next sample, so events are reported one
+    sample late, and every push costs O(1) work.
+
+    The detector also runs the `DropAnalysis` windows for the temperature and any
+    `value_columns` (event counts, frequencies): a sliding basal window is kept
+    with running sums, so each drop's basal statistics and recovery threshold are
+    ready at the drop event, and the during / after window statistics are
+    emitted the moment those windows close. With `detect_hot_points` the windows
+    follow `DropAnalysis(polarity="hot")`: thresholds lie above the basal mean.
+
+    Events are dicts with a "type" of "drop", "recovery", "full_recovery",
+    "recovery_failed" or "window" (the latter with "window" set to "basal",
+    "during" or "after" and mean / std / n arrays ordered as `self.columns`).
+    """
+
+    def __init__(self, detect_hot_points=False, neighbor_threshold=5, preced_window=30, drop_factor=1.5,
+                 deriv_thresh=1, window_before=30, window_after=30, std_threshold=2,
+                 force_basal_computation=False, value_columns=None, temp_col="Temp"):
+        self.detect_hot_points = detect_hot_points
+        self.neighbor_threshold = neighbor_threshold
+        self.preceding_window = preced_window
+        self.drop_threshold_factor = drop_factor
+        self.derivative_threshold = deriv_thresh if detect_hot_points else -1 * deriv_thresh
+        self.window_before = window_before
+        self.window_after = window_after
+        self.std_threshold = std_threshold
+        self.force_basal_computation = force_basal_computation
+        self.columns = [temp_col] + list(value_columns or [])
+
+        self.drop_times = []
+        self.recovery_times = []
+        self.windows = []   # One dict per drop, with the keys of `DropAnalysis.compute_drop_windows`
+
+        self._n = 0
+        self._recent = deque(maxlen=3)                       # (time, temp, row) of the newest samples
+        self._abs_diff_sum = deque(maxlen=preced_window + 3)  # Running sum of |diff| for the newest samples
+        self._dx = None
+        self._uniform = True
+        self._last_candidate = None
+        self._cluster_found = False
+        self._cluster_baseline = math.nan
+        self._waiting = []  # Drops whose recovery (derivative sign flip) has not happened yet
+
+        self._offset = None
+        self._basal_samples = deque()  # Settled (time, row) pairs that can still fall in a basal window
+        self._basal = None
+        self._current = None           # Index of the drop whose windows are still open
+        self._during = None
+        self._after = None
+
+    def push(self, time_value, temp_value, values=None):
+        """Adds one sample and returns the events it completes."""
+        time_value, temp_value = float(time_value), float(temp_value)
+        row = np.concatenate(([temp_value], np.asarray(values if values is not None else [], dtype=float)))
+        if len(row) != len(self.columns):
+            raise ValueError(f"Expected {len(self.columns) - 1} values per sample, got {len(row) - 1}.")
+        if self._recent and time_value < self._recent[-1][0]:
+            raise ValueError("Samples must be pushed in time order.")
+        if self._offset is None:
+            self._offset = np.round(np.nan_to_num(row))
+            self._basal = RunningStats(self._offset)
+
+        events = []
+        if self._recent:
+            prev_time, prev_temp, _ = self._recent[-1]
+            self._abs_diff_sum.append(self._abs_diff_sum[-1] + abs(temp_value - prev_temp))
+            dx = time_value - prev_time
+            if self._dx is None:
+                self._dx = dx
+            elif dx != self._dx:
+                self._uniform = False
+        else:
+            self._abs_diff_sum.append(0.0)
+        self._recent.append((time_value, temp_value, row))
+        self._n += 1
+
+        if self._n == 2:
+            (t0, y0, _), (t1, y1, _) = self._recent
+            self._on_derivative(0, (y1 - y0) / (t1 - t0), events)
+        elif self._n >= 3:
+            self._on_derivative(self._n - 2, self._central_derivative(), events)
+            self._settle(self._recent[0], events)
+        return events
+
+    def push_block(self, time_values, temp_values, values=None):
+        """Adds a block of samples (`values` is a (rows, columns) array or None) and returns their events."""
+        events = []
+        for i in range(len(time_values)):
+            events.extend(self.push(time_values[i], temp_values[i], None if values is None else values[i]))
+        return events
+
+    def finish(self):
+        """Ends the recording: processes the last samples and closes any open windows."""
+        events = []
+        if self._n < 2:
+            return events
+        (t0, y0, _), (t1, y1, _) = list(self._recent)[-2:]
+        self._on_derivative(self._n - 1, (y1 - y0) / (t1 - t0), events, is_last=True)
+        self._settle(self._recent[-2], events)
+        self._settle(self._recent[-1], events, is_last=True)
+        self._close_current(self._recent[-1][0], events, end_of_recording=True)
+        return events
+
+    def _central_derivative(self):
+        """Interior `np.gradient` formula for the middle of the three newest samples."""
+        (t0, y0, _), (t1, y1, _), (t2, y2, _) = self._recent
+        if self._uniform:
+            return (y2 - y0) / (2. * self._dx)
+        dx1, dx2 = t1 - t0, t2 - t1
+        a = -(dx2) / (dx1 * (dx1 + dx2))
+        b = (dx2 - dx1) / (dx1 * dx2)
+        c = dx1 / (dx2 * (dx1 + dx2))
+        return a * y0 + b * y1 + c * y2
+
+    def _abs_diff_at(self, index):
+        return self._abs_diff_sum[index - (self._n - len(self._abs_diff_sum))]
+
+    def _on_derivative(self, index, derivative, events, is_last=False):
+        """Candidate clustering, significance test and recovery flips for the derivative at sample `index`."""
+        # A derivative at sample k is reported at sample k - 1 (the batch off-by-one correction)
+        event_sample = self._recent[-2] if is_last else self._recent[-3] if index >= 1 else (None, None, None)
+        event_time = event_sample[0]
+
+        # **Recovery: the first sign flip after a drop (never the last sample)**
+        flipped = derivative < 0 if self.detect_hot_points else derivative > 0
+        if flipped and not is_last and self._waiting:
+            for drop in self._waiting:
+                self.recovery_times.append(event_time)
+                events.append({"type": "recovery", "drop": drop, "time": event_time})
+                self.windows[drop]["response_time"] = event_time
+                if drop == self._current and self._during is None:
+                    self._during = RunningStats(self._offset)  # The recovery search and during window start here
+            self._waiting = []
+
+        candidate = derivative > self.derivative_threshold if self.detect_hot_points else derivative < self.derivative_threshold
+        if not candidate:
+            return
+
+        # **Cluster candidates; the baseline fluctuation is fixed when a cluster opens**
+        if self._last_candidate is None or index - self._last_candidate > self.neighbor_threshold:
+            window_start = max(0, index - self.preceding_window)
+            n_diffs = index - window_start - 1
+            self._cluster_baseline = ((self._abs_diff_at(max(index - 1, 0)) - self._abs_diff_at(window_start)) / n_diffs
+                                      if n_diffs > 0 else math.nan)
+            self._cluster_found = False
+        self._last_candidate = index
+
+        if not self._cluster_found and abs(derivative) > self.drop_threshold_factor * self._cluster_baseline:
+            self._cluster_found = True
+            self._on_drop(event_time, event_sample[1], events)
+
+    def _on_drop(self, drop_time, drop_temp, events):
+        """Closes the previous drop's windows and resolves the new drop's basal window and threshold."""
+        self._close_current(drop_time, events)
+        previous = self.windows[-1] if self.windows else None
+        drop = len(self.windows)
+        self.drop_times.append(drop_time)
+        self._waiting.append(drop)
+
+        # **Basal window start, chained on the previous drop's full recovery**
+        default_start = max(0, drop_time - self.window_before)
+        forced_basal = None
+        basal_start = default_start
+        if self.force_basal_computation:
+            forced_basal = "global"
+        elif previous is not None and previous["full_recovery_time"] >= drop_time:
+            basal_start, forced_basal = drop_time, "no_recovery"
+        elif previous is not None and default_start < previous["full_recovery_time"]:
+            basal_start, forced_basal = previous["full_recovery_time"], "overlap_prevention"
+
+        # **Basal statistics: the running window minus samples outside [basal_start, drop_time)**
+        basal = self._basal.copy()
+        for sample_time, row in reversed(self._basal_samples):
+            if sample_time < drop_time:
+                break
+            basal.remove(row)
+        for sample_time, row in self._basal_samples:
+            if sample_time >= basal_start or sample_time >= drop_time:
+                break
+            basal.remove(row)
+        mean, std, n = basal.stats()
+        if n[0] > 0:
+            # Heat stimuli recover once the temperature falls back below mean + k·std
+            threshold = mean[0] + self.std_threshold * std[0] if self.detect_hot_points else mean[0] - self.std_threshold * std[0]
+        else:
+            threshold = drop_temp  # Empty basal window: fall back to the temperature at the drop
+
+        self.windows.append({
+            "basal_start": basal_start,
+            "drop_time": drop_time,
+            "response_time": None,
+            "full_recovery_time": None,
+            "after_start": None,
+            "after_end": None,
+            "reached_threshold": False,
+            "forced_basal": forced_basal,
+            "basal_temp_mean": mean[0] if n[0] > 0 else math.nan,
+            "basal_temp_std": std[0] if n[0] > 0 else math.nan,
+            "temp_threshold": threshold,
+            "stats": {"basal": (mean, std, n)},
+        })
+        self._current = drop
+        self._during = None
+        self._after = None
+        events.append({"type": "drop", "drop": drop, "time": drop_time, "threshold": threshold})
+        events.append(self._window_event(drop, "basal", basal_start, drop_time, (mean, std, n)))
+
+    def _settle(self, sample, events, is_last=False):
+        """Feeds a sample whose events are all known to the open windows and the basal window."""
+        sample_time, temp_value, row = sample
+
+        if self._current is not None:
+            window = self.windows[self._current]
+            if self._during is not None and self._after is None:
+                # **Recovery search: first sample back at the threshold (before the recording's last time)**
+                recovered = temp_value <= window["temp_threshold"] if self.detect_hot_points else temp_value >= window["temp_threshold"]
+                if not is_last and recovered:
+                    window["full_recovery_time"] = sample_time
+                    window["reached_threshold"] = True
+                    window["after_start"] = sample_time
+                    window["after_end"] = sample_time + self.window_after
+                    window["stats"]["during"] = self._during.stats()
+                    events.append({"type": "full_recovery", "drop": self._current, "time": sample_time})
+                    events.append(self._window_event(self._current, "during", window["response_time"], sample_time,
+                                                     window["stats"]["during"]))
+                    self._after = RunningStats(self._offset)
+                    if not self.force_basal_computation:
+                        self._drop_basal_samples_before(sample_time)
+                else:
+                    self._during.add(row)
+
+            if self._after is not None and "after" not in window["stats"]:
+                if sample_time < window["after_end"]:
+                    self._after.add(row)
+                else:
+                    self._close_after(window, events)
+
+        # **Sliding basal window: keep samples that can still fall in the next drop's basal window**
+        while self._basal_samples and self._basal_samples[0][0] < sample_time - self.window_before:
+            self._basal.remove(self._basal_samples.popleft()[1])
+        self._basal_samples.append((sample_time, row))
+        self._basal.add(row)
+
+    def _drop_basal_samples_before(self, start_time):
+        while self._basal_samples and self._basal_samples[0][0] < start_time:
+            self._basal.remove(self._basal_samples.popleft()[1])
+
+    def _close_after(self, window, events, end_time=None):
+        if end_time is not None and window["after_end"] > end_time:
+            window["after_end"] = end_time  # The after window stops at the next drop
+        window["stats"]["after"] = self._after.stats()
+        events.append(self._window_event(self._current, "after", window["after_start"], window["after_end"],
+                                         window["stats"]["after"]))
+
+    def _close_current(self, end_time, events, end_of_recording=False):
+        """Ends the open drop at the next drop (or the end of the recording)."""
+        if self._current is None:
+            return
+        window = self.windows[self._current]
+        if not window["reached_threshold"]:
+            window["full_recovery_time"] = end_time
+            events.append({"type": "recovery_failed", "drop": self._current, "time": end_time})
+        elif "after" not in window["stats"]:
+            self._close_after(window, events, None if end_of_recording else end_time)
+        self._current = None
+
+    def _window_event(self, drop, name, start, end, stats):
+        mean, std, n = stats
+        return {"type": "window", "drop": drop, "window": name, "start": start, "end": end,
+                "mean": mean, "std": std, "n": n}
+
+
+def replay(df, time_col="Time", temp_col="Temp", value_columns=None, block_size=1, **params):
+    """
+    Replays a recording through an OnlineDropDetector in blocks of `block_size`
+    samples, as an acquisition loop would, and returns the finished detector.
+    """
+    if value_columns is None:
+        value_columns = [col for col in df.columns if col not in (time_col, temp_col)]
+    detector = OnlineDropDetector(value_columns=value_columns, temp_col=temp_col, **params)
+    time_values = df[time_col].to_numpy(dtype=float)
+    temp_values = df[temp_col].to_numpy(dtype=float)
+    values = df[value_columns].to_numpy(dtype=float)
+    for start in range(0, len(df), block_size):
+        stop = start + block_size
+        detector.push_block(time_values[start:stop], temp_values[start:stop], values[start:stop])
+    detector.finish()
+    return detector
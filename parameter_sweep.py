@@ -0,0 +1,189 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from channel_schema import ChannelMatrix, ChannelSchema
+from detectors import POLARITIES, detect_drop_indices, event_polarities
+from recovery_finder import resolve_recovery_chain
+from segment_stats import SegmentStats
+
+
+# Parameters that can be swept, with the defaults used by TimeFinder and DropAnalysis
+DETECTION_PARAMS = {
+    "detect_hot_points": False,
+    "neighbor_threshold": 5,
+    "preced_window": 30,
+    "drop_factor": 1.5,
+    "deriv_thresh": 1,
+}
+ANALYSIS_PARAMS = {
+    "window_before": 30,
+    "window_after": 30,
+    "std_threshold": 2,
+    "force_basal_computation": False,
+}
+WINDOWS = ["basal", "during", "after"]
+
+
+class ParameterSweep:
+    """
+    Evaluates many detection and window parameter settings on one recording.
+
+    Everything that does not depend on the parameters is computed once: the
+    temperature derivative, the cumulative |diff| used for baseline fluctuation,
+    and the prefix-sum statistics of the temperature and every event / frequency
+    column. Each detection setting then costs one `detect_drop_indices` call, and
+    each analysis setting one batched recovery search and one statistics lookup.
+    """
+
+    def __init__(self, df, time_col="Time", temp_col="Temp"):
+        self.time_col = time_col
+        self.temp_col = temp_col
+        self.time = df[time_col].to_numpy(dtype=float)
+        self.temp = df[temp_col].to_numpy(dtype=float)
+        self.max_time = float(df[time_col].max())
+
+        schema = ChannelSchema(df.columns, time_col, temp_col)
+        self.neuron_columns, self.frequency_columns = schema.units, schema.frequency_columns
+        self.stat_columns = schema.stat_columns
+
+        self.derivative = np.gradient(self.temp, self.time)
+        self.abs_diff_sum = np.concatenate(([0.0], np.cumsum(np.abs(np.diff(self.temp)))))
+        self.temp_stats = SegmentStats(self.time, self.temp)
+        self.channel_stats = SegmentStats.from_channels(ChannelMatrix.from_frame(df, schema))
+
+    def detect(self, detect_hot_points, neighbor_threshold, preced_window, drop_factor, deriv_thresh):
+        """Drop and recovery times for one detection setting, as `TimeFinder.run_analysis` returns them."""
+        drops, recoveries = detect_drop_indices(
+            self.temp, self.derivative, deriv_thresh if detect_hot_points else -1 * deriv_thresh,
+            neighbor_threshold, preced_window, drop_factor, detect_hot_points, abs_diff_sum=self.abs_diff_sum
+        )
+        if drops is None:
+            return np.empty(0), np.empty(0)
+        return self.time[drops], self.time[recoveries]
+
+    def analyze(self, drop_times, recovery_times, window_before, window_after, std_threshold, force_basal_computation,
+                polarity="cold"):
+        """
+        Window statistics for one analysis setting, matching `DropAnalysis` with
+        the same `polarity` (hot events get thresholds above the basal mean).
+
+        Returns (recovery_failures, mean, std, n) where the statistics have shape
+        (drop, window, column) with columns ordered as `self.stat_columns`.
+        """
+        n_drops = min(len(drop_times), len(recovery_times))
+        next_drop_times = np.append(drop_times[1:], self.max_time)[:n_drops]
+        if polarity not in POLARITIES:
+            raise ValueError(f"Unknown polarity '{polarity}'; choose from {', '.join(POLARITIES)}.")
+        if polarity == "both":
+            hot = event_polarities(self.time, self.temp, drop_times[:n_drops], recovery_times[:n_drops]) == "hot"
+        else:
+            hot = np.full(n_drops, polarity == "hot")
+
+        chain = resolve_recovery_chain(
+            self.time, self.temp, drop_times[:n_drops], recovery_times[:n_drops], next_drop_times,
+            window_before=window_before, std_threshold=std_threshold,
+            force_basal_computation=force_basal_computation, temp_stats=self.temp_stats, hot=hot
+        )
+        reached = chain["recovery_index"] >= 0
+
+        # **Basal / during / after window bounds for every drop at once**
+        after_end = chain["full_recovery_time"] + window_after
+        has_next = np.arange(n_drops) + 1 < len(drop_times)
+        after_end = np.where(has_next & (after_end > next_drop_times), next_drop_times, after_end)
+        windows = np.full((n_drops, 3, 2), np.nan)
+        windows[:, 0, 0], windows[:, 0, 1] = chain["basal_start"], drop_times[:n_drops]
+        windows[reached, 1, 0], windows[reached, 1, 1] = recovery_times[:n_drops][reached], chain["full_recovery_time"][reached]
+        windows[reached, 2, 0], windows[reached, 2, 1] = chain["full_recovery_time"][reached], after_end[reached]
+
+        mean, std, n = self.channel_stats.window_stats(windows[..., 0], windows[..., 1])
+        return ~reached, mean, std, n
+
+    def evaluate(self, detection, analysis_settings):
+        """
+        Runs one detection setting and every analysis setting on its drops.
+
+        Returns (summary rows, stats rows) for the tidy result tables.
+        """
+        drop_times, recovery_times = self.detect(**detection)
+        summary_rows, stats_rows = [], []
+        for analysis in analysis_settings:
+            setting = {**detection, **analysis}
+            failures, mean, std, n = self.analyze(drop_times, recovery_times, **analysis,
+                                                  polarity="hot" if detection["detect_hot_points"] else "cold")
+            summary_rows.append({**setting, "num_drops": len(drop_times), "analyzed_drops": len(failures),
+                                 "recovery_failures": int(failures.sum())})
+
+            # **Per-column, per-window averages across drops**
+            with np.errstate(invalid="ignore"):
+                has_data = ~np.isnan(mean)
+                n_with_data = has_data.sum(axis=0)
+                mean_of_means = np.where(n_with_data > 0, np.where(has_data, mean, 0).sum(axis=0) / n_with_data, np.nan)
+                has_std = ~np.isnan(std)
+                n_with_std = has_std.sum(axis=0)
+                mean_of_stds = np.where(n_with_std > 0, np.where(has_std, std, 0).sum(axis=0) / n_with_std, np.nan)
+            for j, column in enumerate(self.stat_columns):
+                for w, window in enumerate(WINDOWS):
+                    stats_rows.append({**setting, "column": column, "window": window,
+                                       "mean": mean_of_means[w, j], "std": mean_of_stds[w, j],
+                                       "n_drops": int(n_with_data[w, j])})
+        return summary_rows, stats_rows
+
+
+def expand_grid(grid):
+    """
+    Splits a {parameter: values} grid into detection settings and analysis
+    settings (lists of dicts); parameters not in the grid keep their defaults.
+    """
+    unknown = set(grid) - set(DETECTION_PARAMS) - set(ANALYSIS_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {', '.join(sorted(unknown))}")
+
+    def combinations(defaults):
+        names = list(defaults)
+        values = [list(grid[name]) if name in grid else [defaults[name]] for name in names]
+        return [dict(zip(names, combo)) for combo in itertools.product(*values)]
+
+    return combinations(DETECTION_PARAMS), combinations(ANALYSIS_PARAMS)
+
+
+_worker_sweep = None
+
+
+def _init_worker(sweep):
+    global _worker_sweep
+    _worker_sweep = sweep
+
+
+def _evaluate_in_worker(detection, analysis_settings):
+    return _worker_sweep.evaluate(detection, analysis_settings)
+
+
+def run_sweep(df, grid, time_col="Time", temp_col="Temp", workers=None):
+    """
+    Evaluates every combination of the parameter grid on a recording.
+
+    Detection settings are spread across `workers` processes (0 runs in the
+    calling process); each worker receives the precomputed sweep structures once.
+    Returns two tidy DataFrames: `summary` with one row per setting (drop count,
+    analyzed drops, recovery failures) and `stats` with one row per setting,
+    column and window (mean of the per-drop window means and stds, and the number
+    of drops with data in that window).
+    """
+    detection_settings, analysis_settings = expand_grid(grid)
+    sweep = ParameterSweep(df, time_col=time_col, temp_col=temp_col)
+    workers = workers if workers is not None else min(os.cpu_count() or 1, len(detection_settings))
+
+    if workers == 0 or len(detection_settings) == 1:
+        results = [sweep.evaluate(detection, analysis_settings) for detection in detection_settings]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(sweep,)) as pool:
+            results = list(pool.map(_evaluate_in_worker, detection_settings, itertools.repeat(analysis_settings),
+                                    chunksize=max(1, len(detection_settings) // (4 * workers))))
+
+    summary = pd.DataFrame([row for rows, _ in results for row in rows])
+    stats = pd.DataFrame([row for _, rows in results for row in rows])
+    return summary, stats
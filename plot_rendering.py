@@ -0,0 +1,256 @@
+import contextlib
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+from matplotlib.figure import Figure
+
+from instrumentation import timed_call
+
+
+_NULL_STAGE = contextlib.nullcontext()
+PLOT_DPI = 300
+EVENT_HISTOGRAM_BINS = 50
+
+
+def minmax_decimate(time_values, values, n_bins):
+    """
+    Shape-preserving downsampling of a line trace for drawing.
+
+    The time range is split into `n_bins` equal bins (about one per pixel
+    column) and only each bin's minimum and maximum samples are kept, in time
+    order, so the drawn envelope, spikes and dips look the same as with every
+    sample. Traces with at most 2 * `n_bins` samples are returned unchanged;
+    NaN samples are skipped. `time_values` must be ascending.
+    """
+    time_values = np.asarray(time_values, dtype=float)
+    values = np.asarray(values, dtype=float)
+    n = len(time_values)
+    if n <= 2 * n_bins or not time_values[-1] > time_values[0]:
+        return time_values, values
+
+    edges = np.linspace(time_values[0], time_values[-1], n_bins + 1)
+    starts = np.unique(np.searchsorted(time_values, edges[:-1], side="left"))
+    starts = starts[starts < n]
+    counts = np.diff(np.append(starts, n))
+
+    # **First index of each bin's minimum and maximum, in one pass each**
+    positions = np.arange(n)
+    keep = []
+    for reduce in (np.fmin, np.fmax):
+        extreme = np.repeat(reduce.reduceat(values, starts), counts)
+        keep.append(np.minimum.reduceat(np.where(values == extreme, positions, n), starts))
+    keep = np.unique(np.concatenate(keep))
+    keep = keep[keep < n]  # Bins with only NaN samples
+    return time_values[keep], values[keep]
+
+
+def figure_pixels(fig):
+    """Width of a figure in pixels when saved at PLOT_DPI (the decimation bin count)."""
+    return int(fig.get_figwidth() * PLOT_DPI)
+
+
+def event_histograms(time_values, events, bins=EVENT_HISTOGRAM_BINS):
+    """
+    Event-count histograms of every unit over time, in one binned reduction.
+
+    `events` is a samples × units matrix (or one column). Returns (bin_edges,
+    counts) with counts of shape bins × units, identical to
+    `np.histogram(time_values, bins, weights=events[:, j])` for each unit.
+    `time_values` must be ascending.
+    """
+    time_values = np.asarray(time_values, dtype=float)
+    events = np.asarray(events)
+    column = events.ndim == 1
+    events = events[:, None] if column else events
+    if len(time_values) == 0:
+        edges = np.linspace(0, 1, bins + 1)
+        counts = np.zeros((bins, events.shape[1]))
+    else:
+        low, high = time_values[0], time_values[-1]
+        low, high = (low - 0.5, high + 0.5) if low == high else (low, high)  # Same range as np.histogram
+        edges = np.linspace(low, high, bins + 1)
+        starts = np.searchsorted(time_values, edges[:-1], side="left")
+        ends = np.append(starts[1:], len(time_values))
+        filled = ends > starts
+        counts = np.zeros((bins, events.shape[1]), dtype=np.int64 if events.dtype.kind in "iub" else float)
+        counts[filled] = np.add.reduceat(events, starts[filled], axis=0, dtype=counts.dtype)
+    return edges, counts[:, 0] if column else counts
+
+
+def draw_drop_windows(ax, drop_intervals, forced_computations, recovery_failures, during_last=False):
+    """Shades the basal (green), during (red) and after (purple) windows of every drop."""
+    for idx, (basal_start, drop_time, during_start, during_end, after_start, after_end) in enumerate(drop_intervals):
+        # **Determine Hatching Style for Forced Computation in Green (Basal Period)**
+        forced_type = forced_computations[idx]
+        hatch_style = None
+        if forced_type == "no_recovery":
+            hatch_style = "oo"  # No full recovery, so basal temp was forced
+        elif forced_type == "overlap_prevention":
+            hatch_style = "//"  # Overlap prevention adjusted the basal window
+
+        # **Always show green (30s Before window), with hatching only if required**
+        ax.axvspan(basal_start, drop_time, color='green', alpha=0.2, hatch=hatch_style, label="30s Before" if idx == 0 else "")
+
+        # **Always show red (During Stim window), with hatching if no recovery**
+        stim_hatch = "\\" if recovery_failures[idx] else None
+        if not during_last:
+            ax.axvspan(during_start, during_end, color='red', alpha=0.3, hatch=stim_hatch, label="During Stim" if idx == 0 else "")
+
+        # **Only plot after-period if it exists**
+        if after_start is not None and after_end is not None:
+            ax.axvspan(after_start, after_end, color='purple', alpha=0.2, label="30s After" if idx == 0 else "")
+
+        if during_last:
+            ax.axvspan(during_start, during_end, color='red', alpha=0.3, hatch=stim_hatch, label="During Stim" if idx == 0 else "")
+
+
+def render_temp_plot(save_path, time_values, temp_values, drop_intervals, forced_computations, recovery_failures):
+    """Renders the annotated temperature trace to `save_path`."""
+    fig = Figure(figsize=(12, 6))
+    ax = fig.subplots()
+
+    # Plot temperature over time (min/max per pixel column for long recordings)
+    ax.plot(*minmax_decimate(time_values, temp_values, figure_pixels(fig)), color='blue', alpha=0.7, label="Temperature")
+    draw_drop_windows(ax, drop_intervals, forced_computations, recovery_failures)
+
+    ax.set_xlabel("Time (s)")
+    ax.set_ylabel("Temperature (°C)")
+    ax.set_title("Temperature Drops and Stimulation Periods")
+    ax.legend()
+
+    fig.savefig(save_path, dpi=PLOT_DPI)
+    return save_path
+
+
+def render_neuron_plot(save_path, time_values, values, neuron, plot_label, is_frequency,
+                       drop_intervals, forced_computations, recovery_failures):
+    """Renders one neuron's event histogram or frequency trace with the drop windows to `save_path`."""
+    if not is_frequency:
+        bin_edges, counts = event_histograms(time_values, values)
+        return render_event_plot(save_path, bin_edges, counts, neuron, plot_label,
+                                 drop_intervals, forced_computations, recovery_failures)
+
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
+
+    # **Plot frequency data as a continuous line** (min/max per pixel column for long recordings)
+    ax.plot(*minmax_decimate(time_values, values, figure_pixels(fig)), label=f"{neuron} {plot_label}", color='blue')
+    return _finish_neuron_plot(fig, ax, save_path, neuron, plot_label, True,
+                               drop_intervals, forced_computations, recovery_failures)
+
+
+def render_event_plot(save_path, bin_edges, counts, neuron, plot_label, drop_intervals, forced_computations, recovery_failures):
+    """Renders one neuron's event histogram from precomputed bins (see `event_histograms`) to `save_path`."""
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
+
+    # **Plot event counts as a histogram**
+    ax.hist(bin_edges[:-1], bins=bin_edges, weights=counts, alpha=0.7, color='black', label=f"{neuron} {plot_label}")
+    return _finish_neuron_plot(fig, ax, save_path, neuron, plot_label, False,
+                               drop_intervals, forced_computations, recovery_failures)
+
+
+def _finish_neuron_plot(fig, ax, save_path, neuron, plot_label, is_frequency,
+                        drop_intervals, forced_computations, recovery_failures):
+    draw_drop_windows(ax, drop_intervals, forced_computations, recovery_failures, during_last=True)
+
+    ax.set_xlabel("Time (s)")
+    ax.set_ylabel("Neuron Events" if not is_frequency else "Frequency (Hz)")
+    ax.set_title(f"{neuron} {plot_label} Response to Drop")
+    ax.legend()
+    ax.grid(True)
+
+    fig.savefig(save_path, dpi=PLOT_DPI)
+    return save_path
+
+
+class PlotRenderer:
+    """
+    Renders figures on a pool of worker processes.
+
+    Figures are drawn with the object-oriented matplotlib API, so workers never
+    touch pyplot or a GUI backend. `submit` returns immediately; `wait` blocks
+    until every submitted figure is saved and returns the saved paths.
+    With `workers=0` (the default) figures are rendered synchronously in the
+    calling process; `workers=None` starts a pool of one process per CPU. Pools
+    use spawned workers, so scripts that start one need an
+    `if __name__ == "__main__":` guard.
+    When an enabled `profiler` is given, every figure is recorded as a "plot" stage.
+    """
+
+    def __init__(self, workers=0, profiler=None):
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.profiler = profiler
+        self._pool = None
+        self._futures = []
+
+    def submit(self, render_fn, *args):
+        """
+        Queues one figure; `render_fn` must be a module-level function so it can be sent to a worker.
+        While profiling with a worker pool, the returned future resolves to (path, timings); `wait` unpacks it.
+        """
+        profiled = self.profiler is not None and self.profiler.enabled
+        if self.workers == 0:
+            future = Future()
+            try:
+                with self.profiler.stage("plot", detail=self._plot_name(args)) if profiled else _NULL_STAGE:
+                    future.set_result(render_fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            profiled = False
+        else:
+            if self._pool is None:
+                # Spawned workers are safe to start from GUI or worker threads
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            if profiled:
+                future = self._pool.submit(timed_call, render_fn, *args)  # Timed in the worker, recorded in `wait`
+            else:
+                future = self._pool.submit(render_fn, *args)
+        self._futures.append((future, self._plot_name(args) if profiled else None))
+        return future
+
+    def pending(self):
+        """Number of submitted figures that are not finished yet."""
+        return sum(1 for future, _ in self._futures if not future.done())
+
+    def wait(self):
+        """Waits for all submitted figures and returns their paths; re-raises the first rendering error."""
+        futures, self._futures = self._futures, []
+        paths = []
+        for future, plot_name in futures:
+            result = future.result()
+            if plot_name is not None:
+                result, (wall_s, cpu_s, peak_bytes) = result
+                self.profiler.add("plot", wall_s, cpu_s, peak_bytes, detail=plot_name)
+            paths.append(result)
+        return paths
+
+    @staticmethod
+    def _plot_name(args):
+        return os.path.basename(args[0]) if args and isinstance(args[0], str) else None
+
+    def cancel(self, wait=False):
+        """
+        Drops every figure that has not started rendering and stops the worker pool,
+        waiting for the figures already rendering only when `wait` is True.
+        """
+        futures, self._futures = self._futures, []
+        for future, _ in futures:
+            future.cancel()
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+
+    def shutdown(self, wait=True):
+        """Stops the worker pool (after pending figures finish when `wait` is True)."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown(wait=True)
@@ -0,0 +1,217 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from channel_schema import FREQUENCY_DTYPE
+
+
+ALIGNMENTS = ("drop", "response", "recovery")  # Drop time, response (detected recovery point) or full recovery time
+PSTH_DTYPE = np.float32
+
+
+class PSTH:
+    """
+    Peri-stimulus time histograms of every drop and unit.
+
+    `counts` is a (drop, unit, bin) tensor of event counts and `frequencies` a
+    (drop, frequency unit, bin) tensor of mean frequencies, with bins given by
+    `bin_edges` relative to each drop's alignment time. Bins outside the
+    recording (and drops without an alignment time) are NaN.
+    """
+
+    def __init__(self, counts, frequencies, bin_edges, units, frequency_units, align, align_times, polarities=None,
+                 recording=None):
+        self.counts = counts
+        self.frequencies = frequencies
+        self.bin_edges = np.asarray(bin_edges, dtype=float)
+        self.units = list(units)
+        self.frequency_units = list(frequency_units)
+        self.align = align
+        self.align_times = np.asarray(align_times, dtype=float)
+        self.polarities = None if polarities is None else np.asarray(polarities, dtype=str)
+        self.recording = recording
+
+    @property
+    def bin_centres(self):
+        return (self.bin_edges[:-1] + self.bin_edges[1:]) / 2
+
+    @property
+    def bin_width(self):
+        return float(self.bin_edges[1] - self.bin_edges[0])
+
+    def mean_curves(self, metric="events", drops=None):
+        """
+        Drop-averaged curves: mean, SEM and number of drops per (unit, bin),
+        ignoring NaN bins. `drops` (indices or a boolean mask) selects the drops averaged.
+        """
+        if metric not in ("events", "frequency"):
+            raise ValueError(f"Unknown metric '{metric}'; choose 'events' or 'frequency'.")
+        tensor = self.counts if metric == "events" else self.frequencies
+        if drops is not None:
+            tensor = tensor[drops]
+        values = tensor.astype(float)
+        valid = ~np.isnan(values)
+        n = valid.sum(axis=0)
+        finite = np.where(valid, values, 0.0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = finite.sum(axis=0) / n
+            variance = (np.where(valid, values - mean, 0.0) ** 2).sum(axis=0) / (n - 1)
+            sem = np.sqrt(variance) / np.sqrt(n)
+        return mean, np.where(n > 1, sem, np.nan), n
+
+    def curves_table(self):
+        """Long table of the drop-averaged curves: unit, metric, bin time (centre), mean, sem and n_drops."""
+        frames = []
+        for metric, units in (("events", self.units), ("frequency", self.frequency_units)):
+            if not units:
+                continue
+            mean, sem, n = self.mean_curves(metric)
+            shape = mean.shape
+            frames.append(pd.DataFrame({
+                "neuron": np.repeat(np.array(units, dtype=object), shape[1]),
+                "metric": metric,
+                "time": np.tile(self.bin_centres, shape[0]),
+                "mean": mean.ravel(),
+                "sem": sem.ravel(),
+                "n_drops": n.ravel(),
+            }))
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+            columns=["neuron", "metric", "time", "mean", "sem", "n_drops"])
+
+    def save(self, path):
+        """Writes the tensors and their axes to a compressed .npz file (no pickled objects)."""
+        arrays = {
+            "counts": self.counts,
+            "frequencies": self.frequencies,
+            "bin_edges": self.bin_edges,
+            "units": np.array(self.units, dtype=str),
+            "frequency_units": np.array(self.frequency_units, dtype=str),
+            "align": np.array(self.align),
+            "align_times": self.align_times,
+            "recording": np.array(self.recording or ""),
+        }
+        if self.polarities is not None:
+            arrays["polarities"] = self.polarities
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["counts"], data["frequencies"], data["bin_edges"], data["units"].tolist(),
+                       data["frequency_units"].tolist(), str(data["align"]), data["align_times"],
+                       data["polarities"] if "polarities" in data.files else None, str(data["recording"]) or None)
+
+
+def psth_bin_edges(pre=30.0, post=60.0, bin_width=1.0):
+    """Bin edges from -`pre` to `post` around the alignment time; the span must be a whole number of bins."""
+    if bin_width <= 0 or pre < 0 or post < 0 or pre + post <= 0:
+        raise ValueError("PSTH spans must not be negative and the bin width must be positive.")
+    n_bins = int(round((pre + post) / bin_width))
+    if not np.isclose(n_bins * bin_width, pre + post):
+        raise ValueError(f"pre + post ({pre + post:g}) is not a whole number of {bin_width:g} bins.")
+    return -pre + bin_width * np.arange(n_bins + 1)
+
+
+def alignment_times(analysis, align="drop"):
+    """
+    Alignment time of every drop of a DropAnalysis: its drop time, its response
+    time or its full recovery time (NaN for drops that never recovered).
+    """
+    if align not in ALIGNMENTS:
+        raise ValueError(f"Unknown alignment '{align}'; choose from {', '.join(ALIGNMENTS)}.")
+    n_drops = min(len(analysis.drop_times), len(analysis.recovery_times))
+    if align == "drop":
+        return np.asarray(analysis.drop_times[:n_drops], dtype=float)
+    if align == "response":
+        return np.asarray(analysis.recovery_times[:n_drops], dtype=float)
+    windows = analysis.compute_drop_windows()
+    return np.array([w["full_recovery_time"] if w["reached_threshold"] else np.nan for w in windows], dtype=float)
+
+
+def compute_psth(analysis, align="drop", pre=30.0, post=60.0, bin_width=1.0):
+    """
+    PSTH tensors of every drop and unit of a DropAnalysis (`analyze_drops` is not needed).
+
+    All (drop, bin) windows go to the analysis's prefix-sum engine in one call,
+    so every unit and frequency column is gathered at once: the cost depends on
+    drops x bins x columns, not on the span or the recording length. A bin counts
+    the events of the samples inside it, so bins narrower than the sampling
+    interval alternate between samples and empty bins. Spans are not cut at the
+    neighbouring drops.
+    """
+    edges = psth_bin_edges(pre, post, bin_width)
+    times = alignment_times(analysis, align)
+    starts = times[:, None] + edges[None, :-1]
+    ends = times[:, None] + edges[None, 1:]
+
+    stats = analysis.segment_stats
+    sums, n = stats.window_sums(starts, ends)  # (drop, bin, column)
+    index = analysis.time_index
+    outside = np.isnan(starts) | (starts < index.start) | (ends > index.end + max(index.interval, 0.0))
+
+    column_index = {col: j for j, col in enumerate(analysis.stat_columns)}
+    units = list(analysis.neuron_columns)
+    frequency_units = [unit for unit in units if unit in analysis.frequency_columns]
+    event_cols = [column_index[unit] for unit in units]
+    freq_cols = [column_index[analysis.frequency_columns[unit]] for unit in frequency_units]
+
+    counts = np.where(outside[:, :, None], np.nan, sums[:, :, event_cols])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        frequencies = np.where(outside[:, :, None] | (n[:, :, freq_cols] == 0), np.nan,
+                               sums[:, :, freq_cols] / n[:, :, freq_cols])
+
+    # (drop, bin, unit) -> (drop, unit, bin)
+    counts = np.ascontiguousarray(counts.transpose(0, 2, 1), dtype=PSTH_DTYPE)
+    frequencies = np.ascontiguousarray(frequencies.transpose(0, 2, 1), dtype=FREQUENCY_DTYPE)
+    return PSTH(counts, frequencies, edges, units, frequency_units, align, times,
+                polarities=analysis.drop_polarities() if analysis.polarity != "cold" else None,
+                recording=analysis.dataname)
+
+
+def main(argv=None):
+    import matplotlib
+    matplotlib.use("Agg")
+    from batch_analysis import TIME_FINDER_PARAMS, collect_inputs, load_params
+    from detection_cache import DetectionCache
+    from drop_analysis import DropAnalysis
+    from recording_cache import load_recording
+    from time_finder import TimeFinder
+
+    parser = argparse.ArgumentParser(description="Build peri-stimulus time histograms around every drop of recordings.")
+    parser.add_argument("inputs", nargs="+", help="CSV files, directories of CSV files, or glob patterns.")
+    parser.add_argument("--params", default=None, help="JSON file with detection parameters (as for batch_analysis.py).")
+    parser.add_argument("--align", choices=ALIGNMENTS, default="drop", help="Time each drop's histogram is aligned to.")
+    parser.add_argument("--pre", type=float, default=30.0, help="Span before the alignment time.")
+    parser.add_argument("--post", type=float, default=60.0, help="Span after the alignment time.")
+    parser.add_argument("--bin-width", type=float, default=1.0, help="Histogram bin width.")
+    parser.add_argument("--output-dir", default="data_out", help="Folder for psth_<name>.npz and psth_curves_<name>.csv.")
+    parser.add_argument("--cache-dir", default=None, help="Recording and detection cache (reviewed drops are reused).")
+    args = parser.parse_args(argv)
+
+    params = load_params(args.params)
+    for csv_path in collect_inputs(args.inputs):
+        dataname = os.path.basename(csv_path)
+        data = load_recording(csv_path, time_col=params["time_col"], cache_dir=args.cache_dir)
+        tool = TimeFinder(data, dataname=dataname, output_dir=args.output_dir, file_path=csv_path,
+                          detection_cache=DetectionCache(args.cache_dir), time_col=params["time_col"],
+                          temp_col=params["temp_col"], **{key: params[key] for key in TIME_FINDER_PARAMS})
+        results = tool.run_analysis(plot_orig=False, user_confirmation=False, plot_after=False)
+        analysis = DropAnalysis(data, results["drop_times"], results["recovery_times"], dataname=dataname,
+                                output_dir=args.output_dir, time_col=params["time_col"], temp_col=params["temp_col"],
+                                window_before=params["window_before"], std_threshold=params["std_threshold"],
+                                force_basal_computation=params["force_basal_computation"], save_plots=False,
+                                polarity=tool.polarity)
+        psth = compute_psth(analysis, align=args.align, pre=args.pre, post=args.post, bin_width=args.bin_width)
+
+        folder = os.path.join(args.output_dir, analysis.dataname)
+        psth.save(os.path.join(folder, f"psth_{analysis.dataname}.npz"))
+        psth.curves_table().to_csv(os.path.join(folder, f"psth_curves_{analysis.dataname}.csv"), index=False,
+                                   encoding="utf-8-sig")
+        print(f"{analysis.dataname}: {psth.counts.shape[0]} drops x {len(psth.units)} units x {psth.counts.shape[2]} bins.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import uuid
+
+import pandas as pd
+
+from columnar import read_frame, write_frame
+from instrumentation import get_profiler
+
+
+DEFAULT_CACHE_DIR = os.environ.get("CORNEAL_NERVE_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "corneal_nerve"))
+DEFAULT_MAX_CACHE_BYTES = 2 * 1024 ** 3
+CACHE_FORMAT_VERSION = 1  # Bump when parsing rules change so old entries are not reused
+INDEX_NAME = "index.json"
+
+
+def read_recording_csv(csv_path, time_col="Time"):
+    """
+    Parses a recording CSV with typed columns.
+
+    The UTF-8 byte order mark some exporters put before the `Time` header is
+    stripped, and integer event-count columns are stored in the smallest integer
+    type that holds them. The time column keeps its parsed type.
+    """
+    df = pd.read_csv(csv_path, encoding="utf-8-sig")
+    df.columns = [str(col).lstrip("\ufeff").strip() for col in df.columns]
+
+    for col in df.columns:
+        if col != time_col and pd.api.types.is_integer_dtype(df[col].dtype):
+            df[col] = pd.to_numeric(df[col], downcast="unsigned" if df[col].min() >= 0 else "integer")
+    return df
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """Content hash of a file, used as the cache key."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RecordingCache:
+    """
+    Content-addressed cache of parsed recordings.
+
+    Each recording is parsed once and stored as a columnar binary file named after
+    the CSV's content hash; later loads memory-map it instead of re-parsing.
+    An index of (size, mtime) per source path avoids re-hashing unchanged files;
+    when a source CSV changes, its old entry is dropped. The least recently used
+    entries are evicted once the cache exceeds `max_bytes`; entries that are
+    memory-mapped by a running analysis cannot be deleted on Windows and are
+    skipped until a later eviction.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def load(self, csv_path, time_col="Time"):
+        """Returns the recording as a DataFrame, parsing the CSV only on a cache miss."""
+        profiler = get_profiler()
+        with profiler.stage("cache_lookup"):
+            key = self.key(csv_path)
+        entry_path = self._entry_path(key)
+
+        if os.path.exists(entry_path):
+            os.utime(entry_path)  # Mark as recently used for eviction
+            with profiler.stage("cache_read"):
+                return read_frame(entry_path)
+
+        with profiler.stage("csv_parse"):
+            df = read_recording_csv(csv_path, time_col=time_col)
+        with profiler.stage("cache_write"):
+            try:
+                write_frame(entry_path, df, metadata={"source": os.path.abspath(csv_path), "version": CACHE_FORMAT_VERSION})
+            except PermissionError:
+                # Windows: another process wrote the same entry meanwhile and has it memory-mapped
+                if not os.path.exists(entry_path):
+                    raise
+            self.evict(keep=key)
+        return read_frame(entry_path)
+
+    def key(self, csv_path):
+        """Cache key for a CSV: its content hash, reused from the index while size and mtime are unchanged."""
+        source = os.path.abspath(csv_path)
+        stat = os.stat(source)
+        index = self._read_index()
+        known = index.get(source)
+        if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+            return known["key"]
+
+        key = f"{file_hash(source)}-v{CACHE_FORMAT_VERSION}"
+        if known and known["key"] != key and not any(e["key"] == known["key"] for p, e in index.items() if p != source):
+            # **The source changed: drop the stale entry right away**
+            self._remove(known["key"])
+        index[source] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "key": key}
+        self._write_index(index)
+        return key
+
+    def evict(self, keep=None):
+        """Deletes least recently used entries (except `keep`) until the cache fits in `max_bytes`."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".cncol") and name != f"{keep}.cncol":
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name[:-len(".cncol")]))
+
+        total = sum(size for _, size, _ in entries) + (os.path.getsize(self._entry_path(keep)) if keep else 0)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if self._remove(key):
+                total -= size
+
+    def clear(self):
+        """Removes the index and every cached recording that is not memory-mapped by a running analysis."""
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".cncol"):
+                self._remove(name[:-len(".cncol")])
+            elif name == INDEX_NAME:
+                os.remove(os.path.join(self.cache_dir, name))
+
+    def size(self):
+        """Total bytes used by cached recordings."""
+        return sum(os.path.getsize(os.path.join(self.cache_dir, name)) for name in os.listdir(self.cache_dir) if name.endswith(".cncol"))
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.cncol")
+
+    def _remove(self, key):
+        """
+        Deletes one entry; False if it is still memory-mapped somewhere (Windows
+        refuses to delete mapped files), in which case a later eviction retries it.
+        """
+        try:
+            os.remove(self._entry_path(key))
+        except FileNotFoundError:
+            pass
+        except PermissionError:
+            return False
+        return True
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.cache_dir, INDEX_NAME)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_index(self, index):
+        path = os.path.join(self.cache_dir, INDEX_NAME)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, path)
+
+
+def load_recording(csv_path, time_col="Time", cache_dir=None, use_cache=True, max_cache_bytes=DEFAULT_MAX_CACHE_BYTES):
+    """
+    Loads a recording for TimeFinder and DropAnalysis.
+
+    With `use_cache` the parsed columns come from (or are added to) the binary
+    recording cache and are memory-mapped read-only; otherwise the CSV is parsed directly.
+    """
+    if not use_cache:
+        with get_profiler().stage("csv_parse"):
+            return read_recording_csv(csv_path, time_col=time_col)
+    return RecordingCache(cache_dir, max_bytes=max_cache_bytes).load(csv_path, time_col=time_col)
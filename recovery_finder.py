@@ -0,0 +1,144 @@
+import numpy as np
+from segment_stats import SegmentStats
+from time_index import TimeIndex
+
+
+def find_full_recoveries(time_values, temp_values, start_times, thresholds, end_times, max_batch=1 << 22, hot=None):
+    """
+    Finds, for every drop at once, the first sample with `start <= time < end`
+    whose temperature is at or above that drop's threshold.
+
+    All search ranges are gathered into one flat index array and compared
+    against their repeated thresholds in a single NumPy pass (split into
+    batches of at most `max_batch` samples). Drops marked in the boolean `hot`
+    are heat stimuli and recover at the first sample at or *below* their
+    threshold. Returns the sample index of each recovery, or -1 where the
+    temperature never returns to threshold inside the range.
+    """
+    time_values = np.asarray(time_values, dtype=float)
+    temp_values = np.asarray(temp_values, dtype=float)
+    thresholds = np.asarray(thresholds, dtype=float)
+    direction = np.where(hot, -1.0, 1.0) if hot is not None else np.ones(len(thresholds))  # Hot: compare -temp >= -threshold
+
+    lo = np.searchsorted(time_values, np.asarray(start_times, dtype=float), side="left")
+    hi = np.searchsorted(time_values, np.asarray(end_times, dtype=float), side="left")
+    lengths = np.maximum(hi - lo, 0)
+    recovery_index = np.full(len(lo), -1, dtype=np.int64)
+
+    batch_start = 0
+    while batch_start < len(lo):
+        # **Group consecutive drops until the batch holds `max_batch` samples (at least one drop)**
+        cumulative = np.cumsum(lengths[batch_start:])
+        batch_end = batch_start + max(1, int(np.searchsorted(cumulative, max_batch, side="right")))
+        batch = slice(batch_start, batch_end)
+        batch_lengths = lengths[batch]
+        total = int(batch_lengths.sum())
+
+        if total > 0:
+            segment = np.repeat(np.arange(batch_end - batch_start), batch_lengths)
+            segment_offsets = np.cumsum(batch_lengths) - batch_lengths
+            sample_index = lo[batch][segment] + (np.arange(total) - segment_offsets[segment])
+            sign = direction[batch][segment]
+            hits = np.flatnonzero(sign * temp_values[sample_index] >= sign * thresholds[batch][segment])
+
+            # **First hit of every segment (hits are sorted, so np.unique keeps the earliest)**
+            hit_segments, first = np.unique(segment[hits], return_index=True)
+            recovery_index[batch_start + hit_segments] = sample_index[hits[first]]
+
+        batch_start = batch_end
+
+    return recovery_index
+
+
+def resolve_recovery_chain(time_values, temp_values, drop_times, response_times, next_drop_times,
+                           window_before=30, std_threshold=2, force_basal_computation=False, temp_stats=None,
+                           previous_full_recovery=np.nan, hot=None, time_index=None):
+    """
+    Resolves basal windows, recovery thresholds and full recovery times for a
+    sequence of drops, including the `prev_full_recovery_time` chaining used by
+    `DropAnalysis` when basal computation is not forced.
+
+    Each drop's basal window depends only on the previous drop's full recovery
+    time, so every drop is first solved in one batch assuming the earlier
+    recoveries, and only drops whose previous recovery changed are re-solved
+    until the chain is stable (usually one or two passes). `previous_full_recovery`
+    is the full recovery time of the drop before the first one given (NaN if
+    there is none), so part of a longer sequence can be re-solved on its own.
+    Drops marked in the boolean `hot` are heat stimuli: their threshold is
+    `std_threshold` standard deviations *above* the basal mean, and they recover
+    when the temperature falls back to it. `time_index` (a TimeIndex of
+    `time_values`) is built here when not given.
+
+    Returns a dict of per-drop arrays: basal_start, forced_basal, basal_temp_mean,
+    basal_temp_std, temp_threshold, recovery_index (-1 if never recovered) and full_recovery_time.
+    """
+    time_values = np.asarray(time_values, dtype=float)
+    temp_values = np.asarray(temp_values, dtype=float)
+    drop_times = np.asarray(drop_times, dtype=float)
+    response_times = np.asarray(response_times, dtype=float)
+    next_drop_times = np.asarray(next_drop_times, dtype=float)
+    if temp_stats is None:
+        temp_stats = SegmentStats(time_values, temp_values)
+
+    n_drops = len(drop_times)
+    hot = np.zeros(n_drops, dtype=bool) if hot is None else np.asarray(hot, dtype=bool)
+    default_start = np.maximum(0, drop_times - window_before)
+    basal_start = default_start.copy()
+    forced_basal = np.full(n_drops, None, dtype=object)
+    basal_mean = np.full(n_drops, np.nan)
+    basal_std = np.full(n_drops, np.nan)
+    threshold = np.full(n_drops, np.nan)
+    recovery_index = np.full(n_drops, -1, dtype=np.int64)
+    full_recovery = next_drop_times.copy()
+
+    pending = np.arange(n_drops)
+    while len(pending) > 0:
+        # **Basal window from the previous drop's current full recovery time**
+        if force_basal_computation:
+            forced_basal[pending] = "global"
+        else:
+            prev_recovery = np.where(pending > 0, full_recovery[np.maximum(pending - 1, 0)], previous_full_recovery)
+            has_prev = ~np.isnan(prev_recovery)
+            no_recovery = has_prev & (prev_recovery >= drop_times[pending])
+            overlap = has_prev & ~no_recovery & (default_start[pending] < prev_recovery)
+            basal_start[pending] = np.where(no_recovery, drop_times[pending],
+                                            np.where(overlap, prev_recovery, default_start[pending]))
+            forced_basal[pending] = np.where(no_recovery, "no_recovery", np.where(overlap, "overlap_prevention", None))
+
+        # **Basal temperature statistics; an empty basal window falls back to the drop-time temperature**
+        mean, std, n = temp_stats.window_stats(basal_start[pending], drop_times[pending])
+        mean, std, n = mean[:, 0], std[:, 0], n[:, 0]
+        basal_mean[pending] = np.where(n > 0, mean, np.nan)
+        basal_std[pending] = np.where(n > 0, std, np.nan)
+        threshold[pending] = np.where(hot[pending], mean + std_threshold * std, mean - std_threshold * std)
+
+        empty = pending[n == 0]
+        if len(empty) > 0:
+            if time_index is None:
+                time_index = TimeIndex(time_values)
+            drop_index = time_index.find(drop_times[empty])
+            if np.any(drop_index < 0):
+                raise ValueError("Drop times with an empty basal window must be within half a sampling interval of a sample.")
+            threshold[empty] = temp_values[drop_index]
+
+        # **Batched recovery search bounded by the next drop**
+        found = find_full_recoveries(time_values, temp_values, response_times[pending], threshold[pending],
+                                     next_drop_times[pending], hot=hot[pending])
+        recovery_index[pending] = found
+        new_full = np.where(found >= 0, time_values[np.maximum(found, 0)], next_drop_times[pending])
+        changed = pending[new_full != full_recovery[pending]]
+        full_recovery[pending] = new_full
+
+        # **Only drops following a changed recovery need another pass**
+        pending = changed + 1
+        pending = pending[pending < n_drops] if not force_basal_computation else pending[:0]
+
+    return {
+        "basal_start": basal_start,
+        "forced_basal": forced_basal,
+        "basal_temp_mean": basal_mean,
+        "basal_temp_std": basal_std,
+        "temp_threshold": threshold,
+        "recovery_index": recovery_index,
+        "full_recovery_time": full_recovery,
+    }
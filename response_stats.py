@@ -0,0 +1,182 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+COMPARISONS = {"during_vs_basal": 1, "after_vs_basal": 2}  # Test window index in `DropAnalysis.window_bounds`
+RESAMPLE_BATCH = 1000  # Resamples drawn per matrix product; bounds memory for long windows
+
+
+def compare_windows(basal, test, n_resamples=10000, confidence=0.95, seed=None, batch_size=RESAMPLE_BATCH):
+    """
+    Compares the samples of a test window with the basal window for every column at once.
+
+    `basal` and `test` are samples × columns matrices (NaN samples are ignored).
+    The effect is the difference of means (test - basal). Its two-sided
+    permutation p-value relabels a random subset of the pooled samples as the
+    test window; its bootstrap percentile interval resamples both windows with
+    replacement. Each batch of resamples is a 0/1 (permutation) or count
+    (bootstrap) weight matrix multiplied with the sample matrix, so every column
+    is handled by the same matrix product.
+
+    Returns a dict of per-column arrays: basal_mean, test_mean, difference,
+    ci_low, ci_high and p_value (NaN where a window has fewer than two samples).
+    """
+    rng = np.random.default_rng(seed)
+    basal = np.asarray(basal, dtype=float)
+    test = np.asarray(test, dtype=float)
+    n_basal, n_test, n_cols = len(basal), len(test), basal.shape[1]
+
+    valid_basal, valid_test = ~np.isnan(basal), ~np.isnan(test)
+    basal, test = np.where(valid_basal, basal, 0.0), np.where(valid_test, test, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        basal_mean = basal.sum(axis=0) / valid_basal.sum(axis=0)
+        test_mean = test.sum(axis=0) / valid_test.sum(axis=0)
+    result = {"basal_mean": basal_mean, "test_mean": test_mean, "difference": test_mean - basal_mean,
+              "ci_low": np.full(n_cols, np.nan), "ci_high": np.full(n_cols, np.nan), "p_value": np.full(n_cols, np.nan)}
+    if n_basal < 2 or n_test < 2 or n_resamples < 1:
+        return result
+
+    has_missing = not (valid_basal.all() and valid_test.all())
+    pooled = np.vstack([basal, test])
+    pooled_valid = np.vstack([valid_basal, valid_test]).astype(float)
+    pooled_sum, pooled_n = pooled.sum(axis=0), pooled_valid.sum(axis=0)
+    observed = np.abs(result["difference"])
+    threshold = observed * (1 - 1e-9) - 1e-12  # Count permutations tied with the observed effect despite rounding
+
+    exceed = np.zeros(n_cols)
+    boot = np.empty((n_resamples, n_cols))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for start in range(0, n_resamples, batch_size):
+            r = min(batch_size, n_resamples - start)
+
+            # **Permutations: the n_test smallest random keys mark the relabelled test samples**
+            keys = rng.random((r, n_basal + n_test))
+            selected = (keys <= np.partition(keys, n_test - 1, axis=1)[:, n_test - 1:n_test]).astype(float)
+            test_sum = selected @ pooled
+            if has_missing:
+                test_n = selected @ pooled_valid
+                permuted = test_sum / test_n - (pooled_sum - test_sum) / (pooled_n - test_n)
+            else:
+                permuted = test_sum / n_test - (pooled_sum - test_sum) / n_basal
+            exceed += (np.abs(permuted) >= threshold).sum(axis=0)
+
+            # **Bootstrap: multinomial resampling counts of each window**
+            basal_weights = rng.multinomial(n_basal, np.full(n_basal, 1 / n_basal), size=r).astype(float)
+            test_weights = rng.multinomial(n_test, np.full(n_test, 1 / n_test), size=r).astype(float)
+            if has_missing:
+                boot[start:start + r] = ((test_weights @ test) / (test_weights @ valid_test)
+                                         - (basal_weights @ basal) / (basal_weights @ valid_basal))
+            else:
+                boot[start:start + r] = (test_weights @ test) / n_test - (basal_weights @ basal) / n_basal
+
+    tail = (1 - confidence) / 2 * 100
+    quantile = np.nanpercentile if has_missing else np.percentile
+    with np.errstate(invalid="ignore"):
+        result["ci_low"], result["ci_high"] = quantile(boot, [tail, 100 - tail], axis=0)
+    result["p_value"] = np.where(np.isnan(result["difference"]), np.nan, (1 + exceed) / (n_resamples + 1))
+    return result
+
+
+def benjamini_hochberg(p_values):
+    """Benjamini–Hochberg adjusted p-values (q-values); NaN p-values stay NaN and are not counted."""
+    p_values = np.asarray(p_values, dtype=float)
+    q_values = np.full(len(p_values), np.nan)
+    tested = np.flatnonzero(~np.isnan(p_values))
+    if len(tested):
+        order = tested[np.argsort(p_values[tested])]
+        ranked = p_values[order] * len(order) / np.arange(1, len(order) + 1)
+        q_values[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1.0)
+    return q_values
+
+
+def _compare_task(args):
+    basal, test, n_resamples, confidence, seed = args
+    return compare_windows(basal, test, n_resamples=n_resamples, confidence=confidence, seed=seed)
+
+
+def run_response_tests(analysis, n_resamples=10000, confidence=0.95, alpha=0.05, min_fraction=0.5,
+                       workers=None, seed=0):
+    """
+    Tests every neuron's response to every drop of an analysed recording.
+
+    `analysis` is a DropAnalysis; its windows are resolved on demand if
+    `analyze_drops()` has not run. For each drop, the during and after windows
+    are compared with the basal window for every event and frequency column
+    (`compare_windows`), and p-values are adjusted across neurons per drop,
+    comparison and metric (Benjamini–Hochberg). Drops are
+    spread across `workers` processes (0 runs in the calling process); each drop
+    and comparison gets its own random stream from `seed`, so results do not
+    depend on the number of workers.
+
+    Returns two DataFrames: `tests` with one row per drop, comparison and column,
+    and `responders` with one row per neuron, metric and comparison. A neuron
+    is a responder when at least `min_fraction` of its tested drops have q < `alpha`;
+    `direction` is the sign of its median effect.
+    """
+    schema = analysis.schema
+    channels = analysis.channels
+    windows = analysis.window_bounds(*analysis.analysed_intervals())
+    lo, hi = analysis.segment_stats.bounds(windows[..., 0], windows[..., 1])
+
+    def samples(i, w):
+        rows = slice(lo[i, w], hi[i, w])
+        return np.hstack([channels.events[rows], channels.frequencies[rows]]).astype(float)
+
+    tasks, keys = [], []
+    seeds = np.random.SeedSequence(seed).spawn(len(windows) * len(COMPARISONS))
+    for i in range(len(windows)):
+        for c, (comparison, w) in enumerate(COMPARISONS.items()):
+            if np.isnan(windows[i, w]).any() or np.isnan(windows[i, 0]).any():
+                continue  # No during window (never recovered) or no after window
+            basal, test = samples(i, 0), samples(i, w)
+            tasks.append((basal, test, n_resamples, confidence, seeds[i * len(COMPARISONS) + c]))
+            keys.append((i, comparison, len(basal), len(test)))
+
+    workers = workers if workers is not None else min(os.cpu_count() or 1, len(tasks))
+    if workers == 0 or len(tasks) <= 1:
+        results = [_compare_task(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_compare_task, tasks))
+
+    # **Long-format test table**
+    columns = schema.stat_columns
+    neurons = schema.units + schema.frequency_units
+    metrics = ["events"] * len(schema.units) + ["frequency"] * len(schema.frequency_units)
+    frames = []
+    for (i, comparison, n_basal, n_test), result in zip(keys, results):
+        frame = pd.DataFrame({"drop": i + 1, "comparison": comparison, "neuron": neurons, "metric": metrics,
+                              "column": columns, "n_basal": n_basal, "n_test": n_test, **result})
+        for metric in ("events", "frequency"):
+            rows = (frame["metric"] == metric).to_numpy()
+            frame.loc[rows, "q_value"] = benjamini_hochberg(frame.loc[rows, "p_value"].to_numpy())
+        frames.append(frame)
+    test_columns = ["drop", "comparison", "neuron", "metric", "column", "n_basal", "n_test", "basal_mean",
+                    "test_mean", "difference", "ci_low", "ci_high", "p_value", "q_value"]
+    tests = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=test_columns)
+    tests = tests[test_columns]
+    tests["significant"] = (tests["q_value"] < alpha).astype(bool)
+
+    # **Per-neuron responder flags**
+    tested = tests[tests["p_value"].notna()]
+    grouped = tested.groupby(["neuron", "metric", "comparison"], sort=False)
+    responders = grouped.agg(n_drops=("drop", "size"), n_significant=("significant", "sum"),
+                             median_difference=("difference", "median")).reset_index()
+    responders["fraction_significant"] = responders["n_significant"] / responders["n_drops"]
+    responders["responder"] = responders["fraction_significant"] >= min_fraction
+    responders["direction"] = np.where(responders["median_difference"] > 0, "increase",
+                                       np.where(responders["median_difference"] < 0, "decrease", "none"))
+    return tests, responders
+
+
+def write_response_tests(analysis, tests, responders):
+    """Writes `response_tests_<name>.csv` and `responders_<name>.csv` next to the analysis results."""
+    folder = os.path.join(analysis.output_dir, analysis.dataname)
+    paths = (os.path.join(folder, f"response_tests_{analysis.dataname}.csv"),
+             os.path.join(folder, f"responders_{analysis.dataname}.csv"))
+    tests.to_csv(paths[0], index=False, encoding="utf-8-sig")
+    responders.to_csv(paths[1], index=False, encoding="utf-8-sig")
+    return paths
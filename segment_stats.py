@@ -0,0 +1,192 @@
+import numpy as np
+
+
+BUILD_BATCH_COLUMNS = 256  # Columns converted to float64 at a time while building prefix sums
+
+
+class SegmentStats:
+    """
+    Prefix-sum statistics engine for time windows over a recording.
+
+    Cumulative sums, sums of squares and valid-sample counts are built once for
+    every column, so the mean / std / n of any [start, end) window costs two
+    binary searches on the time column and a few array lookups, independent of
+    the window length.
+
+    Memory: the prefix sums and sums of squares take 16 bytes (two float64) per
+    sample and column, about twice a float64 copy of the data and several times
+    a compact `ChannelMatrix`. Valid-sample counts add 8 bytes per sample only
+    for columns with missing values; NaN-free columns count the window's rows.
+    """
+
+    def __init__(self, time_values, values, columns=None):
+        time_values = np.asarray(time_values, dtype=float)
+        values = np.asarray(values, dtype=float)
+        if values.ndim == 1:
+            values = values[:, None]
+        if len(time_values) != len(values):
+            raise ValueError("Time column and value matrix must have the same number of rows.")
+        if len(time_values) > 1 and np.any(np.diff(time_values) < 0):
+            raise ValueError("Time values must be in ascending order.")
+
+        self.time = time_values
+        self._build([values], columns)
+
+    @classmethod
+    def from_blocks(cls, time_values, blocks, columns=None):
+        """
+        Builds the engine over several 2-D value matrices placed side by side
+        (any numeric dtype, e.g. compact event counts and float32 frequencies)
+        without first copying them into one float64 matrix.
+        """
+        time_values = np.asarray(time_values, dtype=float)
+        if any(len(block) != len(time_values) for block in blocks):
+            raise ValueError("Time column and value matrix must have the same number of rows.")
+        if len(time_values) > 1 and np.any(np.diff(time_values) < 0):
+            raise ValueError("Time values must be in ascending order.")
+        stats = cls.__new__(cls)
+        stats.time = time_values
+        stats._build(blocks, columns)
+        return stats
+
+    @classmethod
+    def from_channels(cls, channels):
+        """Builds the engine over every event and frequency column of a `ChannelMatrix`."""
+        return cls.from_blocks(channels.time, [channels.events, channels.frequencies], columns=channels.schema.stat_columns)
+
+    def _build(self, blocks, columns):
+        n_cols = sum(block.shape[1] for block in blocks)
+        self.columns = list(columns) if columns is not None else list(range(n_cols))
+        self.offset = np.zeros(n_cols)
+        self._sum = np.zeros((len(self.time) + 1, n_cols))
+        self._sumsq = np.zeros((len(self.time) + 1, n_cols))
+        count_columns, count_blocks = [], []
+
+        # **Prefix sums in column batches, so temporaries stay small for wide recordings**
+        col = 0
+        for block in blocks:
+            for start in range(0, block.shape[1], BUILD_BATCH_COLUMNS):
+                values = np.asarray(block[:, start:start + BUILD_BATCH_COLUMNS], dtype=float)
+                cols = slice(col, col + values.shape[1])
+
+                # Centre each column on a whole number to limit cancellation in the variance
+                # (integer event counts stay exact, so means match pandas even on rounding ties)
+                valid = ~np.isnan(values)
+                counts = valid.sum(axis=0)
+                col_sums = np.where(valid, values, 0.0).sum(axis=0)
+                offset = np.round(np.divide(col_sums, counts, out=np.zeros(values.shape[1]), where=counts > 0))
+                centred = np.where(valid, values - offset, 0.0)
+
+                self.offset[cols] = offset
+                np.cumsum(centred, axis=0, out=self._sum[1:, cols])
+                np.cumsum(centred * centred, axis=0, out=self._sumsq[1:, cols])
+                # Valid-sample counts only for columns with missing values
+                has_nan = counts < len(values)
+                if has_nan.any():
+                    count_block = np.zeros((len(self.time) + 1, int(has_nan.sum())), dtype=np.int64)
+                    np.cumsum(valid[:, has_nan], axis=0, out=count_block[1:])
+                    count_columns.append(col + np.flatnonzero(has_nan))
+                    count_blocks.append(count_block)
+                col += values.shape[1]
+
+        self._count_columns = np.concatenate(count_columns) if count_columns else np.empty(0, dtype=np.int64)
+        self._count = np.hstack(count_blocks) if len(count_blocks) > 1 else (
+            count_blocks[0] if count_blocks else np.zeros((len(self.time) + 1, 0), dtype=np.int64))
+
+    @classmethod
+    def from_dataframe(cls, df, time_col, columns):
+        """Builds the engine for the given columns of a recording DataFrame."""
+        columns = list(columns)
+        return cls(df[time_col].to_numpy(), df[columns].to_numpy(dtype=float), columns=columns)
+
+    def bounds(self, start_times, end_times):
+        """
+        Returns row bounds [lo, hi) for each (start, end) window, matching the
+        `time >= start` / `time < end` masks. Missing bounds (None/NaN) give empty windows.
+        """
+        starts = np.asarray(start_times, dtype=float)
+        ends = np.asarray(end_times, dtype=float)
+        lo = np.searchsorted(self.time, starts, side="left")
+        hi = np.searchsorted(self.time, ends, side="left")
+        missing = np.isnan(starts) | np.isnan(ends)
+        hi = np.where(missing | (hi < lo), lo, hi)
+        return lo, hi
+
+    def window_stats(self, start_times, end_times):
+        """
+        Computes mean, std (ddof=1) and n for every window and every column.
+
+        `start_times` and `end_times` may have any (matching) shape; the outputs
+        have that shape plus a trailing column axis. Like pandas, windows with no
+        samples give a NaN mean and windows with fewer than two samples a NaN std.
+        """
+        lo, hi = self.bounds(start_times, end_times)
+        n = self._window_counts(lo, hi)
+        s = self._sum[hi] - self._sum[lo]
+        ss = self._sumsq[hi] - self._sumsq[lo]
+        return centred_stats(s, ss, n, self.offset)
+
+    def window_sums(self, start_times, end_times):
+        """Sum and n of the samples in every window and column (shapes as in `window_stats`); empty windows sum to 0."""
+        lo, hi = self.bounds(start_times, end_times)
+        n = self._window_counts(lo, hi)
+        return self._sum[hi] - self._sum[lo] + n * self.offset, n
+
+    def _window_counts(self, lo, hi):
+        """Valid samples per window and column: the row count, or the prefix counts of columns with missing values."""
+        n = np.repeat((hi - lo)[..., None], len(self.offset), axis=-1)
+        if len(self._count_columns):
+            n[..., self._count_columns] = self._count[hi] - self._count[lo]
+        return n
+
+
+class RunningStats:
+    """
+    Running count / sum / sum of squares per column for a window that grows (and
+    optionally shrinks) one sample or block at a time, centred like `SegmentStats`.
+    """
+
+    def __init__(self, offset):
+        self.offset = np.asarray(offset, dtype=float)
+        self.reset()
+
+    def reset(self):
+        self.count = np.zeros(len(self.offset), dtype=np.int64)
+        self.sum = np.zeros(len(self.offset))
+        self.sumsq = np.zeros(len(self.offset))
+
+    def add(self, values, sign=1):
+        """Adds a row or a (rows, columns) block of samples; `sign=-1` removes them again."""
+        values = np.asarray(values, dtype=float)
+        if values.ndim == 1:
+            values = values[None, :]
+        if len(values) == 0:
+            return
+        valid = ~np.isnan(values)
+        centred = np.where(valid, values - self.offset, 0.0)
+        self.count += sign * valid.sum(axis=0)
+        self.sum += sign * centred.sum(axis=0)
+        self.sumsq += sign * (centred * centred).sum(axis=0)
+
+    def remove(self, values):
+        self.add(values, sign=-1)
+
+    def copy(self):
+        other = RunningStats(self.offset)
+        other.count, other.sum, other.sumsq = self.count.copy(), self.sum.copy(), self.sumsq.copy()
+        return other
+
+    def stats(self):
+        """Mean, std (ddof=1) and n per column of the samples added so far."""
+        return centred_stats(self.sum, self.sumsq, self.count, self.offset)
+
+
+def centred_stats(s, ss, n, offset):
+    """Mean, std (ddof=1) and n from centred sums; NaN mean for no samples, NaN std for fewer than two."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        centred_mean = s / n
+        # Un-centre the sum before dividing: exact for integer counts, so ties round like pandas
+        mean = np.where(n > 0, (s + n * offset) / n, np.nan)
+        var = np.maximum(ss - s * centred_mean, 0.0) / (n - 1)
+        std = np.where(n > 1, np.sqrt(var), np.nan)
+    return mean, std, n
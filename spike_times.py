@@ -0,0 +1,191 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from channel_schema import FREQUENCY_DTYPE, FREQUENCY_PREFIX
+from recording_cache import load_recording
+
+
+class SpikeTrains:
+    """
+    Spike timestamps of every unit, held as one flat array sorted within each unit.
+
+    `times[offsets[j]:offsets[j + 1]]` are the spikes of `units[j]`. Because
+    each unit's times are sorted (units that are not are sorted once here),
+    counts in any bins or windows are differences of `np.searchsorted`
+    positions, so re-binning never touches the spikes themselves.
+    """
+
+    def __init__(self, units, times_by_unit):
+        self.units = [str(unit) for unit in units]
+        if len(set(self.units)) != len(self.units):
+            raise ValueError("Duplicate unit names in the spike times.")
+        arrays = [np.asarray(times, dtype=float).ravel() for times in times_by_unit]
+        if len(arrays) != len(self.units):
+            raise ValueError(f"Got {len(arrays)} spike time arrays for {len(self.units)} units.")
+        for j, times in enumerate(arrays):
+            if len(times) > 1 and np.any(times[1:] < times[:-1]):
+                arrays[j] = np.sort(times)
+
+        lengths = np.array([len(times) for times in arrays], dtype=np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(lengths)))
+        self.times = np.concatenate(arrays) if arrays else np.empty(0)
+        self._cumulative = None
+
+    @classmethod
+    def from_npz(cls, path):
+        """Reads a .npz file with one array of spike times per unit (array name = unit name)."""
+        with np.load(path) as data:
+            return cls(data.files, [data[name] for name in data.files])
+
+    @classmethod
+    def from_csv(cls, path, unit_col="unit", time_col="time"):
+        """Reads a long-format CSV with one row per spike: its unit and its time."""
+        spikes = pd.read_csv(path, usecols=[unit_col, time_col], dtype={unit_col: str})
+        codes, units = pd.factorize(spikes[unit_col], sort=False)
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(units) + 1))
+        times = spikes[time_col].to_numpy(dtype=float)[order]
+        return cls(units, [times[bounds[j]:bounds[j + 1]] for j in range(len(units))])
+
+    def __len__(self):
+        return len(self.times)
+
+    def unit_times(self, unit):
+        j = self.units.index(unit)
+        return self.times[self.offsets[j]:self.offsets[j + 1]]
+
+    def _cumulative_rates(self):
+        """
+        Running sum and count of the instantaneous rates (1 / inter-spike interval;
+        none for each unit's first spike or repeated times) over the flat spike array, computed once.
+        """
+        if self._cumulative is None:
+            with np.errstate(divide="ignore"):
+                rates = 1.0 / np.diff(self.times, prepend=np.nan)
+            rates[self.offsets[:-1][self.offsets[:-1] < len(rates)]] = np.nan
+            valid = np.isfinite(rates)
+            self._cumulative = (np.concatenate(([0.0], np.cumsum(np.where(valid, rates, 0.0)))),
+                                np.concatenate(([0], np.cumsum(valid))))
+        return self._cumulative
+
+    def positions(self, bounds):
+        """Flat index of the first spike at or after each of `bounds` (any shape), per unit: (units, *bounds.shape)."""
+        bounds = np.asarray(bounds, dtype=float)
+        positions = np.empty((len(self.units),) + bounds.shape, dtype=np.int64)
+        for j in range(len(self.units)):
+            times = self.times[self.offsets[j]:self.offsets[j + 1]]
+            positions[j] = self.offsets[j] + np.searchsorted(times, bounds, side="left")
+        return positions
+
+    def bin(self, edges):
+        """
+        Spike counts and mean instantaneous rates (1 / ISI of the spikes in the bin,
+        0 without one) in every [edge_i, edge_i+1) bin, as (bins, units) column-major matrices.
+
+        Only the bin edges are searched in each unit's sorted times, so the cost
+        grows with bins x units rather than with the number of spikes.
+        """
+        edges = np.asarray(edges, dtype=float)
+        if np.any(np.diff(edges) < 0):
+            raise ValueError("Bin edges must be ascending.")
+        positions = self.positions(edges)
+        rate_sum, rate_n = self._cumulative_rates()
+        counts = np.diff(positions, axis=1).T
+        n = np.diff(rate_n[positions], axis=1).T
+        with np.errstate(invalid="ignore", divide="ignore"):
+            frequencies = np.where(n > 0, np.diff(rate_sum[positions], axis=1).T / n, 0.0)
+        return counts.astype(np.int32), np.asfortranarray(frequencies, dtype=FREQUENCY_DTYPE)
+
+    def window_counts(self, starts, ends):
+        """Spikes of every unit in [start, end) windows, straight from the spike times: (windows, units); NaN bounds give NaN."""
+        starts, ends = np.asarray(starts, dtype=float), np.asarray(ends, dtype=float)
+        counts = np.moveaxis(self.positions(ends) - self.positions(starts), 0, -1).astype(float)
+        counts[np.isnan(starts) | np.isnan(ends)] = np.nan
+        return counts
+
+    def window_rates(self, starts, ends):
+        """Mean firing rate (spikes per time unit) of every unit in [start, end) windows: (windows, units)."""
+        starts, ends = np.asarray(starts, dtype=float), np.asarray(ends, dtype=float)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.window_counts(starts, ends) / np.where(ends > starts, ends - starts, np.nan)[..., None]
+
+    def to_frame(self, time_values, temp_values, width=None, time_col="Time", temp_col="Temp"):
+        """
+        A recording in the `Time` / `Temp` / unit / `f-unit` schema for TimeFinder and DropAnalysis.
+
+        Without `width`, each row of the temperature trace is a bin [Time_i, Time_i+1)
+        (the last one as wide as the median sampling interval). With `width`, rows are
+        a uniform grid of that width over the trace, with the temperature interpolated.
+        """
+        time_values = np.asarray(time_values, dtype=float)
+        temp_values = np.asarray(temp_values, dtype=float)
+        if len(time_values) < 2:
+            raise ValueError("The temperature trace needs at least two samples.")
+        interval = np.median(np.diff(time_values))
+        if width is None:
+            grid, temp = time_values, temp_values
+            edges = np.append(time_values, time_values[-1] + interval)
+        else:
+            if width <= 0:
+                raise ValueError("Bin width must be positive.")
+            grid = np.arange(time_values[0], time_values[-1] + interval, width)
+            temp = np.interp(grid, time_values, temp_values)
+            edges = np.append(grid, grid[-1] + width)
+
+        counts, frequencies = self.bin(edges)
+        columns = {time_col: grid, temp_col: temp}
+        columns.update({unit: counts[:, j] for j, unit in enumerate(self.units)})
+        columns.update({FREQUENCY_PREFIX + unit: frequencies[:, j] for j, unit in enumerate(self.units)})
+        return pd.DataFrame(columns, copy=False)
+
+
+def read_spike_times(path, unit_col="unit", time_col="time"):
+    """Reads spike times from a .npz file (one array per unit) or a long-format CSV (one row per spike)."""
+    if os.path.splitext(path)[1].lower() == ".npz":
+        return SpikeTrains.from_npz(path)
+    return SpikeTrains.from_csv(path, unit_col=unit_col, time_col=time_col)
+
+
+def load_spike_recording(spikes_path, temp_path, width=None, time_col="Time", temp_col="Temp", cache_dir=None,
+                         use_cache=True):
+    """
+    Loads spike times and the temperature trace they were recorded with, and
+    bins them into one recording DataFrame (see `SpikeTrains.to_frame`).
+
+    Returns (df, trains); call `trains.to_frame` again to re-bin at another width.
+    """
+    trains = read_spike_times(spikes_path)
+    trace = load_recording(temp_path, time_col=time_col, cache_dir=cache_dir, use_cache=use_cache)
+    if temp_col not in trace.columns:
+        raise ValueError(f"Temperature column '{temp_col}' not found in {temp_path}.")
+    df = trains.to_frame(trace[time_col].to_numpy(dtype=float), trace[temp_col].to_numpy(dtype=float), width=width,
+                         time_col=time_col, temp_col=temp_col)
+    return df, trains
+
+
+def spike_window_stats(analysis, trains):
+    """
+    Spike counts and firing rates in every drop's basal / during / after window,
+    computed from the spike times rather than the binned counts.
+
+    `analysis` is a DropAnalysis, analysed or not (see `analysed_intervals`).
+    Returns a long table with one row per drop, window and unit (NaN where the
+    window does not exist).
+    """
+    windows = analysis.window_bounds(*analysis.analysed_intervals())
+    counts = trains.window_counts(windows[..., 0], windows[..., 1])
+    rates = trains.window_rates(windows[..., 0], windows[..., 1])
+    n_drops, n_windows, n_units = counts.shape
+    shape = counts.shape
+    return pd.DataFrame({
+        "drop": np.broadcast_to(np.arange(1, n_drops + 1)[:, None, None], shape).ravel(),
+        "window": pd.Categorical.from_codes(np.broadcast_to(np.arange(n_windows)[None, :, None], shape).ravel(),
+                                            categories=["basal", "during", "after"]),
+        "neuron": np.array(trains.units, dtype=object)[np.broadcast_to(np.arange(n_units)[None, None, :], shape).ravel()],
+        "spikes": counts.ravel(),
+        "rate": rates.ravel(),
+        "start": np.broadcast_to(windows[:, :, None, 0], shape).ravel(),
+        "end": np.broadcast_to(windows[:, :, None, 1], shape).ravel(),
+    })
@@ -0,0 +1,531 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from channel_schema import FREQUENCY_DTYPE
+from columnar import read_columns, read_header
+from drop_analysis import DropAnalysis
+from segment_stats import RunningStats
+
+
+DEFAULT_CHUNKSIZE = 200_000
+
+
+def read_columns_header(source):
+    """Column names of a recording CSV (BOM stripped) or columnar file, without reading any rows."""
+    if source.endswith(".cncol"):
+        return [entry["name"] for entry in read_header(source)["columns"]]
+    header = pd.read_csv(source, nrows=0, encoding="utf-8-sig").columns
+    return [str(col).lstrip("\ufeff").strip() for col in header]
+
+
+def iter_chunks(source, chunksize=DEFAULT_CHUNKSIZE, columns=None):
+    """
+    Yields a recording as DataFrames of at most `chunksize` rows.
+
+    `source` is a recording CSV or a columnar file (e.g. a recording cache entry),
+    which is memory-mapped so only the current chunk is materialised.
+    """
+    if source.endswith(".cncol"):
+        data, _ = read_columns(source, columns=columns)
+        n_rows = read_header(source)["n_rows"]
+        names = [name for name in read_columns_header(source) if name in data]
+        for start in range(0, n_rows, chunksize):
+            yield pd.DataFrame({name: np.asarray(data[name][start:start + chunksize]) for name in names})
+        return
+
+    header = read_columns_header(source)
+    usecols = None if columns is None else [i for i, col in enumerate(header) if col in set(columns)]
+    reader = pd.read_csv(source, chunksize=chunksize, encoding="utf-8-sig", usecols=usecols)
+    names = header if usecols is None else [header[i] for i in usecols]
+    for chunk in reader:
+        chunk.columns = names
+        yield chunk
+
+
+def iter_time_blocks(chunks, time_col):
+    """
+    Re-cuts chunks so that samples sharing a time value never straddle two blocks.
+
+    The trailing run of equal times is held back and prepended to the next
+    chunk; the final block holds exactly the samples at the recording's last time.
+    Yields (block, is_final).
+    """
+    carry = None
+    for chunk in chunks:
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        if len(chunk) == 0:
+            continue
+        time_values = chunk[time_col].to_numpy()
+        cut = int(np.searchsorted(time_values, time_values[-1], side="left"))
+        carry = chunk.iloc[cut:]
+        if cut > 0:
+            yield chunk.iloc[:cut], False
+    if carry is not None:
+        yield carry, True
+
+
+def find_uniform_spacing(source, time_col="Time", chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Returns the constant sample spacing of a recording, or None if it varies.
+
+    `np.gradient` switches formula when the time axis is uniformly spaced, so the
+    streaming derivative needs this global property before the first chunk.
+    """
+    first_diff = None
+    previous = None
+    for chunk in iter_chunks(source, chunksize, columns=[time_col]):
+        time_values = chunk[time_col].to_numpy(dtype=float)
+        if previous is not None:
+            time_values = np.concatenate(([previous], time_values))
+        if len(time_values) >= 2:
+            diffs = np.diff(time_values)
+            if first_diff is None:
+                first_diff = diffs[0]
+            if not (diffs == first_diff).all():
+                return None
+        if len(time_values):
+            previous = time_values[-1]
+    return first_diff
+
+
+class ChunkedDropDetector:
+    """
+    Chunk-by-chunk counterpart of `detect_drop_indices`.
+
+    Samples are fed in chunks of any size. The state carried across chunk
+    boundaries is: the two edge samples needed for the derivative, the last
+    `preceding_window + 1` values of the running |diff| sum (for baseline
+    fluctuation), the open candidate cluster, and drops still waiting for their
+    recovery sign flip. The derivative and the running sum are computed exactly
+    as in the in-memory path, so the detected drops and recoveries are identical.
+    """
+
+    def __init__(self, derivative_threshold, neighbor_threshold, preceding_window, drop_threshold_factor,
+                 detect_hot_points=False, uniform_dx=None):
+        self.derivative_threshold = derivative_threshold
+        self.neighbor_threshold = neighbor_threshold
+        self.preceding_window = preceding_window
+        self.drop_threshold_factor = drop_threshold_factor
+        self.detect_hot_points = detect_hot_points
+        self.uniform_dx = uniform_dx
+
+        self.drop_points = []
+        self.recovery_points = []
+        self.n_candidates = 0
+
+        self._carry_time = np.empty(0)
+        self._carry_temp = np.empty(0)
+        self._carry_start = 0       # Global index of the first carried sample
+        self._started = False       # Derivative of sample 0 computed
+        self._abs_diff_tail = np.empty(0)  # Running |diff| sums for the samples just before the next block
+        self._last_candidate = None
+        self._open_found = False
+        self._open_baseline = np.nan
+        self._pending = []          # Drop indices waiting for a recovery sign flip
+        self._first_drop_wraps = False
+
+    def feed(self, time_values, temp_values):
+        """Processes the next chunk of samples."""
+        time_values = np.concatenate((self._carry_time, np.asarray(time_values, dtype=float)))
+        temp_values = np.concatenate((self._carry_temp, np.asarray(temp_values, dtype=float)))
+
+        if not self._started:
+            if len(time_values) < 2:
+                self._carry_time, self._carry_temp = time_values, temp_values
+                return
+            derivative = np.empty(len(time_values) - 1)
+            derivative[0] = (temp_values[1] - temp_values[0]) / (time_values[1] - time_values[0])
+            derivative[1:] = self._interior_gradient(time_values, temp_values)
+            self._process_block(0, derivative, time_values, temp_values, None, is_last=False)
+            self._started = True
+        elif len(time_values) >= 3:
+            derivative = self._interior_gradient(time_values, temp_values)
+            self._process_block(self._carry_start + 1, derivative, time_values[1:], temp_values[1:],
+                                (time_values[0], temp_values[0]), is_last=False)
+        else:
+            self._carry_time, self._carry_temp = time_values, temp_values
+            return
+
+        self._carry_start += len(time_values) - 2
+        self._carry_time, self._carry_temp = time_values[-2:], temp_values[-2:]
+
+    def finish(self):
+        """Processes the last sample and returns (drop_times, recovery_times)."""
+        if not self._started or len(self._carry_time) < 2:
+            raise ValueError("At least two samples are required to compute the temperature derivative.")
+        time_values, temp_values = self._carry_time, self._carry_temp
+        derivative = np.array([(temp_values[1] - temp_values[0]) / (time_values[1] - time_values[0])])
+        self._process_block(self._carry_start + 1, derivative, time_values[1:], temp_values[1:],
+                            (time_values[0], temp_values[0]), is_last=True)
+
+        if self._first_drop_wraps:
+            # A drop detected at sample 0 is shifted to index -1, i.e. the last sample
+            self.drop_points[0] = time_values[-1]
+        return self.drop_points, self.recovery_points
+
+    def _interior_gradient(self, time_values, temp_values):
+        """Second-order interior gradient, using the same formula `np.gradient` uses for the whole recording."""
+        if self.uniform_dx is not None:
+            return (temp_values[2:] - temp_values[:-2]) / (2. * self.uniform_dx)
+        dx = np.diff(time_values)
+        dx1, dx2 = dx[:-1], dx[1:]
+        a = -(dx2) / (dx1 * (dx1 + dx2))
+        b = (dx2 - dx1) / (dx1 * dx2)
+        c = dx1 / (dx2 * (dx1 + dx2))
+        return a * temp_values[:-2] + b * temp_values[1:-1] + c * temp_values[2:]
+
+    def _process_block(self, start, derivative, time_values, temp_values, previous_sample, is_last):
+        """
+        Runs detection on the derivative of global samples [start, start + len(derivative)).
+
+        `time_values` / `temp_values` start at sample `start`; `previous_sample`
+        is the (time, temp) of sample start - 1, or None for the first block.
+        """
+        n = len(derivative)
+        block_time = time_values[:n]
+        block_temp = temp_values[:n]
+
+        # **Running |diff| sum, continued from the previous block exactly as one global cumsum**
+        if previous_sample is None:
+            abs_diff_sum = np.concatenate(([0.0], np.cumsum(np.abs(np.diff(block_temp)))))
+        else:
+            steps = np.abs(np.diff(np.concatenate(([previous_sample[1]], block_temp))))
+            abs_diff_sum = np.cumsum(np.concatenate((self._abs_diff_tail[-1:], steps)))[1:]
+        history = np.concatenate((self._abs_diff_tail, abs_diff_sum))
+        history_start = start - len(self._abs_diff_tail)
+        self._abs_diff_tail = history[-(self.preceding_window + 1):]
+
+        def time_at(index):
+            return previous_sample[0] if index == start - 1 else block_time[index - start]
+
+        # Identify potential drop points (or hot peaks)
+        if self.detect_hot_points:
+            candidates = start + np.flatnonzero(derivative > self.derivative_threshold)
+            flips = start + np.flatnonzero(derivative < 0)
+        else:
+            candidates = start + np.flatnonzero(derivative < self.derivative_threshold)
+            flips = start + np.flatnonzero(derivative > 0)
+        if is_last:
+            flips = flips[:-1] if len(flips) and flips[-1] == start + n - 1 else flips
+        self.n_candidates += len(candidates)
+
+        new_drops = []
+        if len(candidates):
+            # **Cluster candidates, continuing the open cluster from the previous block**
+            new_cluster = np.empty(len(candidates), dtype=bool)
+            new_cluster[0] = self._last_candidate is None or candidates[0] - self._last_candidate > self.neighbor_threshold
+            new_cluster[1:] = np.diff(candidates) > self.neighbor_threshold
+            cluster_id = np.cumsum(new_cluster) - (1 if new_cluster[0] else 0)
+
+            cluster_starts = candidates[new_cluster]
+            window_starts = np.maximum(0, cluster_starts - self.preceding_window)
+            n_diffs = cluster_starts - window_starts - 1
+            with np.errstate(invalid="ignore", divide="ignore"):
+                new_baselines = np.where(
+                    n_diffs > 0,
+                    (history[np.maximum(cluster_starts - 1, history_start) - history_start]
+                     - history[np.maximum(window_starts, history_start) - history_start]) / n_diffs,
+                    np.nan
+                )
+            baselines = new_baselines if new_cluster[0] else np.concatenate(([self._open_baseline], new_baselines))
+            found = np.zeros(len(baselines), dtype=bool)
+            if not new_cluster[0]:
+                found[0] = self._open_found
+
+            significant = (np.abs(derivative[candidates - start]) > self.drop_threshold_factor * baselines[cluster_id]) & ~found[cluster_id]
+            significant_index = np.flatnonzero(significant)
+            found_clusters, first = np.unique(cluster_id[significant_index], return_index=True)
+            found[found_clusters] = True
+            new_drops = list(candidates[significant_index[first]])
+
+            self._last_candidate = candidates[-1]
+            self._open_found = found[-1]
+            self._open_baseline = baselines[-1]
+
+        for drop_index in new_drops:
+            if drop_index == 0:
+                self._first_drop_wraps = True
+                self.drop_points.append(None)
+            else:
+                self.drop_points.append(time_at(drop_index - 1))
+
+        # **Recovery: the next sign flip after each drop (pending drops take the first flip of this block)**
+        waiting = self._pending + new_drops
+        next_flip = np.searchsorted(flips, np.asarray(waiting, dtype=np.int64) + 1, side="left")
+        resolved = next_flip < len(flips)
+        for flip_position in next_flip[resolved]:
+            self.recovery_points.append(time_at(flips[flip_position] - 1))
+        self._pending = [drop for drop, done in zip(waiting, resolved) if not done]
+
+
+def stream_detect_drops(source, time_col="Time", temp_col="Temp", detect_hot_points=False, neighbor_threshold=5,
+                        preced_window=30, drop_factor=1.5, deriv_thresh=1, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Detects drops in a recording read chunk by chunk, with the same parameters
+    and results as `TimeFinder.run_analysis` without manual correction.
+    """
+    detector = ChunkedDropDetector(
+        deriv_thresh if detect_hot_points else -1 * deriv_thresh, neighbor_threshold, preced_window, drop_factor,
+        detect_hot_points=detect_hot_points, uniform_dx=find_uniform_spacing(source, time_col, chunksize)
+    )
+    for chunk in iter_chunks(source, chunksize, columns=[time_col, temp_col]):
+        detector.feed(chunk[time_col].to_numpy(), chunk[temp_col].to_numpy())
+    drop_times, recovery_times = detector.finish()
+    return {
+        "num_drops": len(drop_times),
+        "drop_times": drop_times,
+        "recovery_times": recovery_times
+    }
+
+
+class _DropState:
+    """Progress of one drop through the stream: basal window, recovery search, after window."""
+
+    def __init__(self, drop_time, response_time, next_drop_time, default_start):
+        self.drop_time = drop_time
+        self.response_time = response_time
+        self.next_drop_time = next_drop_time
+        self.has_next = np.isfinite(next_drop_time)
+        self.default_start = default_start
+        self.basal_start = None
+        self.forced_basal = None
+        self.basal_done = False
+        self.threshold = None
+        self.drop_temp = None
+        self.response_temp = None
+        self.status = "basal"       # basal -> searching -> after -> done
+        self.full_recovery_time = None
+        self.reached_threshold = False
+        self.after_start = None
+        self.after_end = None
+        self.accumulators = None    # basal, during, after
+
+
+class StreamingDropAnalysis(DropAnalysis):
+    """
+    DropAnalysis over a recording read in chunks, for recordings larger than RAM.
+
+    Windows are resolved in one pass in time order. Each drop keeps running sums
+    for its basal, during and after windows (temperature plus every event and
+    frequency column), so peak memory is bounded by the chunk size and the number
+    of drops rather than the file size. Results and CSV outputs are the same as
+    `DropAnalysis` (up to floating-point rounding of the window sums). Drop times
+    must be ascending and each recovery time must not precede its drop.
+    Plots need the full trace and are not produced in this mode.
+    """
+
+    def __init__(self, source, drop_times, recovery_times, chunksize=DEFAULT_CHUNKSIZE, **kwargs):
+        if kwargs.get("save_plots", False):
+            raise ValueError("StreamingDropAnalysis cannot render plots; use save_plots=False.")
+        kwargs["save_plots"] = False
+        if kwargs.get("polarity", "cold") != "cold":
+            raise ValueError("StreamingDropAnalysis only analyses cold drops; load the recording for hot or mixed stimuli.")
+        kwargs.setdefault("dataname", os.path.basename(source))
+        header = pd.DataFrame(columns=read_columns_header(source))
+        super().__init__(header, drop_times, recovery_times, **kwargs)
+        self.source = source
+        self.chunksize = chunksize
+        self._stream_stats = None
+
+    def compute_drop_windows(self):
+        """Resolves every drop's windows and accumulates their statistics in a single pass over the chunks."""
+        n_drops = min(len(self.drop_times), len(self.recovery_times))
+        if any(b < a for a, b in zip(self.drop_times, self.drop_times[1:])):
+            raise ValueError("Streaming analysis requires drop times in ascending order.")
+        if any(self.recovery_times[i] < self.drop_times[i] for i in range(n_drops)):
+            raise ValueError("Streaming analysis requires every recovery time to be at or after its drop time.")
+
+        value_columns = [self.temp_col] + self.stat_columns
+        states = [
+            _DropState(self.drop_times[i], self.recovery_times[i],
+                       self.drop_times[i + 1] if i + 1 < len(self.drop_times) else np.inf,
+                       max(0, self.drop_times[i] - self.window_before))
+            for i in range(n_drops)
+        ]
+        first_active = 0
+        max_time = None
+
+        chunks = iter_chunks(self.source, self.chunksize, columns=[self.time_col] + value_columns)
+        for block, is_final in iter_time_blocks(chunks, self.time_col):
+            time_values = block[self.time_col].to_numpy(dtype=float)
+            values = block[value_columns].to_numpy(dtype=float)
+            # Frequencies at the precision ChannelMatrix stores them, as in DropAnalysis
+            values[:, 1 + len(self.neuron_columns):] = values[:, 1 + len(self.neuron_columns):].astype(FREQUENCY_DTYPE)
+            block_max = block[self.time_col].iloc[-1]
+            max_time = block_max if max_time is None else max(max_time, block_max)
+
+            if states and states[0].accumulators is None:
+                # Centre on whole numbers from the first block so integer counts stay exact
+                offset = np.round(np.nan_to_num(np.nanmean(values, axis=0))) if len(values) else np.zeros(values.shape[1])
+                for state in states:
+                    state.accumulators = [RunningStats(offset) for _ in range(3)]
+
+            if is_final and states:
+                # The last drop's recovery must happen strictly before the recording's last time
+                states[-1].next_drop_time = min(states[-1].next_drop_time, float(block_max))
+
+            for i in range(first_active, n_drops):
+                state = states[i]
+                if state.default_start > time_values[-1] and not is_final:
+                    break
+                if state.status != "done" or not state.basal_done:
+                    self._advance_drop(i, states, time_values, values, is_final)
+
+            while first_active < n_drops and states[first_active].status == "done" and states[first_active].basal_done:
+                first_active += 1
+
+        return self._collect_windows(states, max_time)
+
+    def _advance_drop(self, i, states, time_values, values, is_final):
+        """Feeds one block of samples to drop `i`'s windows, in time order."""
+        state = states[i]
+        basal_acc, during_acc, after_acc = state.accumulators
+        block_end = time_values[-1]
+
+        def rows(start, end):
+            return int(np.searchsorted(time_values, start, side="left")), int(np.searchsorted(time_values, end, side="left"))
+
+        # **Exact-sample temperatures used for an empty basal window and for the response row**
+        for attr, target in (("drop_temp", state.drop_time), ("response_temp", state.response_time)):
+            if getattr(state, attr) is None:
+                idx = int(np.searchsorted(time_values, target, side="left"))
+                if idx < len(time_values) and time_values[idx] == target:
+                    setattr(state, attr, values[idx, 0])
+
+        # **Basal window start, once the previous drop's full recovery is known**
+        if state.basal_start is None:
+            if self.force_basal_computation:
+                state.basal_start, state.forced_basal = state.default_start, "global"
+            elif i == 0:
+                state.basal_start = state.default_start
+            elif states[i - 1].full_recovery_time is not None:
+                prev_full_recovery_time = states[i - 1].full_recovery_time
+                if prev_full_recovery_time >= state.drop_time:
+                    state.basal_start, state.forced_basal = state.drop_time, "no_recovery"
+                elif state.default_start < prev_full_recovery_time:
+                    state.basal_start, state.forced_basal = prev_full_recovery_time, "overlap_prevention"
+                else:
+                    state.basal_start = state.default_start
+                if state.basal_start != state.default_start:
+                    basal_acc.reset()  # Drop samples accumulated speculatively before the adjusted start
+
+        # **Basal window**
+        if not state.basal_done:
+            lo, hi = rows(state.basal_start if state.basal_start is not None else state.default_start, state.drop_time)
+            basal_acc.add(values[lo:hi])
+            if block_end >= state.drop_time or is_final:
+                state.basal_done = True
+                mean, std, n = basal_acc.stats()
+                if n[0] > 0:
+                    state.threshold = mean[0] - self.std_threshold * std[0]
+                elif state.drop_temp is not None:
+                    state.threshold = state.drop_temp
+                else:
+                    raise ValueError("Drop times with an empty basal window must match a sample time exactly.")
+                state.status = "searching"
+
+        # **Recovery search bounded by the next drop; the during window grows until recovery**
+        if state.status == "searching":
+            lo, hi = rows(state.response_time, state.next_drop_time)
+            crossing = np.flatnonzero(values[lo:hi, 0] >= state.threshold)
+            if len(crossing):
+                j = lo + crossing[0]
+                state.full_recovery_time = time_values[j]
+                state.reached_threshold = True
+                during_end = int(np.searchsorted(time_values, state.full_recovery_time, side="left"))
+                during_acc.add(values[lo:during_end])
+
+                state.after_start = state.full_recovery_time
+                state.after_end = state.after_start + self.window_after
+                if state.has_next and state.after_end > state.next_drop_time:
+                    state.after_end = state.next_drop_time
+                state.status = "after"
+            else:
+                during_acc.add(values[lo:hi])
+                if block_end >= state.next_drop_time or is_final:
+                    state.full_recovery_time = state.next_drop_time  # Never recovered: ends at the next drop
+                    state.status = "done"
+
+        # **After window**
+        if state.status == "after":
+            lo, hi = rows(state.after_start, state.after_end)
+            after_acc.add(values[lo:hi])
+            if block_end >= state.after_end or is_final:
+                state.status = "done"
+
+    def _collect_windows(self, states, max_time):
+        """Builds `compute_drop_windows` output and the (drop, window, column) statistics from the finished states."""
+        windows = []
+        n_stats = len(self.stat_columns)
+        mean = np.full((len(states), 3, n_stats), np.nan)
+        std = np.full((len(states), 3, n_stats), np.nan)
+        n = np.zeros((len(states), 3, n_stats), dtype=np.int64)
+
+        for i, state in enumerate(states):
+            if not state.reached_threshold:
+                state.full_recovery_time = self.drop_times[i + 1] if i + 1 < len(self.drop_times) else max_time
+            basal_start = 0 if state.basal_start == 0 else state.basal_start
+            basal_mean, basal_std, basal_n = state.accumulators[0].stats()
+
+            windows.append({
+                "basal_start": basal_start,
+                "drop_time": state.drop_time,
+                "response_time": state.response_time,
+                "full_recovery_time": state.full_recovery_time,
+                "after_start": state.after_start,
+                "after_end": state.after_end,
+                "reached_threshold": state.reached_threshold,
+                "forced_basal": state.forced_basal,
+                "basal_temp_mean": basal_mean[0] if basal_n[0] > 0 else np.nan,
+                "basal_temp_std": basal_std[0] if basal_n[0] > 0 else np.nan,
+                "temp_threshold": state.threshold,
+                "response_temp": state.response_temp,
+            })
+
+            for w, accumulator in enumerate(state.accumulators):
+                if w > 0 and not state.reached_threshold:
+                    continue
+                window_mean, window_std, window_n = accumulator.stats()
+                mean[i, w], std[i, w], n[i, w] = window_mean[1:], window_std[1:], window_n[1:]
+
+        self._stream_stats = (mean, std, n)
+        return windows
+
+    def window_stats_matrix(self, drop_intervals, recovery_failures):
+        """Statistics accumulated during the streaming pass (see `DropAnalysis.window_stats_matrix`)."""
+        if self._stream_stats is None:
+            self.compute_drop_windows()
+        return self._stream_stats
+
+    def update_drops(self, drop_times, recovery_times, wait_for_plots=False):
+        """
+        Re-analyses every drop in a new pass over the chunks: the trace is not
+        kept in memory, so edited drops cannot be recomputed on their own.
+        """
+        self.drop_times = [float(t) for t in drop_times]
+        self.recovery_times = [float(t) for t in recovery_times]
+        self._stream_stats = None
+        self.analyze_drops(wait_for_plots=wait_for_plots)
+        return list(range(len(self.results)))
+
+
+def run_streaming_analysis(source, output_dir="data_out", dataname=None, chunksize=DEFAULT_CHUNKSIZE,
+                           time_col="Time", temp_col="Temp", detect_hot_points=False, neighbor_threshold=5,
+                           preced_window=30, drop_factor=1.5, deriv_thresh=1, **analysis_kwargs):
+    """
+    Streams drop detection and drop analysis over a recording; returns (detection results, analysis).
+    Only cold drops can be analysed this way, so `detect_hot_points` is rejected before the first pass.
+    """
+    if detect_hot_points or analysis_kwargs.get("polarity", "cold") != "cold":
+        raise ValueError("Streaming analysis only analyses cold drops; load the recording for hot or mixed stimuli.")
+    results = stream_detect_drops(source, time_col=time_col, temp_col=temp_col, detect_hot_points=detect_hot_points,
+                                  neighbor_threshold=neighbor_threshold, preced_window=preced_window,
+                                  drop_factor=drop_factor, deriv_thresh=deriv_thresh, chunksize=chunksize)
+    analysis = StreamingDropAnalysis(source, results["drop_times"], results["recovery_times"], chunksize=chunksize,
+                                     output_dir=output_dir, dataname=dataname or os.path.basename(source),
+                                     time_col=time_col, temp_col=temp_col, save_plots=False, **analysis_kwargs)
+    analysis.analyze_drops()
+    return results, analysis
@@ -0,0 +1,86 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+
+def unit_names(n_units):
+    """Unit column names in the acquisition software's style (`6001 nw-2-01`, ...); none is a prefix of another."""
+    return [f"{6001 + i} nw-2-{i:03X}" for i in range(n_units)]
+
+
+def generate_recording(duration=3600, sampling_rate=1.0, n_units=12, n_drops=8, noise=0.02, failures=(),
+                       base_temp=26.0, drop_depth=(3.0, 6.0), seed=0):
+    """
+    Generates a synthetic recording in the `Time` / `Temp` / unit / `f-unit` schema.
+
+    The temperature sits at `base_temp` with Gaussian `noise` and has `n_drops`
+    evenly spaced cold drops: a ~2 s fall by a random depth, then a recovery back
+    to baseline. Drops whose index is in `failures` only recover half way and stay
+    below the recovery threshold until the next drop. Every unit has Poisson
+    event counts whose rate rises while the temperature is below baseline, and a
+    matching instantaneous-frequency column that is non-zero only on samples with events.
+    """
+    rng = np.random.default_rng(seed)
+    n_samples = int(round(duration * sampling_rate))
+    time_values = np.round(np.arange(n_samples) / sampling_rate, 6)
+    temp = np.full(n_samples, base_temp) + rng.normal(0, noise, n_samples)
+
+    # **Cold drops: fast fall, then recovery (or a partial one for failures)**
+    fall = max(2, int(round(2 * sampling_rate)))
+    margin = int(60 * sampling_rate)
+    starts = np.linspace(margin, max(margin, n_samples - 3 * margin), n_drops).astype(int) if n_drops else np.empty(0, dtype=int)
+    cooling = np.zeros(n_samples)
+    for k, start in enumerate(starts):
+        depth = rng.uniform(*drop_depth)
+        recovery = int(rng.uniform(20, 80) * sampling_rate)
+        end = starts[k + 1] if k + 1 < len(starts) else n_samples
+        fall_end = min(start + fall, end)
+        recovered = min(fall_end + recovery, end)
+        residual = 0.5 if k in failures else 0.0
+        cooling[start:fall_end] = np.linspace(0, depth, fall_end - start, endpoint=False)
+        cooling[fall_end:recovered] = depth * np.linspace(1, residual, recovered - fall_end)
+        cooling[recovered:end] = residual * depth
+    temp -= cooling
+
+    data = {"Time": time_values, "Temp": np.round(temp, 4)}
+
+    # **Cold-sensitive units: event rate grows with the temperature drop**
+    names = unit_names(n_units)
+    base_rates = rng.uniform(0.05, 1.0, n_units) / sampling_rate
+    gains = rng.uniform(0.0, 1.0, n_units) / sampling_rate
+    counts = rng.poisson(base_rates[None, :] + gains[None, :] * cooling[:, None]).astype(np.int32)
+    frequencies = np.where(counts > 0, np.round(counts * sampling_rate * rng.gamma(2.0, 0.5, counts.shape), 5), 0.0)
+    for j, name in enumerate(names):
+        data[name] = counts[:, j]
+    for j, name in enumerate(names):
+        data[f"f-{name}"] = frequencies[:, j]
+    return pd.DataFrame(data)
+
+
+def write_recording(path, **kwargs):
+    """Generates a synthetic recording (see `generate_recording`) and saves it as CSV; returns the DataFrame."""
+    df = generate_recording(**kwargs)
+    df.to_csv(path, index=False)
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic recording CSV for testing and benchmarking.")
+    parser.add_argument("output", help="CSV file to write.")
+    parser.add_argument("--duration", type=float, default=3600, help="Recording length in seconds.")
+    parser.add_argument("--rate", type=float, default=1.0, help="Sampling rate in Hz.")
+    parser.add_argument("--units", type=int, default=12, help="Number of units (each gets an event and a frequency column).")
+    parser.add_argument("--drops", type=int, default=8, help="Number of cold drops.")
+    parser.add_argument("--noise", type=float, default=0.02, help="Temperature noise (standard deviation, °C).")
+    parser.add_argument("--failures", type=int, nargs="*", default=[], help="Indices of drops that never fully recover.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args(argv)
+
+    df = write_recording(args.output, duration=args.duration, sampling_rate=args.rate, n_units=args.units,
+                         n_drops=args.drops, noise=args.noise, failures=tuple(args.failures), seed=args.seed)
+    print(f"Wrote {len(df)} samples x {args.units} units to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
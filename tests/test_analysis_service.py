@@ -0,0 +1,39 @@
+import shutil
+import time
+
+from analysis_service import AnalysisService
+from conftest import EXAMPLE_INPUT
+
+
+def wait_done(service, job_id, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = service.job(job_id)
+        if job["status"] in ("done", "error"):
+            return job
+        time.sleep(0.1)
+    raise TimeoutError(job_id)
+
+
+def test_cached_job_under_another_name_has_results(tmp_path):
+    for name in ("a.csv", "b.csv"):
+        shutil.copy(EXAMPLE_INPUT, tmp_path / name)
+    params = {"save_plots": False}
+
+    service = AnalysisService(str(tmp_path / "data"), workers=1, use_cache=False)
+    try:
+        first = wait_done(service, service.submit(str(tmp_path / "a.csv"), params)["id"])
+        assert first["status"] == "done" and not first["cached"]
+        expected = service.results(first["id"])
+    finally:
+        service.shutdown()
+
+    service = AnalysisService(str(tmp_path / "data"), workers=1, use_cache=False)  # New session: only the disk cache
+    try:
+        second = service.submit(str(tmp_path / "b.csv"), params)
+        assert second["cached"] and second["status"] == "done" and second["output_name"] == "a"
+        results = service.results(second["id"])
+        assert results is not None and results.equals(expected)
+        assert "a/results_a.cncol" in service.job_files(second["id"])
+    finally:
+        service.shutdown()
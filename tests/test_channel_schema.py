@@ -0,0 +1,85 @@
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from channel_schema import ChannelMatrix, ChannelSchema, compact_count_dtype
+from segment_stats import SegmentStats
+from synthetic_data import generate_recording
+
+
+def test_frequency_columns_match_units_exactly():
+    schema = ChannelSchema(["Time", "Temp", "U1", "U11", "f-U11", "f-U1", "U2"])
+    assert schema.units == ["U1", "U11", "U2"]
+    assert schema.frequency_columns == {"U1": "f-U1", "U11": "f-U11"}
+    assert schema.stat_columns == ["U1", "U11", "U2", "f-U1", "f-U11"]
+    assert schema.unmatched_frequency_columns == []
+
+    df = pd.DataFrame({"Time": [0.0, 1.0], "Temp": [26.0, 25.0], "U1": [1, 2], "U11": [3, 4], "f-U11": [5.0, 6.0],
+                       "f-U1": [7.0, 8.0], "U2": [0, 1]})
+    channels = ChannelMatrix.from_frame(df, schema)
+    for col in df.columns:
+        assert np.array_equal(channels.column(col), df[col].to_numpy())
+
+
+def test_frequency_column_of_a_longer_unit_is_not_matched_to_its_prefix():
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        schema = ChannelSchema(["Time", "Temp", "U1", "f-U11"])
+    assert schema.frequency_columns == {}
+    assert schema.unmatched_frequency_columns == ["f-U11"]
+    assert "f-U11" in output.getvalue()
+
+
+@pytest.mark.parametrize("columns, message", [
+    (["Time", "Temp", "U1", "U1"], "Duplicate column names in the recording: U1"),
+    (["Time", "Time", "Temp", "U1"], "Duplicate column names in the recording: Time"),
+    (["Time", "Temp", "Temp", "f-U1", "f-U1"], "Duplicate column names in the recording: Temp, f-U1"),
+    (["t", "Temp", "U1"], "Time column 'Time' not found"),
+    (["Time", "T", "U1"], "Temperature column 'Temp' not found"),
+])
+def test_invalid_headers_raise(columns, message):
+    with pytest.raises(ValueError, match=message):
+        ChannelSchema(columns)
+
+
+@pytest.mark.parametrize("columns, dtype", [
+    ([np.array([0, 255])], np.uint8),
+    ([np.array([0, 256])], np.uint16),
+    ([np.array([3, 7]), np.array([255])], np.uint8),
+    ([np.array([3, 7]), np.array([256])], np.uint16),
+    ([np.array([-1, 5])], np.int8),
+    ([np.array([-1, 255])], np.int16),
+    ([np.array([-129, 0])], np.int16),
+    ([np.array([0.0, 255.0])], np.uint8),
+    ([np.array([0.0, np.nan])], np.float32),
+    ([np.array([0.5])], np.float32),
+    ([np.array([], dtype=float), np.array([1])], np.uint8),
+    ([], np.uint8),
+])
+def test_compact_count_dtype(columns, dtype):
+    assert compact_count_dtype(columns) == np.dtype(dtype)
+
+
+def test_count_matrix_holds_counts_exactly():
+    df = pd.DataFrame({"Time": [0.0, 1.0, 2.0], "Temp": 26.0, "U1": [0, 255, 3], "U2": [-1, 256, 0]})
+    channels = ChannelMatrix.from_frame(df)
+    assert channels.events.dtype == np.int16
+    assert np.array_equal(channels.events, df[["U1", "U2"]].to_numpy())
+
+
+def test_segment_stats_from_channels_matches_dataframe():
+    df = generate_recording(duration=1200, n_units=5, n_drops=4, seed=3)
+    df.loc[100:130, "f-" + df.columns[3]] = np.nan
+    channels = ChannelMatrix.from_frame(df)
+    from_channels = SegmentStats.from_channels(channels)
+    from_dataframe = SegmentStats.from_dataframe(df, "Time", channels.schema.stat_columns)
+    assert from_channels.columns == from_dataframe.columns
+
+    rng = np.random.default_rng(0)
+    starts = rng.uniform(-10, 1200, 200)
+    ends = starts + rng.uniform(0, 300, 200)
+    for actual, expected in zip(from_channels.window_stats(starts, ends), from_dataframe.window_stats(starts, ends)):
+        # Frequencies are float32 in the channel matrix
+        assert np.allclose(actual, expected, equal_nan=True, rtol=1e-6, atol=1e-6)
@@ -0,0 +1,83 @@
+import contextlib
+import io
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cohort import aggregate_cohort, filename_metadata
+from columnar import read_frame
+from drop_analysis import DropAnalysis
+from synthetic_data import generate_recording
+from time_finder import TimeFinder
+
+
+FACTORS = {"injury": ["Intact", "BAK", "BAK_Day14"], "sex": ["Female", "Male"], "day": r"Day(\d+)"}
+RECORDINGS = ["M1_BAK_Day14_Female", "M2_BAK_Female", "M3_Intact_Male", "M4_bak_day14_Male", "M5_BAK_Male"]
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("M1_BAK_Day14_Female", {"injury": "BAK_Day14", "sex": "Female", "day": "14"}),
+    ("M2_BAK_Female", {"injury": "BAK", "sex": "Female", "day": None}),
+    ("m4_bak_day14_male", {"injury": "BAK_Day14", "sex": "Male", "day": "14"}),
+    ("M6_BAKED_Femaleish", {"injury": None, "sex": None, "day": None}),
+])
+def test_filename_metadata(name, expected):
+    assert filename_metadata(name, FACTORS) == expected
+
+
+def build_output_tree(output_dir):
+    for seed, name in enumerate(RECORDINGS):
+        df = generate_recording(duration=900, n_units=3, n_drops=4, failures=(1,) if seed % 2 else (), seed=seed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = TimeFinder(df, dataname=f"{name}.csv", output_dir=str(output_dir / "batch"),
+                                 file_path=f"{name}.csv").run_analysis(plot_orig=False, user_confirmation=False,
+                                                                       plot_after=False)
+            DropAnalysis(df, results["drop_times"], results["recovery_times"], dataname=f"{name}.csv",
+                         output_dir=str(output_dir / "batch"), save_plots=False).analyze_drops()
+
+    # A recording analysed before numeric results tables were written
+    legacy = output_dir / "legacy" / "M9_BAK_Male"
+    legacy.mkdir(parents=True)
+    shutil.copy(output_dir / "batch" / "M5_BAK_Male" / "analyzed_M5_BAK_Male.csv", legacy / "analyzed_M9_BAK_Male.csv")
+
+
+def test_group_means_match_pandas(tmp_path):
+    build_output_tree(tmp_path)
+    pd.DataFrame({"recording": ["M2_BAK_Female.csv", "M3_Intact_Male"], "sex": ["Male", ""],
+                  "cohort": ["A", "B"]}).to_csv(tmp_path / "manifest.csv", index=False)
+
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        summary, recordings = aggregate_cohort(str(tmp_path), factors=FACTORS, sidecar_path=str(tmp_path / "manifest.csv"))
+    assert "skipping 1 recordings" in output.getvalue() and "M9_BAK_Male" in output.getvalue()
+
+    # **Manifest values take precedence over the filename (an empty cell clears the field)**
+    metadata = recordings.set_index("recording").fillna("-")
+    assert list(metadata.index) == sorted(RECORDINGS)
+    assert metadata.loc["M1_BAK_Day14_Female", ["injury", "sex", "day", "cohort"]].tolist() == ["BAK_Day14", "Female", "14", "-"]
+    assert metadata.loc["M2_BAK_Female", ["injury", "sex", "cohort"]].tolist() == ["BAK", "Male", "A"]
+    assert metadata.loc["M3_Intact_Male", ["injury", "sex", "cohort"]].tolist() == ["Intact", "-", "B"]
+
+    # **Group statistics against a pandas groupby over the concatenated tables**
+    tables = []
+    for name in RECORDINGS:
+        table = read_frame(str(tmp_path / "batch" / name / f"results_{name}.cncol"), mmap=False)
+        for column in ("injury", "sex", "day", "cohort"):
+            table[column] = metadata.loc[name, column]
+        table["recording"] = name
+        tables.append(table)
+    keys = ["injury", "sex", "day", "cohort", "drop", "window", "metric"]
+    combined = pd.concat(tables, ignore_index=True).astype({"window": str, "metric": str})
+    combined = combined.dropna(subset=["mean"])
+    expected = combined.groupby(keys)["mean"].agg(["mean", "std", "count"])
+    expected["n_recordings"] = combined.groupby(keys)["recording"].nunique()
+
+    actual = summary[summary["n"] > 0].astype({"window": str, "metric": str})
+    actual = actual.fillna({"sex": "-", "day": "-", "cohort": "-"}).set_index(keys).loc[expected.index]
+    assert len(actual) == len(expected) == (summary["n"] > 0).sum()
+    assert np.allclose(actual["mean"], expected["mean"])
+    assert np.allclose(actual["std"], expected["std"], equal_nan=True)
+    assert np.array_equal(actual["n"], expected["count"])
+    assert np.array_equal(actual["n_recordings"], expected["n_recordings"])
+    assert np.allclose(actual["sem"], expected["std"] / np.sqrt(expected["count"]), equal_nan=True)
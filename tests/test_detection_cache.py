@@ -0,0 +1,103 @@
+import contextlib
+import hashlib
+import io
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from conftest import EXAMPLE_INPUT
+from detection_cache import DETECTION_DIR, DetectionCache, apply_corrections
+from detectors import CusumDetector, SmoothedDerivativeDetector
+from time_finder import TimeFinder
+from time_index import TimeIndex
+
+
+def detect(csv_path, cache, output_dir, reviewer=None, **kwargs):
+    """Runs TimeFinder on `csv_path` with the cache; returns (drops, recoveries, printed output)."""
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        tool = TimeFinder(pd.read_csv(csv_path), dataname="rec.csv", output_dir=str(output_dir), file_path=str(csv_path),
+                          detection_cache=cache, reviewer=reviewer, show_plots=False, **kwargs)
+        tool.run_analysis(plot_orig=False, user_confirmation=reviewer is not None, plot_after=False)
+    return tool.drop_points, tool.recovery_points, output.getvalue()
+
+
+def test_apply_corrections():
+    points = [10.0, 20.0, 30.0]
+    assert apply_corrections(points, [("add", 25.0), ("remove", 10.0)]) == [20.0, 25.0, 30.0]
+    assert apply_corrections(points, [("add", 5.0), ("remove", 5.0), ("remove", 40.0)]) == points
+    assert apply_corrections(points, [["remove", 20.0], ["add", 20.0]]) == points
+    assert points == [10.0, 20.0, 30.0]
+
+
+def test_corrections_are_replayed(tmp_path):
+    csv_path = tmp_path / "rec.csv"
+    shutil.copy(EXAMPLE_INPUT, csv_path)
+    cache = DetectionCache(str(tmp_path / "cache"))
+    detected_drops, detected_recoveries, _ = detect(csv_path, cache, tmp_path)
+    cache.clear()
+
+    # Typed times snap to the nearest sample (add) or detected point (remove)
+    added = float(TimeIndex(pd.read_csv(csv_path)["Time"]).snap(detected_drops[-1] - 40.3))
+    edits = {"Drop Start": [("remove", detected_drops[1] + 0.2), ("add", detected_drops[-1] - 40.3)],
+             "Recovery": [("remove", detected_recoveries[1])]}
+    drops, recoveries, _ = detect(csv_path, cache, tmp_path, reviewer=lambda tool: edits)
+    assert drops == sorted([t for t in detected_drops if t != detected_drops[1]] + [added])
+    assert recoveries == detected_recoveries[:1] + detected_recoveries[2:]
+
+    # **Same recording and detection parameters: the corrected points come back**
+    cached_drops, cached_recoveries, output = detect(csv_path, cache, tmp_path)
+    assert "from the detection cache" in output
+    assert (cached_drops, cached_recoveries) == (drops, recoveries)
+
+    # **A detection parameter or the recording changed: fresh detection**
+    changed_drops, _, output = detect(csv_path, cache, tmp_path, drop_factor=1.6)
+    assert "from the detection cache" not in output
+    assert changed_drops == detect(csv_path, None, tmp_path, drop_factor=1.6)[0]
+
+    df = pd.read_csv(csv_path)
+    df.loc[0, "Temp"] += 0.01
+    df.to_csv(csv_path, index=False)
+    edited_drops, _, output = detect(csv_path, cache, tmp_path)
+    assert "from the detection cache" not in output
+    assert edited_drops == detected_drops
+
+
+def test_default_detector_keys_are_unchanged(tmp_path):
+    csv_path = tmp_path / "rec.csv"
+    shutil.copy(EXAMPLE_INPUT, csv_path)
+    cache = DetectionCache(str(tmp_path / "cache"))
+    with contextlib.redirect_stdout(io.StringIO()):
+        tool = TimeFinder(pd.read_csv(csv_path), output_dir=str(tmp_path), file_path=str(csv_path))
+
+    # The parameters keyed before pluggable detectors existed
+    assert tool.detection_params() == {
+        "time_col": "Time", "temp_col": "Temp", "detect_hot_points": False, "neighbor_threshold": 5,
+        "preceding_window": 30, "drop_threshold_factor": 1.5, "derivative_threshold": -1,
+    }
+    key = cache.key(str(csv_path), tool.detection_params())
+    assert key.endswith("-" + hashlib.sha1(
+        b'{"derivative_threshold": -1, "detect_hot_points": false, "drop_threshold_factor": 1.5, '
+        b'"neighbor_threshold": 5, "preceding_window": 30, "temp_col": "Temp", "time_col": "Time"}').hexdigest()[:12])
+
+    # Other detectors never share an entry with the default one
+    keys = {key}
+    for detector in (SmoothedDerivativeDetector(), CusumDetector()):
+        with contextlib.redirect_stdout(io.StringIO()):
+            other = TimeFinder(pd.read_csv(csv_path), output_dir=str(tmp_path), file_path=str(csv_path), detector=detector)
+        assert other.detection_params()["detector"] == detector.name
+        keys.add(cache.key(str(csv_path), other.detection_params()))
+    assert len(keys) == 3
+
+
+@pytest.mark.parametrize("corrupt", ["", "{not json"])
+def test_unreadable_entries_are_misses(tmp_path, corrupt):
+    csv_path = tmp_path / "rec.csv"
+    shutil.copy(EXAMPLE_INPUT, csv_path)
+    cache = DetectionCache(str(tmp_path / "cache"))
+    cache.save(str(csv_path), {"a": 1}, [1.0], [2.0], {"Drop Start": [], "Recovery": []})
+    assert cache.load(str(csv_path), {"a": 1})["drop_times"] == [1.0]
+    [entry] = os.listdir(tmp_path / "cache" / DETECTION_DIR)
+    (tmp_path / "cache" / DETECTION_DIR / entry).write_text(corrupt)
+    assert cache.load(str(csv_path), {"a": 1}) is None
@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import EXAMPLE_INPUT
+from detectors import (CusumDetector, DerivativeDetector, SmoothedDerivativeDetector, detect_drop_indices,
+                       detect_event_indices)
+from synthetic_data import generate_recording
+
+
+def old_detection(temp_series, dT_dt, derivative_threshold, neighbor_threshold, preceding_window,
+                  drop_threshold_factor, detect_hot_points=False):
+    """The original per-cluster loops of `TimeFinder.detect_drops`, returning (refined_drops, recoveries)."""
+    drop_candidates = np.where(dT_dt > derivative_threshold)[0] if detect_hot_points else np.where(dT_dt < derivative_threshold)[0]
+    if len(drop_candidates) == 0:
+        return None, None
+
+    clusters = []
+    current_cluster = [drop_candidates[0]]
+    for i in range(1, len(drop_candidates)):
+        if drop_candidates[i] - drop_candidates[i - 1] <= neighbor_threshold:
+            current_cluster.append(drop_candidates[i])
+        else:
+            clusters.append(current_cluster)
+            current_cluster = [drop_candidates[i]]
+    clusters.append(current_cluster)
+
+    refined_drops, recoveries = [], []
+    for cluster in clusters:
+        start_index = max(0, cluster[0] - preceding_window)
+        preceding_values = temp_series[start_index:cluster[0]]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            baseline_fluctuation = np.mean(np.abs(np.diff(preceding_values))) if len(preceding_values) > 1 else np.nan
+
+        drop_index = None
+        for idx in cluster:
+            if abs(dT_dt[idx]) > drop_threshold_factor * baseline_fluctuation:
+                refined_drops.append(idx - 1)
+                drop_index = idx
+                break
+
+        if drop_index is not None:
+            for idx in range(drop_index + 1, len(dT_dt) - 1):
+                if (dT_dt[idx] > 0 and not detect_hot_points) or (dT_dt[idx] < 0 and detect_hot_points):
+                    recoveries.append(idx - 1)
+                    break
+    return refined_drops, recoveries
+
+
+def old_bidirectional(temp_series, dT_dt, deriv_thresh, neighbor_threshold, preceding_window, drop_threshold_factor):
+    """Both old loops, merged in time order without unrecovered events and returns of the previous event."""
+    events = []
+    for hot in (False, True):
+        drops, recoveries = old_detection(temp_series, dT_dt, deriv_thresh if hot else -deriv_thresh,
+                                          neighbor_threshold, preceding_window, drop_threshold_factor, hot)
+        if drops is not None:
+            events += [(drop, recovery, hot) for drop, recovery in zip(drops, recoveries)]
+    events.sort()
+
+    kept = []
+    for drop, recovery, hot in events:
+        if kept and kept[-1][2] != hot:
+            last_drop, last_recovery, _ = kept[-1]
+            halfway = (temp_series[last_drop] + temp_series[last_recovery]) / 2
+            if (temp_series[drop] < halfway) if hot else (temp_series[drop] > halfway):
+                continue
+        kept.append((drop, recovery, hot))
+    return kept
+
+
+def traces():
+    df = pd.read_csv(EXAMPLE_INPUT)
+    yield "example", df["Time"].to_numpy(dtype=float), df["Temp"].to_numpy(dtype=float)
+    for seed, (noise, rate) in enumerate([(0.05, 1.0), (0.3, 1.0), (0.6, 1.0), (0.2, 4.0), (0.8, 2.0)]):
+        df = generate_recording(duration=1800, sampling_rate=rate, n_units=1, n_drops=6, noise=noise, seed=seed)
+        time_values, temp = df["Time"].to_numpy(dtype=float), df["Temp"].to_numpy(dtype=float)
+        # Heat pulses between the cold drops, so both directions have events
+        for centre in np.linspace(200, 1600, 4):
+            temp = temp + 5.0 * np.exp(-0.5 * ((time_values - centre) / 2.0) ** 2)
+        yield f"synthetic-{seed}", time_values, temp
+
+
+TRACES = list(traces())
+
+
+@pytest.mark.parametrize("name, time_values, temp", TRACES, ids=[t[0] for t in TRACES])
+@pytest.mark.parametrize("detect_hot_points", [False, True])
+@pytest.mark.parametrize("settings", [(1, 5, 30, 1.5), (0.3, 3, 10, 1.2), (0.5, 8, 60, 3.0)])
+def test_drop_indices_match_old_loops(name, time_values, temp, detect_hot_points, settings):
+    deriv_thresh, neighbor_threshold, preced_window, drop_factor = settings
+    dT_dt = np.gradient(temp, time_values)
+    threshold = deriv_thresh if detect_hot_points else -deriv_thresh
+    drops, recoveries = detect_drop_indices(temp, dT_dt, threshold, neighbor_threshold, preced_window, drop_factor,
+                                            detect_hot_points)
+    expected_drops, expected_recoveries = old_detection(temp, dT_dt, threshold, neighbor_threshold, preced_window,
+                                                        drop_factor, detect_hot_points)
+    if expected_drops is None:
+        assert drops is None and recoveries is None
+    else:
+        assert list(drops) == expected_drops
+        assert list(recoveries) == expected_recoveries
+
+
+@pytest.mark.parametrize("name, time_values, temp", TRACES, ids=[t[0] for t in TRACES])
+@pytest.mark.parametrize("settings", [(1, 5, 30, 1.5), (0.3, 3, 10, 1.2)])
+def test_bidirectional_matches_old_loops(name, time_values, temp, settings):
+    deriv_thresh, neighbor_threshold, preced_window, drop_factor = settings
+    dT_dt = np.gradient(temp, time_values)
+    events, recoveries, hot = detect_event_indices(temp, dT_dt, deriv_thresh, neighbor_threshold, preced_window,
+                                                   drop_factor)
+    expected = old_bidirectional(temp, dT_dt, deriv_thresh, neighbor_threshold, preced_window, drop_factor)
+    found = [] if events is None else list(zip(events.tolist(), recoveries.tolist(), hot.tolist()))
+    assert found == expected
+    if name != "example":
+        assert {False, True} <= {h for _, _, h in expected}
+
+
+@pytest.mark.parametrize("name, time_values, temp", TRACES, ids=[t[0] for t in TRACES])
+@pytest.mark.parametrize("direction", ["cold", "hot", "both"])
+@pytest.mark.parametrize("settings", [(1, 5, 30, 1.5), (0.3, 3, 10, 1.2)])
+def test_derivative_detector_matches_detect_drop_indices(name, time_values, temp, direction, settings):
+    deriv_thresh, neighbor_threshold, preced_window, drop_factor = settings
+    detector = DerivativeDetector(deriv_thresh=deriv_thresh, neighbor_threshold=neighbor_threshold,
+                                  preced_window=preced_window, drop_factor=drop_factor,
+                                  detect_hot_points=direction == "hot", bidirectional=direction == "both")
+    drops, recoveries = detector.detect(time_values, temp)
+    dT_dt = np.gradient(temp, time_values)
+    if direction == "both":
+        expected_drops, expected_recoveries, _ = detect_event_indices(temp, dT_dt, deriv_thresh, neighbor_threshold,
+                                                                      preced_window, drop_factor)
+    else:
+        expected_drops, expected_recoveries = detect_drop_indices(
+            temp, dT_dt, deriv_thresh if direction == "hot" else -deriv_thresh, neighbor_threshold, preced_window,
+            drop_factor, direction == "hot")
+    if expected_drops is None:
+        assert drops is None and recoveries is None and detector.report["drops"] == 0
+    else:
+        assert np.array_equal(drops, expected_drops) and np.array_equal(recoveries, expected_recoveries)
+        assert detector.report["drops"] == len(expected_drops)
+
+
+def planted_recording(sampling_rate, noise, seed, n_drops=8):
+    """A synthetic trace and the times of its planted drops (their first falling sample)."""
+    df = generate_recording(duration=2400, sampling_rate=sampling_rate, n_units=1, n_drops=n_drops, noise=noise,
+                            failures=(3,), seed=seed)
+    margin = int(60 * sampling_rate)
+    starts = np.linspace(margin, len(df) - 3 * margin, n_drops).astype(int)  # As generate_recording places them
+    return df["Time"].to_numpy(dtype=float), df["Temp"].to_numpy(dtype=float), starts / sampling_rate
+
+
+# CUSUM's default threshold (10 noise units) is above a 2 s, 3 °C fall at the highest noise level
+@pytest.mark.parametrize("detector, noise", [(SmoothedDerivativeDetector(smooth_s=2.0), noise) for noise in (0.02, 0.1, 0.3)]
+                         + [(CusumDetector(), noise) for noise in (0.02, 0.1)], ids=lambda p: getattr(p, "name", p))
+@pytest.mark.parametrize("sampling_rate", [1.0, 4.0, 10.0])
+@pytest.mark.parametrize("seed", [0, 1])
+def test_detectors_recover_planted_drops(detector, noise, sampling_rate, seed):
+    time_values, temp, planted = planted_recording(sampling_rate, noise, seed)
+    drops, recoveries = detector.detect(time_values, temp)
+    assert drops is not None and len(drops) == len(planted)
+    assert np.all(np.abs(time_values[drops] - planted) <= 2.0)
+    # Each recovery point falls between its drop and the end of the planted recovery (fall + at most 80 s)
+    assert np.all(time_values[recoveries] > time_values[drops])
+    assert np.all(time_values[recoveries] <= planted + 82.0)
@@ -0,0 +1,66 @@
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import EXAMPLE_INPUT
+from drop_analysis import DropAnalysis
+from online_detector import replay
+from synthetic_data import generate_recording
+from time_finder import TimeFinder
+
+
+def recordings():
+    yield "example", pd.read_csv(EXAMPLE_INPUT)
+    yield "failures", generate_recording(duration=2400, n_units=4, n_drops=10, failures=(1, 2, 5), seed=3)
+    yield "noisy", generate_recording(duration=1800, sampling_rate=2.0, n_units=4, n_drops=8, noise=0.05, seed=4)
+    df = generate_recording(duration=1200, n_units=3, n_drops=5, seed=5)
+    df["Time"] = np.cumsum(np.random.default_rng(1).uniform(0.5, 1.5, len(df))).round(3)  # Non-uniform sampling
+    yield "non-uniform", df
+
+
+RECORDINGS = list(recordings())
+
+
+def batch_analysis(df, tmp_path, detect_hot_points, force_basal_computation):
+    with contextlib.redirect_stdout(io.StringIO()):
+        tool = TimeFinder(df, dataname="rec.csv", output_dir=str(tmp_path), file_path="rec.csv",
+                          detect_hot_points=detect_hot_points)
+        results = tool.run_analysis(plot_orig=False, user_confirmation=False, plot_after=False)
+    analysis = DropAnalysis(df, results["drop_times"], results["recovery_times"], dataname="rec.csv",
+                            output_dir=str(tmp_path), save_plots=False, polarity=tool.polarity,
+                            force_basal_computation=force_basal_computation)
+    return results, analysis
+
+
+@pytest.mark.parametrize("name, df", RECORDINGS, ids=[r[0] for r in RECORDINGS])
+@pytest.mark.parametrize("block_size", [1, 7, 100000])
+@pytest.mark.parametrize("detect_hot_points, force_basal_computation", [(False, False), (False, True), (True, False)])
+def test_replay_matches_batch_analysis(tmp_path, name, df, block_size, detect_hot_points, force_basal_computation):
+    results, analysis = batch_analysis(df, tmp_path, detect_hot_points, force_basal_computation)
+    detector = replay(df, block_size=block_size, detect_hot_points=detect_hot_points,
+                      force_basal_computation=force_basal_computation, value_columns=analysis.stat_columns)
+
+    assert detector.drop_times == [float(t) for t in results["drop_times"]]
+    assert detector.recovery_times == [float(t) for t in results["recovery_times"]]
+
+    windows = analysis.compute_drop_windows()
+    assert len(detector.windows) == len(windows)
+    intervals = [DropAnalysis.drop_row(window)[1] for window in windows]
+    failures = [not window["reached_threshold"] for window in windows]
+    mean, std, n = analysis.window_stats_matrix(intervals, failures)
+    for i, (online, expected) in enumerate(zip(detector.windows, windows)):
+        for key in ("basal_start", "full_recovery_time", "after_start", "after_end", "reached_threshold", "forced_basal"):
+            assert online[key] == expected[key], (i, key)
+        for key in ("basal_temp_mean", "basal_temp_std", "temp_threshold"):
+            assert np.isclose(online[key], expected[key], equal_nan=True), (i, key)
+        for w, window in enumerate(("basal", "during", "after")):
+            if window not in online["stats"]:
+                assert np.isnan(mean[i, w]).all(), (i, window)
+                continue
+            online_mean, online_std, online_n = online["stats"][window]
+            assert np.allclose(online_mean[1:], mean[i, w], equal_nan=True), (i, window)
+            assert np.allclose(online_std[1:], std[i, w], equal_nan=True), (i, window)
+            assert np.array_equal(online_n[1:], n[i, w]), (i, window)
@@ -0,0 +1,37 @@
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import EXAMPLE_INPUT
+from drop_analysis import DropAnalysis
+from parameter_sweep import ParameterSweep
+from time_finder import TimeFinder
+
+
+@pytest.mark.parametrize("detect_hot_points", [False, True])
+def test_sweep_matches_drop_analysis(tmp_path, detect_hot_points):
+    df = pd.read_csv(EXAMPLE_INPUT)
+    with contextlib.redirect_stdout(io.StringIO()):
+        tool = TimeFinder(df, dataname="rec.csv", output_dir=str(tmp_path), file_path="rec.csv",
+                          detect_hot_points=detect_hot_points)
+        results = tool.run_analysis(plot_orig=False, user_confirmation=False, plot_after=False)
+        analysis = DropAnalysis(df, results["drop_times"], results["recovery_times"], dataname="rec.csv",
+                                output_dir=str(tmp_path), save_plots=False, polarity=tool.polarity)
+        analysis.analyze_drops()
+
+    sweep = ParameterSweep(df)
+    summary, _ = sweep.evaluate({"detect_hot_points": detect_hot_points, "neighbor_threshold": 5, "preced_window": 30,
+                                 "drop_factor": 1.5, "deriv_thresh": 1},
+                                [{"window_before": 30, "window_after": 30, "std_threshold": 2,
+                                  "force_basal_computation": False}])
+    assert summary[0]["num_drops"] == len(results["drop_times"])
+    assert summary[0]["recovery_failures"] == sum(analysis.recovery_failures)
+
+    failures, mean, _, _ = sweep.analyze(np.asarray(results["drop_times"]), np.asarray(results["recovery_times"]),
+                                         30, 30, 2, False, polarity=tool.polarity)
+    assert list(failures) == list(analysis.recovery_failures)
+    expected, _, _ = analysis.window_stats_matrix(analysis.drop_intervals, analysis.recovery_failures)
+    assert np.allclose(mean, expected, equal_nan=True)
@@ -0,0 +1,125 @@
+import contextlib
+import io
+import os
+
+import numpy as np
+import pytest
+
+from drop_analysis import DropAnalysis
+from plot_rendering import PlotRenderer, event_histograms, minmax_decimate, render_temp_plot
+from synthetic_data import generate_recording
+from time_finder import TimeFinder
+
+
+def render_recording(output_dir, renderer):
+    df = generate_recording(duration=600, n_units=2, n_drops=3, seed=5)
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = TimeFinder(df, dataname="rec.csv", output_dir=str(output_dir), file_path="rec.csv").run_analysis(
+            plot_orig=False, user_confirmation=False, plot_after=False)
+        analysis = DropAnalysis(df, results["drop_times"], results["recovery_times"], dataname="rec.csv",
+                                output_dir=str(output_dir), plot_renderer=renderer)
+        analysis.analyze_drops(wait_for_plots=False)
+        paths = analysis.wait_for_plots()
+    return sorted(os.path.relpath(path, output_dir) for path in paths)
+
+
+def test_pooled_renderer_writes_the_same_figures(tmp_path):
+    in_process = render_recording(tmp_path / "in-process", PlotRenderer(workers=0))
+    with PlotRenderer(workers=2) as renderer:
+        pooled = render_recording(tmp_path / "pooled", renderer)
+
+    assert in_process == pooled
+    assert any(path.endswith("_temp.png") for path in pooled)
+    for path in pooled:
+        assert (tmp_path / "in-process" / path).read_bytes() == (tmp_path / "pooled" / path).read_bytes()
+
+
+def test_cancel_drops_queued_figures(tmp_path):
+    time_values = np.arange(200000, dtype=float)
+    temp_values = np.sin(time_values / 50.0)
+    renderer = PlotRenderer(workers=1)
+    paths = [str(tmp_path / f"temp_{k}.png") for k in range(6)]
+    futures = [renderer.submit(render_temp_plot, path, time_values, temp_values, [], [], []) for path in paths]
+    renderer.cancel(wait=True)
+
+    assert renderer.pending() == 0 and renderer.wait() == []
+    cancelled = [future.cancelled() for future in futures]
+    assert any(cancelled)
+    for path, was_cancelled in zip(paths, cancelled):
+        assert os.path.exists(path) != was_cancelled
+
+
+def reference_histograms(time_values, events, bins):
+    columns = [np.histogram(time_values, bins, weights=events[:, j]) for j in range(events.shape[1])]
+    return columns[0][1], np.column_stack([counts for counts, _ in columns])
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.int16, np.int64, np.float32, np.float64])
+@pytest.mark.parametrize("bins", [1, 7, 50])
+def test_event_histograms_match_np_histogram(dtype, bins):
+    rng = np.random.default_rng(bins)
+    time_values = np.cumsum(rng.uniform(0.01, 2.0, 5000))
+    events = rng.integers(0, 200, (5000, 4)).astype(dtype)  # uint8 sums overflow in every bin
+    edges, counts = event_histograms(time_values, events, bins=bins)
+    expected_edges, expected = reference_histograms(time_values, events.astype(float), bins)
+    assert np.array_equal(edges, expected_edges)
+    assert np.array_equal(counts, expected)
+    if dtype == np.uint8:
+        assert counts.max() > np.iinfo(np.uint8).max
+
+    edges, column = event_histograms(time_values, events[:, 2], bins=bins)
+    assert np.array_equal(column, expected[:, 2])
+
+
+def test_event_histograms_constant_time_column():
+    time_values = np.full(10, 3.0)
+    events = np.arange(20, dtype=np.uint8).reshape(10, 2)
+    edges, counts = event_histograms(time_values, events, bins=5)
+    expected_edges, expected = reference_histograms(time_values, events.astype(float), 5)
+    assert np.array_equal(edges, expected_edges)
+    assert np.array_equal(counts, expected)
+
+
+def test_event_histograms_empty_input():
+    edges, counts = event_histograms(np.empty(0), np.empty((0, 3), dtype=np.uint8), bins=5)
+    expected, expected_edges = np.histogram(np.empty(0), 5, weights=np.empty(0))
+    assert np.array_equal(edges, expected_edges)
+    assert counts.shape == (5, 3) and not counts.any() and not expected.any()
+
+
+def bin_extremes(time_values, values, edges):
+    """(min, max) of every bin with a valid sample, binned like the decimation (the last bin includes its right edge)."""
+    n_bins = len(edges) - 1
+    bins = np.clip(np.searchsorted(edges, time_values, side="right") - 1, 0, n_bins - 1)
+    return {b: (np.nanmin(values[bins == b]), np.nanmax(values[bins == b]))
+            for b in np.unique(bins) if not np.isnan(values[bins == b]).all()}
+
+
+@pytest.mark.parametrize("uniform", [True, False])
+def test_minmax_decimate_keeps_every_bin_extreme(uniform):
+    rng = np.random.default_rng(4)
+    time_values = np.arange(20000.0) if uniform else np.cumsum(rng.exponential(1.0, 20000))
+    values = np.cumsum(rng.normal(size=20000))
+    values[rng.integers(0, 20000, 30)] += 50.0  # Spikes
+    values[5000:5200] = np.nan
+    n_bins = 300
+
+    kept_time, kept = minmax_decimate(time_values, values, n_bins)
+    assert len(kept) <= 2 * n_bins
+    assert np.all(np.diff(kept_time) > 0)
+    # Kept samples are original samples, and every bin keeps its minimum and maximum
+    assert np.array_equal(kept, values[np.searchsorted(time_values, kept_time)])
+    edges = np.linspace(time_values[0], time_values[-1], n_bins + 1)
+    kept_extremes = bin_extremes(kept_time, kept, edges)
+    for b, extremes in bin_extremes(time_values, values, edges).items():
+        assert kept_extremes[b] == extremes
+
+
+def test_minmax_decimate_leaves_short_traces_unchanged():
+    time_values, values = np.arange(600.0), np.sin(np.arange(600.0))
+    kept_time, kept = minmax_decimate(time_values, values, 300)
+    assert kept_time is time_values and kept is values
+
+    constant_time = np.zeros(1000)
+    kept_time, kept = minmax_decimate(constant_time, values.repeat(2)[:1000], 10)
+    assert len(kept) == 1000
@@ -0,0 +1,96 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from drop_analysis import DropAnalysis
+from psth import PSTH, alignment_times, compute_psth
+from synthetic_data import generate_recording
+from time_finder import TimeFinder
+
+
+PRE, POST, BIN_WIDTH = 80.0, 90.0, 5.0
+
+
+def analysis_of(output_dir):
+    # Drop 3 never fully recovers; the first drop starts 60 s in, so its span begins before the recording
+    df = generate_recording(duration=1500, n_units=4, n_drops=6, failures=(2,), seed=8)
+    df = df.drop(columns=["f-" + df.columns[3]])  # One unit without a frequency column
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = TimeFinder(df, dataname="rec.csv", output_dir=str(output_dir), file_path="rec.csv").run_analysis(
+            plot_orig=False, user_confirmation=False, plot_after=False)
+    return df, DropAnalysis(df, results["drop_times"], results["recovery_times"], dataname="rec.csv",
+                            output_dir=str(output_dir), save_plots=False)
+
+
+def sliced_psth(df, analysis, align_times):
+    """PSTH tensors from pandas slices of every (drop, unit, bin)."""
+    edges = np.arange(-PRE, POST + BIN_WIDTH / 2, BIN_WIDTH)
+    units = analysis.neuron_columns
+    frequency_units = [unit for unit in units if unit in analysis.frequency_columns]
+    counts = np.full((len(align_times), len(units), len(edges) - 1), np.nan)
+    frequencies = np.full((len(align_times), len(frequency_units), len(edges) - 1), np.nan)
+    first, last = df["Time"].iloc[0], df["Time"].iloc[-1] + 1.0
+    for d, t in enumerate(align_times):
+        for b in range(len(edges) - 1):
+            start, end = t + edges[b], t + edges[b + 1]
+            if np.isnan(t) or start < first or end > last:
+                continue  # Outside the recording
+            segment = df[(df["Time"] >= start) & (df["Time"] < end)]
+            counts[d, :, b] = segment[units].sum().to_numpy()
+            frequencies[d, :, b] = segment[[analysis.frequency_columns[u] for u in frequency_units]].mean().to_numpy()
+    return counts, frequencies
+
+
+@pytest.mark.parametrize("align", ["drop", "response", "recovery"])
+def test_psth_matches_pandas_slices(tmp_path, align):
+    df, analysis = analysis_of(tmp_path)
+    psth = compute_psth(analysis, align=align, pre=PRE, post=POST, bin_width=BIN_WIDTH)
+    times = alignment_times(analysis, align)
+    counts, frequencies = sliced_psth(df, analysis, times)
+
+    assert psth.units == analysis.neuron_columns and len(psth.frequency_units) == len(psth.units) - 1
+    assert np.array_equal(psth.counts, counts, equal_nan=True)
+    assert np.allclose(psth.frequencies, frequencies, equal_nan=True, rtol=1e-6)
+
+    # NaN bins: spans that start before the recording, and the failed drop when aligned to full recovery
+    starts_before = times - PRE < df["Time"].iloc[0]
+    assert starts_before[0] or align == "recovery"
+    assert np.isnan(psth.counts[starts_before, :, 0]).all() and not np.isnan(psth.counts[~starts_before, :, 0]).all()
+    if align == "recovery":
+        windows = analysis.compute_drop_windows()
+        failed = [i for i, w in enumerate(windows) if not w["reached_threshold"]]
+        assert failed and np.isnan(psth.counts[failed]).all() and np.isnan(psth.align_times[failed]).all()
+
+
+def test_mean_curves_sem(tmp_path):
+    _, analysis = analysis_of(tmp_path)
+    psth = compute_psth(analysis, align="recovery", pre=PRE, post=POST, bin_width=BIN_WIDTH)
+    for metric, tensor in (("events", psth.counts), ("frequency", psth.frequencies)):
+        mean, sem, n = psth.mean_curves(metric)
+        values = tensor.astype(float)
+        expected_n = (~np.isnan(values)).sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            expected_sem = np.nanstd(values, axis=0, ddof=1) / np.sqrt(expected_n)
+        assert np.array_equal(n, expected_n)
+        assert np.allclose(mean, np.nanmean(values, axis=0), equal_nan=True)
+        assert np.allclose(sem, np.where(expected_n > 1, expected_sem, np.nan), equal_nan=True)
+
+    drops = np.array([0, 3, 4])
+    mean, _, n = psth.mean_curves("events", drops=drops)
+    assert np.allclose(mean, np.nanmean(psth.counts[drops].astype(float), axis=0), equal_nan=True)
+
+
+def test_save_load_round_trip(tmp_path):
+    _, analysis = analysis_of(tmp_path)
+    psth = compute_psth(analysis, align="response", pre=PRE, post=POST, bin_width=BIN_WIDTH)
+    psth.save(tmp_path / "psth.npz")
+    loaded = PSTH.load(tmp_path / "psth.npz")
+
+    for name in ("counts", "frequencies", "bin_edges", "align_times"):
+        assert np.array_equal(getattr(loaded, name), getattr(psth, name), equal_nan=True)
+        assert getattr(loaded, name).dtype == getattr(psth, name).dtype
+    assert loaded.units == psth.units and loaded.frequency_units == psth.frequency_units
+    assert (loaded.align, loaded.recording, loaded.polarities) == ("response", "rec", None)
+    assert loaded.curves_table().equals(psth.curves_table())
@@ -0,0 +1,72 @@
+import os
+import shutil
+
+import pandas as pd
+
+from conftest import EXAMPLE_INPUT
+from recording_cache import RecordingCache
+
+
+def mapped_on_windows(monkeypatch, locked_paths):
+    """Makes os.remove / os.replace fail on `locked_paths` like Windows does for memory-mapped files."""
+    remove, replace = os.remove, os.replace
+
+    def locked_remove(path):
+        if os.path.abspath(path) in locked_paths:
+            raise PermissionError(13, "The process cannot access the file", path)
+        return remove(path)
+
+    def locked_replace(src, dst):
+        if os.path.abspath(dst) in locked_paths:
+            raise PermissionError(13, "Access is denied", dst)
+        return replace(src, dst)
+
+    monkeypatch.setattr(os, "remove", locked_remove)
+    monkeypatch.setattr(os, "replace", locked_replace)
+
+
+def test_eviction_skips_mapped_entries(tmp_path, monkeypatch):
+    sources = []
+    for name in ("a.csv", "b.csv", "c.csv"):
+        path = tmp_path / name
+        df = pd.read_csv(EXAMPLE_INPUT)
+        df["Temp"] += len(sources)  # Different content, so different entries
+        df.to_csv(path, index=False)
+        sources.append(str(path))
+
+    cache = RecordingCache(str(tmp_path / "cache"))
+    first = cache.load(sources[0])
+    locked = {os.path.abspath(cache._entry_path(cache.key(sources[0])))}
+    mapped_on_windows(monkeypatch, locked)
+
+    cache.max_bytes = 1  # Every other entry must go
+    cache.load(sources[1])
+    cache.load(sources[2])
+    entries = sorted(name for name in os.listdir(cache.cache_dir) if name.endswith(".cncol"))
+    assert entries == sorted(os.path.basename(path) for path in locked | {cache._entry_path(cache.key(sources[2]))})
+    assert first["Temp"].iloc[0] == pd.read_csv(EXAMPLE_INPUT)["Temp"].iloc[0]
+
+    cache.clear()
+    assert [name for name in os.listdir(cache.cache_dir) if name.endswith(".cncol")] == [os.path.basename(next(iter(locked)))]
+
+
+def test_rewrite_of_a_mapped_entry_reuses_it(tmp_path, monkeypatch):
+    shutil.copy(EXAMPLE_INPUT, tmp_path / "a.csv")
+    source = str(tmp_path / "a.csv")
+    cache = RecordingCache(str(tmp_path / "cache"))
+    expected = cache.load(source)
+
+    # Another process wrote the entry between our lookup and our write, and maps it
+    entry = cache._entry_path(cache.key(source))
+    mapped_on_windows(monkeypatch, {os.path.abspath(entry)})
+    exists, lookups = os.path.exists, []
+
+    def missing_at_lookup(path):
+        if path == entry and not lookups:
+            lookups.append(path)
+            return False
+        return exists(path)
+
+    monkeypatch.setattr(os.path, "exists", missing_at_lookup)
+    pd.testing.assert_frame_equal(cache.load(source), expected)
+    assert lookups == [entry]
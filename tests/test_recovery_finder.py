@@ -0,0 +1,120 @@
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import EXAMPLE_INPUT
+from recovery_finder import find_full_recoveries, resolve_recovery_chain
+from synthetic_data import generate_recording
+from time_finder import TimeFinder
+
+
+def old_recovery_loop(df, drop_times, recovery_times, window_before, std_threshold, force_basal_computation,
+                      time_col="Time", temp_col="Temp"):
+    """The original per-drop loop of `DropAnalysis.analyze_drops`, including `prev_full_recovery_time` chaining."""
+    rows = []
+    prev_full_recovery_time = None
+    for i, (drop_time, response_time) in enumerate(zip(drop_times, recovery_times)):
+        if force_basal_computation:
+            basal_start = max(0, drop_time - window_before)
+            forced = "global"
+        elif i == 0:
+            basal_start = max(0, drop_time - window_before)
+            forced = None
+        elif prev_full_recovery_time is None or prev_full_recovery_time >= drop_time:
+            basal_start = drop_time
+            forced = "no_recovery"
+        elif prev_full_recovery_time and max(0, drop_time - window_before) < prev_full_recovery_time:
+            basal_start = prev_full_recovery_time
+            forced = "overlap_prevention"
+        else:
+            basal_start = max(0, drop_time - window_before)
+            forced = None
+
+        basal_segment = df[(df[time_col] >= basal_start) & (df[time_col] < drop_time)]
+        if basal_segment.empty:
+            temp_threshold = df.loc[df[time_col] == drop_time, temp_col].values[0]
+        else:
+            temp_threshold = basal_segment[temp_col].mean() - std_threshold * basal_segment[temp_col].std()
+
+        next_drop_time = drop_times[i + 1] if i + 1 < len(drop_times) else df[time_col].max()
+        full_recovery_time, reached_threshold = None, False
+        after = df[df[time_col] >= response_time]
+        for time_value, temp_value in zip(after[time_col], after[temp_col]):
+            if temp_value >= temp_threshold:
+                if time_value < next_drop_time:
+                    full_recovery_time, reached_threshold = time_value, True
+                    break
+        if full_recovery_time is None:
+            full_recovery_time = next_drop_time
+
+        rows.append((basal_start, forced, temp_threshold, full_recovery_time, reached_threshold))
+        prev_full_recovery_time = full_recovery_time
+    return rows
+
+
+def detected_drops(df, output_dir):
+    with contextlib.redirect_stdout(io.StringIO()):
+        finder = TimeFinder(df, dataname="rec.csv", output_dir=str(output_dir), file_path="rec.csv")
+        results = finder.run_analysis(plot_orig=False, user_confirmation=False, plot_after=False)
+    n_drops = min(len(results["drop_times"]), len(results["recovery_times"]))
+    return np.asarray(results["drop_times"][:n_drops], dtype=float), np.asarray(results["recovery_times"][:n_drops], dtype=float)
+
+
+def recordings():
+    yield "example", pd.read_csv(EXAMPLE_INPUT)
+    # Drops 2 and 3 never recover, so the following drops chain "no_recovery" basal windows
+    yield "failures", generate_recording(duration=2400, n_units=2, n_drops=6, failures=(2, 3), seed=1)
+    yield "dense", generate_recording(duration=1800, n_units=2, n_drops=10, failures=(4,), seed=2)
+
+
+@pytest.mark.parametrize("name, df", list(recordings()))
+@pytest.mark.parametrize("window_before, force_basal_computation", [(30, False), (400, False), (30, True), (400, True)])
+def test_chain_matches_old_loop(tmp_path, name, df, window_before, force_basal_computation):
+    drop_times, recovery_times = detected_drops(df, tmp_path)
+    assert len(drop_times) > 1
+    time_values, temp_values = df["Time"].to_numpy(dtype=float), df["Temp"].to_numpy(dtype=float)
+    next_drop_times = np.append(drop_times[1:], time_values.max())
+
+    chain = resolve_recovery_chain(time_values, temp_values, drop_times, recovery_times, next_drop_times,
+                                   window_before=window_before, std_threshold=2,
+                                   force_basal_computation=force_basal_computation)
+    expected = old_recovery_loop(df, list(drop_times), list(recovery_times), window_before, 2, force_basal_computation)
+
+    for i, (basal_start, forced, threshold, full_recovery_time, reached) in enumerate(expected):
+        assert chain["basal_start"][i] == basal_start
+        assert chain["forced_basal"][i] == forced
+        assert np.isclose(chain["temp_threshold"][i], threshold)
+        assert chain["full_recovery_time"][i] == full_recovery_time
+        assert (chain["recovery_index"][i] >= 0) == reached
+
+
+def test_chain_covers_overlap_and_no_recovery(tmp_path):
+    df = generate_recording(duration=2400, n_units=2, n_drops=6, failures=(2, 3), seed=1)
+    drop_times, recovery_times = detected_drops(df, tmp_path)
+    next_drop_times = np.append(drop_times[1:], df["Time"].max())
+    chain = resolve_recovery_chain(df["Time"].to_numpy(), df["Temp"].to_numpy(), drop_times, recovery_times,
+                                   next_drop_times, window_before=400)
+    assert {"no_recovery", "overlap_prevention"} <= set(chain["forced_basal"])
+
+
+@pytest.mark.parametrize("max_batch", [1, 50, 1 << 22])
+def test_find_full_recoveries_matches_loop(max_batch):
+    rng = np.random.default_rng(0)
+    time_values = np.arange(2000.0)
+    temp_values = np.cumsum(rng.normal(0, 0.2, len(time_values)))
+    starts = np.sort(rng.uniform(0, 1900, 40))
+    ends = starts + rng.uniform(0, 300, 40)
+    thresholds = np.interp(starts, time_values, temp_values) + rng.normal(0.5, 1.0, 40)
+    hot = rng.random(40) < 0.3
+
+    found = find_full_recoveries(time_values, temp_values, starts, thresholds, ends, max_batch=max_batch, hot=hot)
+    for i in range(40):
+        expected = -1
+        for j in np.flatnonzero((time_values >= starts[i]) & (time_values < ends[i])):
+            if (temp_values[j] <= thresholds[i]) if hot[i] else (temp_values[j] >= thresholds[i]):
+                expected = j
+                break
+        assert found[i] == expected
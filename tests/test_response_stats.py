@@ -0,0 +1,114 @@
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import EXAMPLE_INPUT
+from drop_analysis import DropAnalysis
+from response_stats import benjamini_hochberg, run_response_tests
+from synthetic_data import generate_recording
+from time_finder import TimeFinder
+
+
+def test_tests_do_not_need_analyze_drops(tmp_path):
+    df = pd.read_csv(EXAMPLE_INPUT)
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = TimeFinder(df, dataname="rec.csv", output_dir=str(tmp_path), file_path="rec.csv").run_analysis(
+            plot_orig=False, user_confirmation=False, plot_after=False)
+        analysis = DropAnalysis(df, results["drop_times"], results["recovery_times"], dataname="rec.csv",
+                                output_dir=str(tmp_path), save_plots=False)
+
+        before, before_responders = run_response_tests(analysis, n_resamples=200, workers=0)
+        assert len(before) > 0 and len(before_responders) > 0
+        assert analysis.drop_intervals == []  # Nothing was analysed or written
+
+        analysis.analyze_drops()
+        after, after_responders = run_response_tests(analysis, n_resamples=200, workers=0)
+    pd.testing.assert_frame_equal(before, after)
+    pd.testing.assert_frame_equal(before_responders, after_responders)
+
+
+def planted_recording(responding_units, n_units=12, seed=0):
+    """Synthetic drops whose first `responding_units` units fire faster (and at higher frequencies) while cold; the rest do not respond."""
+    df = generate_recording(duration=2400, n_units=n_units, n_drops=8, seed=seed)
+    rng = np.random.default_rng(seed)
+    cooling = np.clip(26.0 - df["Temp"].to_numpy(), 0.0, None)
+    units = [col for col in df.columns if col not in ("Time", "Temp") and not col.startswith("f-")]
+    for j, unit in enumerate(units):
+        gain = 1.0 if j < responding_units else 0.0
+        df[unit] = rng.poisson(0.5 + gain * cooling)
+        df[f"f-{unit}"] = rng.gamma(2.0, 2.0 + gain * cooling)  # Continuous, so permutation p-values have no ties
+    return df, units
+
+
+def response_tests(df, tmp_path, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = TimeFinder(df, dataname="rec.csv", output_dir=str(tmp_path), file_path="rec.csv").run_analysis(
+            plot_orig=False, user_confirmation=False, plot_after=False)
+        analysis = DropAnalysis(df, results["drop_times"], results["recovery_times"], dataname="rec.csv",
+                                output_dir=str(tmp_path), save_plots=False)
+        return run_response_tests(analysis, **kwargs)
+
+
+def test_planted_rate_increase_is_detected(tmp_path):
+    df, units = planted_recording(responding_units=4)
+    tests, responders = response_tests(df, tmp_path, n_resamples=2000, workers=0)
+
+    during = tests[(tests["comparison"] == "during_vs_basal") & (tests["metric"] == "events")]
+    planted = during["neuron"].isin(units[:4])
+    assert (during.loc[planted, "q_value"] < 0.01).all()
+    assert (during.loc[planted, "difference"] > 0).all()
+
+    flags = responders[(responders["comparison"] == "during_vs_basal") & (responders["metric"] == "events")]
+    flags = flags.set_index("neuron").loc[units]
+    assert flags["responder"].tolist() == [True] * 4 + [False] * (len(units) - 4)
+    assert (flags.loc[units[:4], "direction"] == "increase").all()
+
+
+def test_null_recording_has_uniform_p_values(tmp_path):
+    df, _ = planted_recording(responding_units=0, n_units=20, seed=1)
+    tests, responders = response_tests(df, tmp_path, n_resamples=1000, workers=0)
+    grid = np.arange(1, 10) / 10
+
+    # Continuous frequencies: the empirical CDF of the p-values follows the uniform one
+    p_values = tests.loc[tests["metric"] == "frequency", "p_value"].dropna().to_numpy()
+    assert len(p_values) > 200
+    assert np.all(np.abs([(p_values <= a).mean() - a for a in grid]) < 0.08)
+
+    # Event counts tie often, which only makes the test conservative
+    p_values = tests.loc[tests["metric"] == "events", "p_value"].dropna().to_numpy()
+    assert np.all([(p_values <= a).mean() <= a + 0.03 for a in grid])
+
+    assert not responders["responder"].any()
+    assert tests["significant"].mean() < 0.05
+
+
+def test_results_do_not_depend_on_workers(tmp_path):
+    df, _ = planted_recording(responding_units=3, n_units=5, seed=2)
+    in_process = response_tests(df, tmp_path, n_resamples=500, workers=0, seed=7)
+    pooled = response_tests(df, tmp_path, n_resamples=500, workers=2, seed=7)
+    for frame, expected in zip(pooled, in_process):
+        pd.testing.assert_frame_equal(frame, expected)
+
+
+def reference_benjamini_hochberg(p_values):
+    """q_i = min over p_j >= p_i of p_j * m / rank_j, capped at 1, over the m non-NaN p-values."""
+    tested = [p for p in p_values if not np.isnan(p)]
+    m = len(tested)
+    ranks = {p: rank for rank, p in enumerate(sorted(tested), start=1)}  # Ties share the highest rank
+    return np.array([np.nan if np.isnan(p) else min(1.0, min(q * m / ranks[q] for q in tested if q >= p))
+                     for p in p_values])
+
+
+@pytest.mark.parametrize("p_values", [
+    [],
+    [np.nan, np.nan],
+    [0.01],
+    [0.04, 0.01, 0.03, 0.02],
+    [0.5, 0.01, np.nan, 0.01, 0.2, 0.04, np.nan, 0.9, 0.04],
+    list(np.random.default_rng(3).uniform(0, 0.2, 50).round(3)) + [np.nan] * 5,
+])
+def test_benjamini_hochberg_matches_reference(p_values):
+    assert np.allclose(benjamini_hochberg(p_values), reference_benjamini_hochberg(p_values), equal_nan=True)
@@ -0,0 +1,86 @@
+import contextlib
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import EXAMPLE_INPUT
+from drop_analysis import DropAnalysis
+from segment_stats import SegmentStats
+from synthetic_data import generate_recording
+from time_finder import TimeFinder
+
+
+def pandas_cell(df, time_col, column, start, end):
+    """The "mean ± std" cell as the original per-window pandas code formatted it."""
+    if start is None or end is None or column not in df.columns:
+        return "N/A"
+    segment = df[(df[time_col] >= start) & (df[time_col] < end)]
+    mean, std = segment[column].mean(), segment[column].std()
+    return f"{mean:.3f} ± {std:.3f}" if pd.notna(mean) and pd.notna(std) else "N/A"
+
+
+def analyse(df, tmp_path, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = TimeFinder(df, dataname="rec.csv", output_dir=str(tmp_path), file_path="rec.csv").run_analysis(
+            plot_orig=False, user_confirmation=False, plot_after=False)
+        analysis = DropAnalysis(df, results["drop_times"], results["recovery_times"], dataname="rec.csv",
+                                output_dir=str(tmp_path), save_plots=False, **kwargs)
+        analysis.analyze_drops()
+    return analysis
+
+
+def test_mean_rounds_ties_like_pandas():
+    values = np.concatenate([np.ones(195), np.zeros(205), np.full(400, 2.0)])
+    mean, std, n = SegmentStats(np.arange(800.0), values).window_stats([0.0], [400.0])
+    assert mean[0, 0] == pd.Series(values[:400]).mean()
+    assert f"{mean[0, 0]:.3f}" == "0.487"
+
+
+@pytest.mark.parametrize("source, window_before", [("example", 30), ("example", 200)]
+                         + [(seed, window_before) for seed in range(4) for window_before in (30, 200)])
+def test_csv_matches_pandas_windows(tmp_path, source, window_before):
+    if source == "example":
+        df = pd.read_csv(EXAMPLE_INPUT)
+    else:
+        # 2 Hz: 400-sample windows, where rounding ties of integer-count means are common
+        df = generate_recording(duration=2400, sampling_rate=2.0, n_units=12, n_drops=6, failures=(2,), seed=source)
+    analysis = analyse(df, tmp_path, window_before=window_before)
+    table = pd.read_csv(os.path.join(str(tmp_path), "rec", "analyzed_rec.csv"), encoding="utf-8-sig", dtype=str,
+                        keep_default_na=False)
+
+    for i, (basal_start, drop_time, response_time, full_recovery_time, after_start, after_end) in enumerate(
+            analysis.drop_intervals):
+        during = (None, None) if analysis.recovery_failures[i] else (response_time, full_recovery_time)
+        for neuron in analysis.neuron_columns:
+            freq = analysis.frequency_columns.get(neuron)
+            for suffix, (start, end) in ((" - Basal Period", (basal_start, drop_time)), (" - During", during),
+                                         (" - After Resolution", (after_start, after_end))):
+                assert table.loc[i, neuron + suffix] == pandas_cell(df, "Time", neuron, start, end)
+                if freq is not None:
+                    assert table.loc[i, neuron + suffix + " Freq"] == pandas_cell(df, "Time", freq, start, end)
+
+
+def test_columns_with_missing_values_across_build_batches():
+    rng = np.random.default_rng(0)
+    n_rows, n_cols = 300, 2 * 256 + 7  # Three build batches
+    values = rng.poisson(1.5, (n_rows, n_cols)).astype(float)
+    for col in (3, 300, 515):
+        values[rng.random(n_rows) < 0.2, col] = np.nan
+    time_values = np.sort(rng.uniform(0, 100, n_rows))
+    stats = SegmentStats(time_values, values)
+    assert list(stats._count_columns) == [3, 300, 515]
+
+    starts = rng.uniform(-10, 100, 25)
+    ends = starts + rng.uniform(0, 40, 25)
+    mean, std, n = stats.window_stats(starts, ends)
+    sums, sum_n = stats.window_sums(starts, ends)
+    frame = pd.DataFrame(values)
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        segment = frame[(time_values >= start) & (time_values < end)]
+        assert np.array_equal(n[i], segment.count().to_numpy()) and np.array_equal(sum_n[i], n[i])
+        assert np.allclose(mean[i], segment.mean().to_numpy(), equal_nan=True)
+        assert np.allclose(std[i], segment.std().to_numpy(), equal_nan=True)
+        assert np.allclose(sums[i], segment.sum().to_numpy())
@@ -0,0 +1,112 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from drop_analysis import DropAnalysis
+from spike_times import SpikeTrains, spike_window_stats
+from synthetic_data import generate_recording
+from time_finder import TimeFinder
+
+
+def naive_bin(times_by_unit, edges):
+    """Counts and mean 1 / ISI per bin and unit, one bin at a time."""
+    counts = np.zeros((len(edges) - 1, len(times_by_unit)), dtype=np.int64)
+    frequencies = np.zeros(counts.shape)
+    for j, times in enumerate(times_by_unit):
+        times = np.sort(np.asarray(times, dtype=float))
+        for i in range(len(edges) - 1):
+            inside = np.flatnonzero((times >= edges[i]) & (times < edges[i + 1]))
+            counts[i, j] = len(inside)
+            rates = [1.0 / (times[k] - times[k - 1]) for k in inside if k > 0 and times[k] > times[k - 1]]
+            frequencies[i, j] = np.mean(rates) if rates else 0.0
+    return counts, frequencies
+
+
+def spike_times(seed):
+    rng = np.random.default_rng(seed)
+    return {
+        "sorted": np.sort(rng.uniform(0, 100, 300)),
+        "unsorted": rng.uniform(-5, 105, 200),
+        "empty": np.empty(0),
+        "repeated": np.repeat(np.sort(rng.uniform(0, 100, 40)), rng.integers(1, 4, 40)),  # Zero ISIs
+        "on-edges": np.arange(0.0, 100.0, 2.5),
+        "single": np.array([50.0]),
+    }
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+@pytest.mark.parametrize("edges", [np.arange(0, 101, 1.0), np.arange(0, 101, 7.3), np.array([10.0, 10.0, 20.0]),
+                                   np.array([-20.0, 200.0])])
+def test_bin_matches_naive_loop(seed, edges):
+    spikes = spike_times(seed)
+    trains = SpikeTrains(list(spikes), list(spikes.values()))
+    counts, frequencies = trains.bin(edges)
+    expected_counts, expected_frequencies = naive_bin(list(spikes.values()), edges)
+    assert np.array_equal(counts, expected_counts)
+    assert np.allclose(frequencies, expected_frequencies, rtol=1e-6)
+
+    window_counts = trains.window_counts(edges[:-1], edges[1:])
+    assert np.array_equal(window_counts, expected_counts)
+
+
+def test_bin_rejects_descending_edges():
+    with pytest.raises(ValueError, match="ascending"):
+        SpikeTrains(["a"], [[1.0]]).bin([2.0, 1.0])
+
+
+def spiking_recording(seed=0):
+    """A synthetic temperature trace and spike times whose rate rises while the temperature is below baseline."""
+    trace = generate_recording(duration=1200, n_units=0, n_drops=5, failures=(2,), seed=seed)
+    time_values, temp_values = trace["Time"].to_numpy(), trace["Temp"].to_numpy()
+    rng = np.random.default_rng(seed)
+    cooling = np.clip(26.0 - temp_values, 0.0, None)
+    spikes = []
+    for gain in (0.0, 0.5, 2.0):
+        counts = rng.poisson(0.3 + gain * cooling)
+        spikes.append(np.repeat(time_values, counts) + rng.uniform(0, 1, counts.sum()))
+    return time_values, temp_values, SpikeTrains(["u0", "u1", "u2"], spikes)
+
+
+def analyse(df, output_dir):
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = TimeFinder(df, dataname="spikes.csv", output_dir=str(output_dir), file_path="spikes.csv").run_analysis(
+            plot_orig=False, user_confirmation=False, plot_after=False)
+    return results, DropAnalysis(df, results["drop_times"], results["recovery_times"], dataname="spikes.csv",
+                                 output_dir=str(output_dir), save_plots=False)
+
+
+def test_binned_recording_round_trip(tmp_path):
+    time_values, temp_values, trains = spiking_recording()
+    df = trains.to_frame(time_values, temp_values)
+    assert list(df.columns) == ["Time", "Temp", "u0", "u1", "u2", "f-u0", "f-u1", "f-u2"]
+    assert np.array_equal(df["Time"], time_values) and np.array_equal(df["Temp"], temp_values)
+    counts, _ = naive_bin([trains.unit_times(unit) for unit in trains.units], np.append(time_values, time_values[-1] + 1))
+    assert np.array_equal(df[trains.units].to_numpy(), counts)
+
+    # The binned recording gives the drops of its temperature trace alone
+    results, analysis = analyse(df, tmp_path)
+    trace_results, _ = analyse(df[["Time", "Temp"]], tmp_path)
+    assert results["drop_times"] == trace_results["drop_times"] and len(results["drop_times"]) == 5
+    assert results["recovery_times"] == trace_results["recovery_times"]
+
+    # Windows start and end on sample times, i.e. on bin edges: spike counts equal the binned counts
+    stats = spike_window_stats(analysis, trains)
+    windows = analysis.window_bounds(*analysis.analysed_intervals())
+    sums, _ = analysis.segment_stats.window_sums(windows[..., 0], windows[..., 1])
+    column_index = [analysis.stat_columns.index(unit) for unit in trains.units]
+    binned = np.where(np.isnan(windows[..., :1]), np.nan, sums[..., column_index])
+    assert np.isnan(stats["spikes"]).any()  # The failed drop has no during window
+    assert np.array_equal(stats["spikes"].to_numpy(), binned.ravel(), equal_nan=True)
+    assert np.allclose(stats["rate"], stats["spikes"] / (stats["end"] - stats["start"]), equal_nan=True)
+
+
+def test_rebinned_recording_counts_every_spike():
+    time_values, temp_values, trains = spiking_recording(seed=1)
+    df = trains.to_frame(time_values, temp_values, width=0.25)
+    edges = np.append(df["Time"].to_numpy(), df["Time"].iloc[-1] + 0.25)
+    counts, frequencies = naive_bin([trains.unit_times(unit) for unit in trains.units], edges)
+    assert np.array_equal(df[trains.units].to_numpy(), counts)
+    assert np.allclose(df[[f"f-{unit}" for unit in trains.units]].to_numpy(), frequencies, rtol=1e-6)
+    assert df[trains.units].to_numpy().sum() == len(trains)
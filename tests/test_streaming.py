@@ -0,0 +1,77 @@
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from columnar import write_frame
+from conftest import EXAMPLE_INPUT
+from drop_analysis import DropAnalysis
+from streaming import run_streaming_analysis
+from synthetic_data import generate_recording
+from time_finder import TimeFinder
+
+
+def recordings():
+    yield "example", pd.read_csv(EXAMPLE_INPUT, encoding="utf-8-sig")
+    yield "failures", generate_recording(duration=1200, n_units=3, n_drops=6, failures=(1, 2), seed=9)
+    df = generate_recording(duration=900, n_units=2, n_drops=4, noise=0.05, seed=11)
+    df["Time"] = np.cumsum(np.random.default_rng(1).uniform(0.5, 1.5, len(df))).round(3)  # Non-uniform sampling
+    yield "non-uniform", df
+
+
+RECORDINGS = list(recordings())
+
+
+def split_cluster_chunksize(df):
+    """A chunk size whose first chunk ends inside a multi-sample candidate cluster of the in-memory detector."""
+    temp, time_values = df["Temp"].to_numpy(dtype=float), df["Time"].to_numpy(dtype=float)
+    candidates = np.flatnonzero(np.gradient(temp, time_values) < -1)
+    for first, second in zip(candidates[:-1], candidates[1:]):
+        if second - first <= 5:  # Same cluster (default neighbor_threshold)
+            return int(second)
+    raise AssertionError("no multi-sample candidate cluster")
+
+
+def in_memory(df, output_dir):
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = TimeFinder(df, dataname="rec.csv", output_dir=output_dir, file_path="rec.csv").run_analysis(
+            plot_orig=False, user_confirmation=False, plot_after=False)
+        analysis = DropAnalysis(df, results["drop_times"], results["recovery_times"], dataname="rec.csv",
+                                output_dir=output_dir, save_plots=False)
+        analysis.analyze_drops()
+    return results, analysis
+
+
+@pytest.mark.parametrize("name, df", RECORDINGS, ids=[r[0] for r in RECORDINGS])
+@pytest.mark.parametrize("chunking", ["one", "prime", "split-cluster", "whole-file"])
+@pytest.mark.parametrize("suffix", [".csv", ".cncol"])
+def test_streaming_matches_in_memory(tmp_path, name, df, chunking, suffix):
+    source = str(tmp_path / f"rec{suffix}")
+    df.to_csv(tmp_path / "rec.csv", index=False)
+    df = pd.read_csv(tmp_path / "rec.csv")  # The values the stream reads
+    if suffix == ".cncol":
+        write_frame(source, df)
+    chunksize = {"one": 1, "prime": 13, "split-cluster": split_cluster_chunksize(df), "whole-file": 10 * len(df)}[chunking]
+
+    expected, analysis = in_memory(df, str(tmp_path / "memory"))
+    with contextlib.redirect_stdout(io.StringIO()):
+        results, streamed = run_streaming_analysis(source, output_dir=str(tmp_path / "stream"), dataname="rec.csv",
+                                                   chunksize=chunksize)
+
+    assert expected["drop_times"]
+    assert results["drop_times"] == expected["drop_times"]
+    assert results["recovery_times"] == expected["recovery_times"]
+    assert streamed.drop_intervals == analysis.drop_intervals
+    assert streamed.recovery_failures == analysis.recovery_failures
+
+    mean, std, n = streamed.window_stats_matrix(streamed.drop_intervals, streamed.recovery_failures)
+    expected_mean, expected_std, expected_n = analysis.window_stats_matrix(analysis.drop_intervals, analysis.recovery_failures)
+    assert np.array_equal(n, expected_n)
+    assert np.allclose(mean, expected_mean, equal_nan=True)
+    assert np.allclose(std, expected_std, equal_nan=True)
+
+    for filename in ("analyzed_rec.csv", "failure_rec.csv"):
+        pd.testing.assert_frame_equal(pd.read_csv(tmp_path / "stream" / "rec" / filename),
+                                      pd.read_csv(tmp_path / "memory" / "rec" / filename))
@@ -0,0 +1,81 @@
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from time_finder import TimeFinder
+from time_index import TimeIndex
+
+
+UNIFORM = TimeIndex(np.arange(0.0, 10.0, 0.5))
+NON_UNIFORM = TimeIndex([0.0, 1.0, 2.0, 2.1, 2.2, 5.0, 5.3, 9.0])  # Median interval 1.0
+
+
+@pytest.mark.parametrize("time, nearest", [(0.24, 0), (0.25, 0), (0.26, 1), (3.7, 7), (-3.0, 0), (20.0, 19)])
+def test_nearest_between_samples(time, nearest):
+    assert UNIFORM.nearest(time) == nearest
+    assert UNIFORM.nearest([time, 1.0]).tolist() == [nearest, 2]
+
+
+def test_find_between_samples():
+    assert UNIFORM.find([0.24, 0.25, 0.26, 9.5, 9.76, -0.25, -0.26]).tolist() == [0, 0, 1, 19, -1, 0, -1]
+    assert UNIFORM.find(0.4, tolerance=0.05).tolist() == -1
+    assert UNIFORM.values_at(np.arange(20) * 10.0, [0.74, 30.0]).tolist()[0] == 10.0
+    assert np.isnan(UNIFORM.values_at(np.arange(20) * 10.0, [30.0])[0])
+
+
+def test_bounds_between_samples():
+    lo, hi = UNIFORM.bounds([0.25, 1.0, 3.0], [1.0, 1.1, 2.0])
+    assert lo.tolist() == [1, 2, 6] and hi.tolist() == [2, 3, 4]
+
+
+def test_snap_out_of_range():
+    assert UNIFORM.snap([0.3, 9.9, -0.4]).tolist() == [0.5, 9.5, 0.0]
+    with pytest.raises(ValueError, match="No sample within 0.5 of time"):
+        UNIFORM.snap(10.1)
+    with pytest.raises(ValueError, match=r"time\(s\) -1, 12 \(recording spans 0 to 9.5\)"):
+        UNIFORM.snap([1.0, -1.0, 12.0])
+    with pytest.raises(ValueError):
+        UNIFORM.snap(3.3, tolerance=0.1)
+
+
+def test_tolerance_defaults_on_non_uniform_sampling():
+    assert NON_UNIFORM.interval == 1.0
+    # find: half the median interval, even where samples are denser or sparser
+    assert NON_UNIFORM.find([2.04, 2.16, 1.4, 3.0, 7.0]).tolist() == [2, 4, 1, -1, -1]
+    # snap: one median interval
+    assert NON_UNIFORM.snap([3.0, 5.9]).tolist() == [2.2, 5.3]
+    with pytest.raises(ValueError, match="No sample within 1 of time"):
+        NON_UNIFORM.snap(7.0)
+
+
+def test_invalid_and_short_recordings():
+    with pytest.raises(ValueError, match="ascending"):
+        TimeIndex([0.0, 2.0, 1.0])
+    assert TimeIndex([4.0]).interval == 0.0 and TimeIndex([4.0]).nearest([1.0, 9.0]).tolist() == [0, 0]
+    empty = TimeIndex([])
+    assert empty.find([1.0]).tolist() == [-1] and np.isnan(empty.start)
+    with pytest.raises(ValueError, match="no samples"):
+        empty.nearest(1.0)
+
+
+def test_snap_edits(tmp_path):
+    df = pd.DataFrame({"Time": np.arange(0.0, 100.0, 2.0), "Temp": 26.0})
+    with contextlib.redirect_stdout(io.StringIO()):
+        tool = TimeFinder(df, dataname="rec.csv", output_dir=str(tmp_path), file_path="rec.csv")
+    points = [10.0, 40.0]
+
+    assert tool.snap_edits([("add", 21.1), ("remove", 38.5), ("add", 98.9)], points) == [
+        ("add", 22.0), ("remove", 40.0), ("add", 98.0)]
+    # A removal can target a point added by an earlier edit
+    assert tool.snap_edits([("add", 60.4), ("remove", 61.0)], points) == [("add", 60.0), ("remove", 60.0)]
+
+    # No detected point within one interval (2 s) of the removed time
+    with pytest.raises(ValueError, match="No detected point within 2 of 25"):
+        tool.snap_edits([("remove", 25.0)], points)
+    with pytest.raises(ValueError, match="No detected point"):
+        tool.snap_edits([("remove", 10.0), ("remove", 11.0)], points)  # Already removed
+    with pytest.raises(ValueError, match="No sample within 2"):
+        tool.snap_edits([("add", 105.0)], points)
@@ -0,0 +1,79 @@
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from columnar import read_frame
+from drop_analysis import DropAnalysis
+from synthetic_data import generate_recording
+from time_finder import TimeFinder
+
+
+def detected_recording(output_dir):
+    df = generate_recording(duration=900, n_units=3, n_drops=10, failures=(3,), seed=4)
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = TimeFinder(df, dataname="rec.csv", output_dir=str(output_dir), file_path="rec.csv").run_analysis(
+            plot_orig=False, user_confirmation=False, plot_after=False)
+    return df, results["drop_times"], results["recovery_times"]
+
+
+def analyse(df, drop_times, recovery_times, output_dir, force):
+    analysis = DropAnalysis(df, drop_times, recovery_times, dataname="rec.csv", output_dir=str(output_dir),
+                            save_plots=False, force_basal_computation=force)
+    with contextlib.redirect_stdout(io.StringIO()):
+        analysis.analyze_drops()
+    return analysis
+
+
+def assert_same_analysis(edited, fresh, edited_dir, fresh_dir):
+    assert edited.drop_intervals == fresh.drop_intervals
+    assert edited.recovery_failures == fresh.recovery_failures
+    for matrix, expected in zip(edited.window_stats_matrix(edited.drop_intervals, edited.recovery_failures),
+                                fresh.window_stats_matrix(fresh.drop_intervals, fresh.recovery_failures)):
+        assert np.allclose(matrix, expected, equal_nan=True)
+    pd.testing.assert_frame_equal(edited.numeric_results, fresh.numeric_results)
+    for filename in ("analyzed_rec.csv", "failure_rec.csv"):
+        pd.testing.assert_frame_equal(pd.read_csv(edited_dir / "rec" / filename), pd.read_csv(fresh_dir / "rec" / filename))
+    pd.testing.assert_frame_equal(read_frame(str(edited_dir / "rec" / "results_rec.cncol"), mmap=False),
+                                  read_frame(str(fresh_dir / "rec" / "results_rec.cncol"), mmap=False))
+
+
+@pytest.mark.parametrize("force", [False, True])
+def test_update_drops_matches_fresh_analysis(tmp_path, force):
+    df, drop_times, recovery_times = detected_recording(tmp_path / "detection")
+    edited_dir = tmp_path / "edited"
+    analysis = analyse(df, drop_times, recovery_times, edited_dir, force)
+    before = analysis.compute_drop_windows()
+
+    def check(drops, recoveries, step):
+        with contextlib.redirect_stdout(io.StringIO()):
+            recomputed = analysis.update_drops(drops, recoveries)
+        fresh_dir = tmp_path / f"fresh-{step}"
+        assert_same_analysis(analysis, analyse(df, drops, recoveries, fresh_dir, force), edited_dir, fresh_dir)
+        return recomputed
+
+    # **Edit: drop 8 moves earlier and recovers fully earlier, which moves drop 9's basal window**
+    drops, recoveries = list(drop_times), list(recovery_times)
+    drops[8] -= 20
+    recomputed = check(drops, recoveries, "edit")
+    after = analysis.compute_drop_windows()
+    assert after[8]["full_recovery_time"] != before[8]["full_recovery_time"]
+    if not force:
+        assert after[9]["basal_start"] != before[9]["basal_start"]
+        assert recomputed == [7, 8, 9]  # Drop 7's recovery search ends at the moved drop
+    else:
+        assert recomputed == [7, 8]
+
+    # **Add a drop between two detected ones**
+    drops.insert(1, 95.0)
+    recoveries.insert(1, 100.0)
+    check(drops, recoveries, "add")
+
+    # **Remove a drop (the recovery failure)**
+    del drops[4], recoveries[4]
+    check(drops, recoveries, "remove")
+
+    # **Restore the detected drops**
+    check(list(drop_times), list(recovery_times), "restore")
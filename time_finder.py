@@ -1,8 +1,13 @@
-import pandas as pd
-import numpy as np
 import matplotlib.pyplot as plt
 import os
 
+from detection_cache import apply_corrections
+from detectors import DerivativeDetector, event_polarities
+from instrumentation import get_profiler
+from plot_rendering import PLOT_DPI, figure_pixels, minmax_decimate
+from time_index import TimeIndex
+
+
 class TimeFinder:
     """
     Identifies temperature drops in time-series data and allows for manual review and correction.
@@ -10,8 +15,24 @@ class TimeFinder:
 
     def __init__(self, data, dataname='default_name', output_dir='data_out', file_path='path', time_col="Time", temp_col="Temp",
                  detect_hot_points=False, neighbor_threshold=5, preced_window=30, 
-                 drop_factor=1.5, deriv_thresh=1):
-        
+                 drop_factor=1.5, deriv_thresh=1, detection_cache=None, profiler=None, reviewer=None, show_plots=True,
+                 detector=None, bidirectional=False):
+        """
+        `detection_cache` (a DetectionCache) stores detected drops and manual
+        corrections per recording and detection parameters so reruns replay them.
+        Stage timings go to `profiler` (default: the shared profiler).
+
+        `reviewer` replaces the terminal correction prompt: it is called with this
+        TimeFinder and returns the operator's edits as {"Drop Start": [(action, time), ...],
+        "Recovery": [...]}. With `show_plots=False` plots are saved but never shown,
+        so the analysis can run off the main thread (e.g. from the GUI).
+
+        `detector` (a DropDetector from `detectors.py`) replaces the default
+        raw-derivative detection built from the hyperparameters above. With
+        `bidirectional`, the default detector finds cold drops and hot peaks in
+        one pass; pass `polarity` to DropAnalysis to analyse both kinds.
+        """
+
         self.file_path = file_path
         self.df = data
 
@@ -26,12 +47,21 @@ class TimeFinder:
         self.detect_hot_points = detect_hot_points
         self.drop_points = []
         self.recovery_points = []
+        self.detection_cache = detection_cache
+        self.corrections = {"Drop Start": [], "Recovery": []}
+        self.profiler = profiler or get_profiler()
+        self.reviewer = reviewer
+        self.show_plots = show_plots
 
         # Hyperparameters
         self.neighbor_threshold = neighbor_threshold  
         self.preceding_window = preced_window    
         self.drop_threshold_factor = drop_factor 
         self.derivative_threshold = deriv_thresh if detect_hot_points else -1 * deriv_thresh
+        self.detector = detector or DerivativeDetector(deriv_thresh, neighbor_threshold, preced_window, drop_factor, detect_hot_points,
+                                                       bidirectional)
+        self.detection_report = None
+        self._time_index = None
 
         # Output filenames
         self.base_filename = os.path.splitext(os.path.basename(file_path))[0]
@@ -47,74 +77,106 @@ class TimeFinder:
             os.makedirs(os.path.join(self.output_dir, self.dataname))
         self.save_dir = os.path.join(self.output_dir, self.dataname)
 
+    @property
+    def time_index(self):
+        """Binary-search index of the recording's sample times, built on first use."""
+        if self._time_index is None:
+            self._time_index = TimeIndex(self.df[self.time_col].to_numpy(dtype=float))
+        return self._time_index
+
+    def snap_edits(self, edits, points):
+        """
+        Moves (action, time) edits onto real samples: an added time becomes the
+        nearest sample time, a removed time the nearest of `points` within one
+        sampling interval. ValueError if there is no such sample or point.
+        """
+        snapped = []
+        for action, value in edits:
+            if action == "add":
+                value = float(self.time_index.snap(value))
+                points = points + [value]
+            elif action == "remove":
+                nearest = min(points, key=lambda p: abs(p - value), default=None)
+                if nearest is None or abs(nearest - value) > self.time_index.interval:
+                    raise ValueError(f"No detected point within {self.time_index.interval:g} of {value:g}.")
+                value = float(nearest)
+                points = [p for p in points if p != value]
+            snapped.append((action, value))
+        return snapped
+
+    @property
+    def polarity(self):
+        """Stimulus type the detector looks for: "cold", "hot" or "both" (DropAnalysis's `polarity`)."""
+        if getattr(self.detector, "bidirectional", False):
+            return "both"
+        return "hot" if getattr(self.detector, "detect_hot_points", self.detect_hot_points) else "cold"
+
+    def event_polarities(self):
+        """Polarity of every (drop, recovery) pair: always the detector's direction unless it looks for both."""
+        n_events = min(len(self.drop_points), len(self.recovery_points))
+        if self.polarity != "both":
+            return [self.polarity] * n_events
+        return list(event_polarities(self.df[self.time_col].to_numpy(dtype=float), self.df[self.temp_col].to_numpy(dtype=float),
+                                     self.drop_points[:n_events], self.recovery_points[:n_events]))
+
+    def detection_params(self):
+        """Parameters that determine the detected drops (the detection cache key)."""
+        params = {"time_col": self.time_col, "temp_col": self.temp_col, **self.detector.params()}
+        if self.detector.name != DerivativeDetector.name:
+            params["detector"] = self.detector.name  # Default-detector keys stay as before, so earlier entries still match
+        return params
+
     def detect_drops(self, user_confirmation, plot_after):
         """Detects temperature drops and identifies recovery points."""
-        temp_series = self.df[self.temp_col].values
-        time_series = self.df[self.time_col].values
+        use_cache = self.detection_cache is not None and os.path.isfile(self.file_path)
+        with self.profiler.stage("detection_cache"):
+            cached = self.detection_cache.load(self.file_path, self.detection_params()) if use_cache else None
 
-        # Compute first derivative
-        dT_dt = np.gradient(temp_series, time_series)
-
-        # Identify potential drop points (or hot peaks)
-        drop_candidates = np.where(dT_dt > self.derivative_threshold)[0] if self.detect_hot_points else np.where(dT_dt < self.derivative_threshold)[0]
-
-        if len(drop_candidates) == 0:
+        if cached is not None and cached["drop_times"] is None:
             print("No drops detected!")
             return
-
-        # Cluster drop points
-        clusters = []
-        current_cluster = [drop_candidates[0]]
-
-        for i in range(1, len(drop_candidates)):
-            if drop_candidates[i] - drop_candidates[i - 1] <= self.neighbor_threshold:
-                current_cluster.append(drop_candidates[i])
-            else:
-                clusters.append(current_cluster)
-                current_cluster = [drop_candidates[i]]
-        clusters.append(current_cluster)  # Append last cluster
-
-        # Identify refined drop points and recoveries
-        refined_drops = []
-        recoveries = []
-
-        for cluster in clusters:
-            if not cluster:
-                continue
-
-            # Define preceding region for baseline calculation
-            start_index = max(0, cluster[0] - self.preceding_window)
-            preceding_values = temp_series[start_index:cluster[0]]
-
-            # Compute baseline fluctuation
-            baseline_fluctuation = np.mean(np.abs(np.diff(preceding_values)))
-
-            # Find the first point in the cluster where the drop is significant
-            drop_index = None
-            for idx in cluster:
-                if abs(dT_dt[idx]) > self.drop_threshold_factor * baseline_fluctuation:
-                    refined_drops.append(idx - 1)  # FIXED: Correcting off-by-one error
-                    drop_index = idx
-                    break  # Stop after first significant drop
-
-            # Identify recovery: Find where derivative flips sign
-            if drop_index is not None:
-                for idx in range(drop_index + 1, len(dT_dt) - 1):
-                    if (dT_dt[idx] > 0 and not self.detect_hot_points) or (dT_dt[idx] < 0 and self.detect_hot_points):
-                        recoveries.append(idx - 1)  # FIXED: Correcting off-by-one error
-                        break  # Stop at first recovery point
-
-        # Store results in time values
-        self.drop_points = list(time_series[refined_drops]) if refined_drops else []
-        self.recovery_points = list(time_series[recoveries]) if recoveries else []
+        elif cached is not None:
+            # **Replay the stored detection and manual corrections**
+            detected_drops, detected_recoveries = cached["drop_times"], cached["recovery_times"]
+            self.corrections = {label: [tuple(edit) for edit in edits] for label, edits in cached["corrections"].items()}
+            self.drop_points = apply_corrections(detected_drops, self.corrections["Drop Start"])
+            self.recovery_points = apply_corrections(detected_recoveries, self.corrections["Recovery"])
+            print(f"Loaded {len(self.drop_points)} drops from the detection cache.")
+        else:
+            temp_series = self.df[self.temp_col].values
+            time_series = self.df[self.time_col].values
+
+            with self.profiler.stage("drop_detection", detail=self.detector.name):
+                refined_drops, recoveries = self.detector.detect(time_series, temp_series)
+            self.detection_report = self.detector.report
+            report = self.detection_report
+            print(f"{report['detector']} detector: {report['drops']} drops from {report['candidates']} candidates in {report['runtime_s']:.3f}s.")
+
+            if refined_drops is None:
+                print("No drops detected!")
+                if use_cache:
+                    self.detection_cache.save(self.file_path, self.detection_params(), None, None, self.corrections)
+                return
+
+            # Store results in time values
+            self.drop_points = list(time_series[refined_drops]) if len(refined_drops) else []
+            self.recovery_points = list(time_series[recoveries]) if len(recoveries) else []
+            detected_drops, detected_recoveries = list(self.drop_points), list(self.recovery_points)
 
         # **PLOT DETECTED DROPS BEFORE ASKING FOR MANUAL CORRECTION**
         if user_confirmation:
             self.plot_results(self.detected_plot, show=True)
 
-            # **Apply manual correction**
-            self.drop_points = self.manual_correction(self.drop_points, "Drop Start")
-            self.recovery_points = self.manual_correction(self.recovery_points, "Recovery")
+            # **Apply manual correction** (timed separately: it includes waiting for the user)
+            with self.profiler.stage("manual_correction"):
+                if self.reviewer is not None:
+                    self.apply_review(self.reviewer(self))
+                else:
+                    self.drop_points = self.manual_correction(self.drop_points, "Drop Start")
+                    self.recovery_points = self.manual_correction(self.recovery_points, "Recovery")
+
+        if use_cache:
+            self.detection_cache.save(self.file_path, self.detection_params(), detected_drops, detected_recoveries, self.corrections)
 
         if plot_after:
         # **Replot modified points**
@@ -130,10 +192,15 @@ class TimeFinder:
                 action, value = correction.split()
                 value = float(value)
 
-                if action == "add":
-                    points.append(value)
-                elif action == "remove":
-                    points = [p for p in points if p != value]
+                if action in ("add", "remove"):
+                    # Typed times snap to the nearest sample (add) or detected point (remove)
+                    try:
+                        [(action, value)] = self.snap_edits([(action, value)], points)
+                    except ValueError as e:
+                        print(e)
+                    else:
+                        points = points + [value] if action == "add" else [p for p in points if p != value]
+                        self.corrections[label].append((action, value))
                 else:
                     print("Invalid command. Use 'add `time`' or 'remove `time`'.")
             except:
@@ -144,17 +211,46 @@ class TimeFinder:
 
         return sorted(points)  # Ensure points remain in time order
 
+    def apply_review(self, edits):
+        """Applies and records the (action, time) edits a `reviewer` returned for each label."""
+        drop_edits = self.snap_edits([tuple(edit) for edit in edits.get("Drop Start", [])], self.drop_points)
+        recovery_edits = self.snap_edits([tuple(edit) for edit in edits.get("Recovery", [])], self.recovery_points)
+        self.corrections["Drop Start"].extend(drop_edits)
+        self.corrections["Recovery"].extend(recovery_edits)
+        self.drop_points = apply_corrections(self.drop_points, drop_edits)
+        self.recovery_points = apply_corrections(self.recovery_points, recovery_edits)
+
     def plot_results(self, savepath, show=False):
         """Plots detected drop/recovery points and saves the figure."""
-        plt.figure(figsize=(10, 5))
-        plt.plot(self.df[self.time_col], self.df[self.temp_col], marker='o', linestyle='-', alpha=0.6, label='Temperature')
-
-        if len(self.drop_points) > 0:
-            plt.scatter(self.drop_points, self.df.loc[self.df[self.time_col].isin(self.drop_points), self.temp_col], 
+        with self.profiler.stage("detection_plot", detail=savepath):
+            self._plot_results(savepath, show and self.show_plots)
+
+    def _plot_results(self, savepath, show):
+        fig = plt.figure(figsize=(10, 5))
+        time_values = self.df[self.time_col].to_numpy(dtype=float)
+        temp_values = self.df[self.temp_col].to_numpy(dtype=float)
+        n_bins = figure_pixels(fig)
+        if len(time_values) > 2 * n_bins:
+            # Long recording: min/max per pixel column, without a marker on every sample
+            plt.plot(*minmax_decimate(time_values, temp_values, n_bins), linestyle='-', alpha=0.6, label='Temperature')
+        else:
+            plt.plot(time_values, temp_values, marker='o', linestyle='-', alpha=0.6, label='Temperature')
+
+        if len(self.drop_points) > 0 and self.polarity == "both":
+            # Hot events (heat peaks) in their own colour; unpaired drops count as cold
+            labels = self.event_polarities()
+            hot_points = [t for t, label in zip(self.drop_points, labels) if label == "hot"]
+            cold_points = [t for t in self.drop_points if t not in set(hot_points)]
+            plt.scatter(cold_points, temp_values[self.time_index.nearest(cold_points)],
+                        color='red', label='Drop Start', zorder=3)
+            plt.scatter(hot_points, temp_values[self.time_index.nearest(hot_points)],
+                        color='darkorange', label='Hot Start', zorder=3)
+        elif len(self.drop_points) > 0:
+            plt.scatter(self.drop_points, temp_values[self.time_index.nearest(self.drop_points)],
                         color='red', label='Drop Start', zorder=3)
 
         if len(self.recovery_points) > 0:
-            plt.scatter(self.recovery_points, self.df.loc[self.df[self.time_col].isin(self.recovery_points), self.temp_col], 
+            plt.scatter(self.recovery_points, temp_values[self.time_index.nearest(self.recovery_points)],
                         color='green', label='Recovery', zorder=3)
 
         plt.xlabel("Time")
@@ -162,7 +258,7 @@ class TimeFinder:
         plt.title("Temperature Drop & Recovery Detection")
         plt.legend()
         plt.grid(True)
-        plt.savefig(os.path.join(self.save_dir, savepath), dpi=300)
+        plt.savefig(os.path.join(self.save_dir, savepath), dpi=PLOT_DPI)
 
         if show:
             plt.show()
@@ -182,5 +278,7 @@ class TimeFinder:
         return {
             "num_drops": len(self.drop_points),
             "drop_times": self.drop_points,
-            "recovery_times": self.recovery_points
+            "recovery_times": self.recovery_points,
+            "polarity": self.polarity,
+            "polarities": self.event_polarities(),
         }
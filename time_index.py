@@ -0,0 +1,84 @@
+import numpy as np
+
+
+class TimeIndex:
+    """
+    Sorted sample times of one recording, answering point and range queries by binary search.
+
+    Built once per recording, it replaces full-column scans and exact float
+    comparisons (`df[time] == t`, `df[time].isin(points)`): every query is
+    O(log n) per time asked. The default `tolerance` of point lookups is half the
+    median sampling interval, so a time matches the sample it is closest to but
+    never a neighbouring one.
+    """
+
+    def __init__(self, time_values):
+        self.times = np.asarray(time_values, dtype=float)
+        if self.times.ndim != 1:
+            raise ValueError("Time values must be one-dimensional.")
+        if len(self.times) > 1 and np.any(self.times[1:] < self.times[:-1]):
+            raise ValueError("Time values must be in ascending order.")
+        self._interval = None
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def start(self):
+        return self.times[0] if len(self.times) else np.nan
+
+    @property
+    def end(self):
+        return self.times[-1] if len(self.times) else np.nan
+
+    @property
+    def interval(self):
+        """Median sampling interval (0 for fewer than two samples), computed once."""
+        if self._interval is None:
+            self._interval = float(np.median(np.diff(self.times))) if len(self.times) > 1 else 0.0
+        return self._interval
+
+    def bounds(self, starts, ends):
+        """Sample index ranges [lo, hi) of the [start, end) time windows."""
+        return (np.searchsorted(self.times, np.asarray(starts, dtype=float), side="left"),
+                np.searchsorted(self.times, np.asarray(ends, dtype=float), side="left"))
+
+    def nearest(self, times):
+        """Index of the sample closest to each time (the earlier one on a tie)."""
+        times = np.asarray(times, dtype=float)
+        if len(self.times) == 0:
+            raise ValueError("The recording has no samples.")
+        right = np.clip(np.searchsorted(self.times, times, side="left"), 1, max(len(self.times) - 1, 1))
+        left = right - 1
+        if len(self.times) == 1:
+            return np.zeros(times.shape, dtype=np.int64)
+        return np.where(times - self.times[left] <= self.times[right] - times, left, right).astype(np.int64)
+
+    def find(self, times, tolerance=None):
+        """Index of the sample within `tolerance` (default: half the sampling interval) of each time, or -1 where there is none."""
+        times = np.asarray(times, dtype=float)
+        if len(self.times) == 0:
+            return np.full(times.shape, -1, dtype=np.int64)
+        tolerance = self.interval / 2 if tolerance is None else tolerance
+        index = self.nearest(times)
+        return np.where(np.abs(self.times[index] - times) <= tolerance, index, -1)
+
+    def snap(self, times, tolerance=None):
+        """
+        Sample times closest to `times`; ValueError for any time farther than
+        `tolerance` (default: one sampling interval) from every sample.
+        """
+        times = np.asarray(times, dtype=float)
+        tolerance = self.interval if tolerance is None else tolerance
+        index = self.find(times, tolerance)
+        if np.any(index < 0):
+            missing = np.atleast_1d(times)[np.atleast_1d(index) < 0]
+            raise ValueError(f"No sample within {tolerance:g} of time(s) {', '.join(f'{t:g}' for t in missing[:5])} "
+                             f"(recording spans {self.start:g} to {self.end:g}).")
+        return self.times[index]
+
+    def values_at(self, values, times, tolerance=None):
+        """`values` (one per sample) at the samples matching `times` (see `find`), NaN where no sample matches."""
+        index = self.find(times, tolerance)
+        values = np.asarray(values, dtype=float)
+        return np.where(index >= 0, values[np.maximum(index, 0)], np.nan)